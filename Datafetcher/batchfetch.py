@@ -0,0 +1,185 @@
+import os
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+HISTORY_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+
+# Max symbols per multi-symbol download request
+BATCH_DOWNLOAD_SIZE = int(os.environ.get('BATCH_DOWNLOAD_SIZE', '100'))
+# Symbols with no history at all are not asked for again until this many days pass
+EMPTY_RECHECK_DAYS = int(os.environ.get('EMPTY_RECHECK_DAYS', '7'))
+EMPTY_SYMBOLS_KEY = 'emptyHistorySymbols'
+
+
+# Download sources return a wide (symbol, field) frame holding the symbols they have an answer for:
+# a symbol with columns but no rows has no history in the range, a symbol left out could not be fetched.
+
+# Download source backed by yfinance's multi-symbol yf.download. A symbol that fails inside the download
+# comes back as all-NaN columns, the same as one with no history (e.g. delisted), so both are reported
+# as empty; the fetcher asks confirm_empty before remembering a symbol as having no history.
+class YFinanceDownloadProvider:
+    def __init__(self, suffix='.NS'):
+        self.suffix = suffix
+
+    # start=None asks for the full history; end is exclusive
+    def download(self, symbols, start, end):
+        import yfinance as yf
+
+        span = {'period': 'max'} if start is None else {'start': start.isoformat(), 'end': end.isoformat()}
+        wide = yf.download(
+            [symbol + self.suffix for symbol in symbols],
+            **span,
+            group_by='ticker',
+            actions=True,
+            auto_adjust=True,
+            ignore_tz=False,
+            threads=True,
+            progress=False,
+            multi_level_index=True,
+        )
+        if wide is None or wide.empty:
+            return pd.concat({symbol: empty_history() for symbol in symbols}, axis=1)
+        # Strip the exchange suffix so the top column level matches our symbols again
+        return wide.rename(columns=lambda name: name[:-len(self.suffix)] if name.endswith(self.suffix) else name, level=0)
+
+    # Per-ticker check that a symbol reported empty really has no history
+    def confirm_empty(self, symbol):
+        import yfinance as yf
+
+        return yf.Ticker(symbol + self.suffix).history(period='max').empty
+
+
+# Download source reading one <symbol>.csv per ticker from a local directory (offline runs and tests).
+# The fetcher clips rows to the requested range; a symbol without a file is reported as having no history.
+class FixtureProvider:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def download(self, symbols, start, end):
+        frames = {}
+        for symbol in symbols:
+            path = os.path.join(self.directory, f"{symbol}.csv")
+            if os.path.exists(path):
+                frames[symbol] = pd.read_csv(path, index_col=0, parse_dates=True)
+            else:
+                frames[symbol] = empty_history()
+        return pd.concat(frames, axis=1)
+
+    # A missing file is the whole answer
+    def confirm_empty(self, symbol):
+        return True
+
+
+# Function to build the frame of a symbol with no history
+def empty_history():
+    return pd.DataFrame(columns=HISTORY_COLUMNS, index=pd.DatetimeIndex([]))
+
+
+# Remembers symbols with no history at all; Redis-backed when a client is given, in-memory otherwise
+class EmptySymbolStore:
+    def __init__(self, redis_client=None, recheck_days=EMPTY_RECHECK_DAYS):
+        self.redis_client = redis_client
+        self.recheck_days = recheck_days
+        self.local = {}
+
+    def _checked_on(self, symbol):
+        if self.redis_client is not None:
+            value = self.redis_client.hget(EMPTY_SYMBOLS_KEY, symbol)
+            return datetime.fromisoformat(value).date() if value else None
+        return self.local.get(symbol)
+
+    def is_known_empty(self, symbol):
+        checked_on = self._checked_on(symbol)
+        return checked_on is not None and datetime.now().date() - checked_on < timedelta(days=self.recheck_days)
+
+    def mark_empty(self, symbol):
+        today = datetime.now().date()
+        if self.redis_client is not None:
+            self.redis_client.hset(EMPTY_SYMBOLS_KEY, symbol, today.isoformat())
+        else:
+            self.local[symbol] = today
+
+
+# Function to keep only the sessions in [start, end); providers may return more (e.g. a partial bar for today)
+def clip_to_range(frame, start, end):
+    if frame.empty:
+        return frame
+    days = frame.index.date
+    keep = days < end if start is None else (days >= start) & (days < end)
+    return frame[keep]
+
+
+# Function to pull one symbol's frame out of a wide (symbol, field) download, or None if the symbol is
+# not in it. Column selection on the wide frame does not copy it; only the symbol's own rows are materialized.
+def split_symbol_frame(wide, symbol):
+    if symbol not in wide.columns.get_level_values(0):
+        return None
+    frame = wide[symbol]
+    frame = frame.reindex(columns=[column for column in HISTORY_COLUMNS if column in frame.columns])
+    # The wide index is the union of all symbols' dates; drop the ones this symbol did not trade
+    return frame.dropna(how='all', subset=[column for column in ['Open', 'High', 'Low', 'Close'] if column in frame.columns])
+
+
+# Batch fetch layer: symbols missing the same range of sessions share one multi-symbol download.
+# Symbols with nothing stored yet get their full history; if the provider reports none and a per-ticker
+# check agrees they are remembered in the empty store. An empty range request just means no new sessions, so nothing is
+# escalated. Symbols whose download failed, or that the provider left out, come back as None.
+class BatchHistoryFetcher:
+    def __init__(self, provider=None, empty_store=None, batch_size=BATCH_DOWNLOAD_SIZE):
+        self.provider = provider or YFinanceDownloadProvider()
+        self.empty_store = empty_store or EmptySymbolStore()
+        self.batch_size = max(batch_size, 1)
+        self.requests_made = 0
+
+    def _download(self, symbols, start, end, throttle):
+        if throttle:
+            throttle()
+        self.requests_made += 1
+        try:
+            return self.provider.download(symbols, start, end)
+        except Exception as e:
+            print(f"Error downloading {len(symbols)} symbols from {start or 'listing'} to {end}: {e}")
+            return None
+
+    def _confirm_empty(self, symbol, throttle):
+        if throttle:
+            throttle()
+        self.requests_made += 1
+        try:
+            return self.provider.confirm_empty(symbol)
+        except Exception as e:
+            print(f"Error checking the history of {symbol}: {e}")
+            return False
+
+    # ranges maps symbol -> (start, end) as returned by tradingcalendar.missing_range;
+    # returns symbol -> history frame (empty if none, None if it could not be fetched so the caller
+    # fetches it on its own)
+    def fetch(self, ranges, throttle=None):
+        results = {}
+        by_range = {}
+        for symbol, (start, end) in ranges.items():
+            if self.empty_store.is_known_empty(symbol):
+                results[symbol] = pd.DataFrame()
+            else:
+                by_range.setdefault((start, end), []).append(symbol)
+
+        for (start, end), group in by_range.items():
+            for offset in range(0, len(group), self.batch_size):
+                chunk = group[offset:offset + self.batch_size]
+                wide = self._download(chunk, start, end, throttle)
+                for symbol in chunk:
+                    frame = None if wide is None else split_symbol_frame(wide, symbol)
+                    if frame is None:
+                        results[symbol] = None
+                        continue
+                    frame = clip_to_range(frame, start, end)
+                    if frame.empty and start is None:
+                        if not self._confirm_empty(symbol, throttle):
+                            # Failed inside the download rather than empty: the caller fetches it on its own
+                            results[symbol] = None
+                            continue
+                        # No history at all: remember it so the next runs skip the request
+                        self.empty_store.mark_empty(symbol)
+                    results[symbol] = frame
+        return results
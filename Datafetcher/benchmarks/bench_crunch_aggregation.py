@@ -0,0 +1,138 @@
+# Benchmark: FinancialSummary aggregation in Python (crunch_data path) vs in the database
+# (summarysql.aggregate_metrics_sql) on a synthetic universe.
+#
+#   python benchmarks/bench_crunch_aggregation.py                 # SQLite stand-in, in memory
+#   BENCH_DSN=postgresql://... python benchmarks/bench_crunch_aggregation.py
+#
+# With BENCH_DSN the tables are created in a throwaway "bench_crunch" schema that is dropped afterwards.
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+for name in ('DB_NAME', 'DB_USER', 'DB_PASSWORD'):
+    os.environ.setdefault(name, 'bench')  # dailydatacruncher reads these at import time
+
+import dailydatacruncher
+import summarysql
+
+STOCKS = int(os.environ.get('BENCH_STOCKS', '2000'))
+YEARS = int(os.environ.get('BENCH_YEARS', '10'))
+SNAPSHOTS_PER_YEAR = int(os.environ.get('BENCH_SNAPSHOTS_PER_YEAR', '4'))
+
+
+# Function to generate synthetic Stock, Financials and Fundamentals rows
+def generate_rows(seed=42):
+    rng = random.Random(seed)
+    stocks, financials, fundamentals = [], [], []
+    now = datetime.now()
+    for stock_id in range(1, STOCKS + 1):
+        stocks.append((stock_id, f"SYM{stock_id}"))
+        scale = 10 ** rng.uniform(8, 12)
+        for year in range(2024 - YEARS, 2024):
+            period_end = date(year, 3, 31)
+            income = {
+                'Net Income': scale * rng.uniform(-0.05, 0.2),
+                'Total Revenue': scale * rng.uniform(0.5, 2),
+                'Basic EPS': rng.uniform(-5, 80),
+                'Gross Profit': scale * rng.uniform(0.1, 0.6),
+            }
+            balance = {'Total Debt': scale * rng.uniform(0, 1.5), 'Total Assets': scale * rng.uniform(1, 4)}
+            cash_flow = {'Free Cash Flow': scale * rng.uniform(-0.1, 0.3)}
+            if rng.random() < 0.05:
+                income['Basic EPS'] = None
+            for statement_type, data in [('income_statement', income), ('balance_sheet', balance), ('cash_flow', cash_flow)]:
+                financials.append((stock_id, period_end, statement_type, json.dumps(data), now))
+            for quarter in range(SNAPSHOTS_PER_YEAR):
+                fundamentals.append((stock_id, date(year, 1 + quarter * 12 // SNAPSHOTS_PER_YEAR, 1),
+                                     int(scale * rng.uniform(1, 30)), rng.uniform(5, 80), rng.uniform(0.5, 15), now))
+    return stocks, financials, fundamentals
+
+
+# Function to load the synthetic rows into SQLite using the bundled yfinancedatafetcher schema
+def load_sqlite(rows):
+    import yfinancedatafetcher
+
+    conn = sqlite3.connect(':memory:')
+    yfinancedatafetcher.create_db_schema(conn)
+    stocks, financials, fundamentals = rows
+    with conn:
+        conn.executemany("INSERT INTO Stock (id, ticker) VALUES (?, ?)", stocks)
+        conn.executemany("INSERT INTO Financials (stock_id, date, statement_type, data, updated_at) VALUES (?, ?, ?, ?, ?)", financials)
+        conn.executemany("INSERT INTO Fundamentals (stock_id, date, market_cap, trailing_pe, price_to_book, updated_at) VALUES (?, ?, ?, ?, ?, ?)", fundamentals)
+    return conn
+
+
+# Function to load the synthetic rows into a scratch schema of the Postgres database at BENCH_DSN
+def load_postgres(rows, dsn):
+    import psycopg2
+    from psycopg2.extras import execute_values
+    import datafetcher
+
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cur:
+        cur.execute("DROP SCHEMA IF EXISTS bench_crunch CASCADE")
+        cur.execute("CREATE SCHEMA bench_crunch")
+        cur.execute("SET search_path TO bench_crunch")
+    datafetcher.create_db_schema(conn)
+    stocks, financials, fundamentals = rows
+    with conn.cursor() as cur:
+        execute_values(cur, "INSERT INTO Stock (id, ticker) VALUES %s", stocks)
+        execute_values(cur, "INSERT INTO Financials (stock_id, date, statement_type, data, updated_at) VALUES %s", financials)
+        execute_values(cur, "INSERT INTO Fundamentals (stock_id, date, market_cap, trailing_pe, price_to_book, updated_at) VALUES %s", fundamentals)
+        cur.execute("ANALYZE")
+    conn.commit()
+    return conn
+
+
+# Function to run the current path: pull every row into Python and aggregate there
+def python_path(conn, decode_json):
+    cur = conn.cursor()
+    cur.execute('SELECT stock_id, date, statement_type, data FROM Financials')
+    financial_data = cur.fetchall()
+    cur.execute('SELECT stock_id, date, market_cap, trailing_pe, price_to_book FROM Fundamentals')
+    fundamentals_data = cur.fetchall()
+    cur.close()
+    if decode_json:
+        financial_data = [(row[0], row[1], row[2], json.loads(row[3])) for row in financial_data]
+    return dailydatacruncher.aggregate_metrics(financial_data, fundamentals_data)
+
+
+# Function to time a callable over a few repeats and keep the best run
+def best_of(fn, repeats=3):
+    best, result = float('inf'), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == '__main__':
+    rows = generate_rows()
+    dsn = os.environ.get('BENCH_DSN')
+    if dsn:
+        conn, dialect, decode_json = load_postgres(rows, dsn), 'postgres', False
+    else:
+        conn, dialect, decode_json = load_sqlite(rows), 'sqlite', True
+    print(f"{dialect}: {STOCKS} stocks x {YEARS} years, {len(rows[1])} Financials rows, {len(rows[2])} Fundamentals rows")
+
+    python_time, python_totals = best_of(lambda: python_path(conn, decode_json))
+    sql_time, sql_totals = best_of(lambda: summarysql.aggregate_metrics_sql(conn, dialect))
+
+    for metric in summarysql.METRICS:
+        assert math.isclose(python_totals[metric], sql_totals[metric], rel_tol=1e-9, abs_tol=1e-6), \
+            f"{metric} differs: python={python_totals[metric]} sql={sql_totals[metric]}"
+    print(f"python path: {python_time * 1000:9.1f} ms")
+    print(f"sql path:    {sql_time * 1000:9.1f} ms  ({python_time / sql_time:.1f}x)")
+
+    if dsn:
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA bench_crunch CASCADE")
+        conn.commit()
+    conn.close()
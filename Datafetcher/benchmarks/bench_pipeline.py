@@ -0,0 +1,261 @@
+# Offline benchmark of the ingestion hot paths on synthetic yfinance-shaped data (see synthetic.py):
+# the datafetcher storage path (Stock, StockData, Fundamentals, Financials) followed by the
+# dailydatacruncher aggregation, in Python and in SQL. No network access is needed.
+#
+#   python benchmarks/bench_pipeline.py                        # SQLite, bundled yfinancedatafetcher schema
+#   BENCH_DSN=postgresql://... python benchmarks/bench_pipeline.py
+#   BENCH_SAVE_BASELINE=1 python benchmarks/bench_pipeline.py  # record the current numbers as the baseline
+#
+# Every scenario reports wall time, rows/sec, per-ticker p50/p95 latency where it applies and peak
+# traced memory (from a second, tracemalloc-instrumented run so tracing does not skew the timings).
+# Results are written to BENCH_RESULTS; if a baseline for the same backend and size exists, any metric
+# worse than it by more than BENCH_TOLERANCE is reported and the script exits with status 1.
+# With BENCH_DSN the tables live in a throwaway "bench_pipeline" schema that is dropped afterwards.
+import json
+import os
+import sqlite3
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+for name in ('DB_NAME', 'DB_USER', 'DB_PASSWORD'):
+    os.environ.setdefault(name, 'bench')  # datafetcher/dailydatacruncher read these at import time
+os.environ.setdefault('PRICE_CACHE_DIR', '')  # benchmark the database path only
+
+import summarysql
+from bench_crunch_aggregation import python_path
+from runmetrics import RunMetrics, summarize_samples
+from synthetic import make_payloads
+
+TICKERS = int(os.environ.get('BENCH_TICKERS', '100'))
+YEARS = int(os.environ.get('BENCH_YEARS', '5'))
+TOLERANCE = float(os.environ.get('BENCH_TOLERANCE', '0.25'))
+CRUNCH_REPEATS = int(os.environ.get('BENCH_REPEATS', '5'))
+SAVE_BASELINE = os.environ.get('BENCH_SAVE_BASELINE', '0') == '1'
+
+# Timings shorter than this are too noisy to compare
+MIN_COMPARABLE_SECONDS = 0.01
+LOWER_IS_BETTER = ['seconds', 'latency_p50_ms', 'latency_p95_ms', 'peak_memory_mb']
+HIGHER_IS_BETTER = ['rows_per_sec']
+
+
+# Storage through the bundled SQLite variant (yfinancedatafetcher), one transaction per ticker
+class SqliteBackend:
+    name = 'sqlite'
+    dialect = 'sqlite'
+    decode_json = True
+
+    def fresh(self):
+        import yfinancedatafetcher
+
+        conn = sqlite3.connect(':memory:')
+        yfinancedatafetcher.create_db_schema(conn)
+        return conn
+
+    def store(self, conn, payloads):
+        import yfinancedatafetcher
+
+        rows, latencies = 0, []
+        for payload in payloads:
+            start = time.perf_counter()
+            rows += yfinancedatafetcher.store_ticker_payload(conn, payload)
+            latencies.append(time.perf_counter() - start)
+        return rows, latencies
+
+    def close(self, conn):
+        conn.close()
+
+
+# Storage through datafetcher.store_ticker_payload (unit of work, bulk StockData upsert) on Postgres
+class PostgresBackend:
+    name = 'postgres'
+    dialect = 'postgres'
+    decode_json = False
+
+    def __init__(self, dsn):
+        import datafetcher
+
+        self.dsn = dsn
+        self.datafetcher = datafetcher
+
+    def fresh(self):
+        import psycopg2
+
+        conn = psycopg2.connect(self.dsn, options='-c timezone=Asia/Kolkata')
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA IF EXISTS bench_pipeline CASCADE")
+            cur.execute("CREATE SCHEMA bench_pipeline")
+            cur.execute("SET search_path TO bench_pipeline")
+        self.datafetcher.create_db_schema(conn)
+        return conn
+
+    def store(self, conn, payloads):
+        from unitofwork import ThroughputCounter
+
+        counter = ThroughputCounter()
+        uow, pending = self.datafetcher.create_writer(conn, counter)
+        latencies = []
+        for payload in payloads:
+            start = time.perf_counter()
+            self.datafetcher.store_ticker_payload(uow, payload, pending)
+            latencies.append(time.perf_counter() - start)
+        uow.commit()
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE")
+        conn.commit()
+        return counter.total_rows(), latencies
+
+    def close(self, conn):
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA bench_pipeline CASCADE")
+        conn.commit()
+        conn.close()
+
+
+# Function to time `work` (best of `repeats`), then run it once more under tracemalloc for peak memory;
+# on_timed runs in between (e.g. to snapshot stage timers of the untraced run)
+def measure(work, setup=None, on_timed=None, repeats=1):
+    seconds = float('inf')
+    for _ in range(repeats):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        rows, latencies = work(state)
+        seconds = min(seconds, time.perf_counter() - start)
+    if on_timed:
+        on_timed()
+
+    state = setup() if setup else state
+    tracemalloc.start()
+    work(state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        'seconds': seconds,
+        'rows': rows,
+        'rows_per_sec': rows / seconds if seconds > 0 else 0.0,
+        'peak_memory_mb': peak / 1e6,
+    }
+    if latencies:
+        summary = summarize_samples(latencies)
+        result['latency_p50_ms'] = summary['p50'] * 1000
+        result['latency_p95_ms'] = summary['p95'] * 1000
+    return result, state
+
+
+# Function to count the rows the crunch reads
+def crunch_rows(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT (SELECT COUNT(*) FROM Financials) + (SELECT COUNT(*) FROM Fundamentals)")
+    rows = cur.fetchone()[0]
+    cur.close()
+    return rows
+
+
+# Function to run every scenario on one backend and return {scenario: metrics}
+def run_benchmarks(backend, payloads):
+    results = {}
+    connections = []
+
+    def setup():
+        conn = backend.fresh()
+        connections.append(conn)
+        return conn
+
+    stages = {}
+
+    def snapshot_stages():
+        if backend.name == 'postgres':
+            report = backend.datafetcher.metrics.report()
+            stages.update({name: summary['total'] for name, summary in report['stages'].items()})
+
+    if backend.name == 'postgres':
+        # datafetcher's own stage timers, reset so they only cover the timed store run
+        backend.datafetcher.metrics = RunMetrics('bench_pipeline')
+    results['store'], conn = measure(lambda conn: backend.store(conn, payloads), setup, snapshot_stages)
+    if stages:
+        results['store']['stages'] = stages
+
+    rows = crunch_rows(conn)
+
+    def crunch_python(_):
+        python_path(conn, backend.decode_json)
+        return rows, []
+
+    def crunch_sql(_):
+        summarysql.aggregate_metrics_sql(conn, backend.dialect)
+        return rows, []
+
+    # The crunch scenarios only read, so they can repeat on the same data
+    results['crunch_python'], _ = measure(crunch_python, repeats=CRUNCH_REPEATS)
+    results['crunch_sql'], _ = measure(crunch_sql, repeats=CRUNCH_REPEATS)
+
+    for extra in connections[:-1]:
+        extra.close()
+    backend.close(conn)
+    return results
+
+
+# Function to list the metrics that got worse than the baseline by more than `tolerance`
+def find_regressions(results, baseline, tolerance=TOLERANCE):
+    regressions = []
+    for scenario, metrics in results.items():
+        previous = baseline.get(scenario, {})
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            if metric not in metrics or not previous.get(metric):
+                continue
+            if metric in ('seconds', 'rows_per_sec') and previous.get('seconds', 0) < MIN_COMPARABLE_SECONDS:
+                continue
+            change = metrics[metric] / previous[metric] - 1
+            worse = change > tolerance if metric in LOWER_IS_BETTER else change < -tolerance
+            if worse:
+                regressions.append(f"{scenario}.{metric}: {previous[metric]:.3f} -> {metrics[metric]:.3f} ({change:+.0%})")
+    return regressions
+
+
+if __name__ == '__main__':
+    dsn = os.environ.get('BENCH_DSN')
+    backend = PostgresBackend(dsn) if dsn else SqliteBackend()
+    baseline_path = os.environ.get('BENCH_BASELINE', os.path.join(BENCH_DIR, f"baseline-{backend.name}.json"))
+    results_path = os.environ.get('BENCH_RESULTS', os.path.join(BENCH_DIR, f"results-{backend.name}.json"))
+
+    generated = time.perf_counter()
+    payloads = make_payloads(TICKERS, YEARS)
+    print(f"{backend.name}: {TICKERS} tickers x {YEARS} years, "
+          f"{sum(len(payload['data']) for payload in payloads)} history rows "
+          f"(generated in {time.perf_counter() - generated:.1f}s)")
+
+    report = {
+        'config': {'backend': backend.name, 'tickers': TICKERS, 'years': YEARS},
+        'recorded_at': datetime.now().isoformat(timespec='seconds'),
+        'results': run_benchmarks(backend, payloads),
+    }
+    for scenario, metrics in report['results'].items():
+        latency = f", p50 {metrics['latency_p50_ms']:.1f}ms p95 {metrics['latency_p95_ms']:.1f}ms" if 'latency_p50_ms' in metrics else ''
+        print(f"{scenario:14s} {metrics['seconds'] * 1000:9.1f} ms  {metrics['rows_per_sec']:12,.0f} rows/sec"
+              f"{latency}, peak {metrics['peak_memory_mb']:.1f} MB")
+
+    with open(results_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {results_path}")
+
+    if SAVE_BASELINE or not os.path.exists(baseline_path):
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {baseline_path}")
+        sys.exit(0)
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline.get('config') != report['config']:
+        print(f"Baseline {baseline_path} was recorded with {baseline.get('config')}, not comparing")
+        sys.exit(0)
+    regressions = find_regressions(report['results'], baseline['results'])
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions beyond {TOLERANCE:.0%} against {baseline_path}")
@@ -0,0 +1,88 @@
+# Microbenchmarks: the old recursive sanitize_data walk vs the vectorized helpers in sanitize.py.
+#
+#   python benchmarks/bench_sanitize.py
+#
+# The payload mimics the pre-compaction summary: one fundamentals row per stock per trading day.
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sanitize import dumps_finite, sum_finite
+
+STOCKS = int(os.environ.get('BENCH_STOCKS', '2000'))
+DAYS = int(os.environ.get('BENCH_DAYS', '250'))
+NON_FINITE_RATE = 0.02
+
+
+# The recursive implementation dailydatacruncher used before, kept here as the baseline
+def legacy_sanitize_data(data):
+    if isinstance(data, float):
+        if data == float('inf') or data == float('-inf') or data != data:  # checks for infinity and NaN
+            return None
+    elif isinstance(data, dict):
+        return {k: legacy_sanitize_data(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [legacy_sanitize_data(v) for v in data]
+    return data
+
+
+# Function to draw a float that is occasionally NaN or +/-Inf
+def noisy(rng, low, high):
+    roll = rng.random()
+    if roll < NON_FINITE_RATE / 2:
+        return float('nan')
+    if roll < NON_FINITE_RATE:
+        return rng.choice([float('inf'), float('-inf')])
+    return rng.uniform(low, high)
+
+
+# Function to build the old-style summary payload
+def generate_payload(seed=7):
+    rng = random.Random(seed)
+    start = date(2023, 1, 1)
+    rows = []
+    for stock_id in range(1, STOCKS + 1):
+        for day in range(DAYS):
+            rows.append([stock_id, (start + timedelta(days=day)).isoformat(), rng.randint(10 ** 9, 10 ** 13),
+                         noisy(rng, 5, 80), noisy(rng, 0.5, 15)])
+    return {'totalMarketCap': 1.0, 'totalProfit': float('nan'), 'fundamentalsData': rows}
+
+
+# Function to time a callable over a few repeats and keep the best run
+def best_of(fn, repeats=3):
+    best, result = float('inf'), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def report(name, legacy_time, new_time):
+    print(f"{name:<28} legacy {legacy_time * 1000:9.1f} ms   vectorized {new_time * 1000:9.1f} ms   ({legacy_time / new_time:.1f}x)")
+
+
+if __name__ == '__main__':
+    payload = generate_payload()
+    values = [row[3] for row in payload['fundamentalsData']]
+    print(f"{len(payload['fundamentalsData'])} rows, {len(values)} values per column")
+
+    legacy_time, legacy_sum = best_of(lambda: sum(legacy_sanitize_data(value) or 0 for value in values))
+    new_time, new_sum = best_of(lambda: sum_finite(values))
+    assert math.isclose(legacy_sum, new_sum, rel_tol=1e-9)
+    report('aggregate one column', legacy_time, new_time)
+
+    legacy_time, legacy_text = best_of(lambda: json.dumps(legacy_sanitize_data(payload), default=str))
+    new_time, new_text = best_of(lambda: dumps_finite(payload))
+    assert json.loads(legacy_text) == json.loads(new_text)
+    report('sanitize + serialize', legacy_time, new_time)
+
+    # Plain encoding (emitting invalid NaN tokens) is the floor both serialize paths share
+    encode_time, _ = best_of(lambda: json.dumps(payload, default=str))
+    report('cleaning overhead only', legacy_time - encode_time, max(new_time - encode_time, 1e-6))
@@ -0,0 +1,95 @@
+# Synthetic yfinance-shaped data for offline benchmarks: history frames as returned by
+# Ticker.history, stock.info dicts and the balance_sheet/financials/cashflow frames, assembled into
+# the payload dicts datafetcher.fetch_ticker_payload returns. Everything is seeded and reproducible.
+import numpy as np
+import pandas as pd
+
+HISTORY_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+STATEMENT_ITEMS = {
+    'balance_sheet': ['Total Assets', 'Total Debt', 'Stockholders Equity', 'Cash And Cash Equivalents',
+                      'Current Assets', 'Current Liabilities', 'Inventory', 'Net PPE'],
+    'income_statement': ['Total Revenue', 'Gross Profit', 'Operating Income', 'Net Income', 'Basic EPS',
+                         'Diluted EPS', 'EBITDA', 'Interest Expense'],
+    'cash_flow': ['Operating Cash Flow', 'Capital Expenditure', 'Free Cash Flow', 'Issuance Of Debt',
+                  'Repayment Of Debt', 'Cash Dividends Paid'],
+}
+# Share of statement cells left empty, as Yahoo does for line items a company does not report
+MISSING_RATE = 0.08
+STATEMENT_YEARS = 4
+EXCHANGE_TIMEZONE = 'Asia/Kolkata'
+
+
+# Function to build a daily OHLCV history of `years` business years ending at `end`
+def make_history(rng, years, end='2024-03-28'):
+    index = pd.bdate_range(end=end, periods=years * 250, tz=EXCHANGE_TIMEZONE, name='Date')
+    days = len(index)
+    close = rng.uniform(20, 3000) * np.exp(np.cumsum(rng.normal(0.0003, 0.02, days)))
+    spread = np.abs(rng.normal(0, 0.01, days)) * close
+    open_ = close * (1 + rng.normal(0, 0.005, days))
+    dividends = np.where(rng.random(days) < 0.004, rng.uniform(1, 20, days), 0.0)
+    splits = np.where(rng.random(days) < 0.0002, 2.0, 0.0)
+    return pd.DataFrame({
+        'Open': open_,
+        'High': np.maximum(open_, close) + spread,
+        'Low': np.minimum(open_, close) - spread,
+        'Close': close,
+        'Volume': rng.integers(1_000, 5_000_000, days),
+        'Dividends': dividends,
+        'Stock Splits': splits,
+    }, index=index, columns=HISTORY_COLUMNS)
+
+
+# Function to build a stock.info dict; real ones carry ~150 keys, most irrelevant to the pipeline
+def make_info(rng, symbol):
+    market_cap = int(10 ** rng.uniform(9, 13))
+    info = {
+        'symbol': f"{symbol}.NS",
+        'longName': f"{symbol} Industries Limited",
+        'currency': 'INR',
+        'exchange': 'NSI',
+        'sector': rng.choice(['Technology', 'Financial Services', 'Energy', 'Healthcare', 'Industrials']),
+        'marketCap': market_cap,
+        'enterpriseValue': int(market_cap * rng.uniform(0.8, 1.6)),
+        'trailingPE': float(rng.uniform(5, 90)),
+        'forwardPE': float(rng.uniform(5, 70)),
+        'pegRatio': float(rng.uniform(0.2, 4)) if rng.random() > 0.3 else None,
+        'priceToBook': float(rng.uniform(0.4, 20)),
+        'dividendYield': float(rng.uniform(0, 0.05)),
+        'longBusinessSummary': 'Synthetic company used for benchmarking. ' * 20,
+    }
+    for position in range(120):
+        info[f"field{position}"] = float(rng.normal())
+    return info
+
+
+# Function to build the three statement frames: line items as rows, fiscal year ends as columns
+def make_statements(rng, scale, end_year=2024):
+    columns = pd.to_datetime([f"{year}-03-31" for year in range(end_year, end_year - STATEMENT_YEARS, -1)])
+    statements = []
+    for statement_type in ['balance_sheet', 'income_statement', 'cash_flow']:
+        items = STATEMENT_ITEMS[statement_type]
+        values = rng.normal(0.3, 0.5, (len(items), len(columns))) * scale
+        values[rng.random(values.shape) < MISSING_RATE] = np.nan
+        frame = pd.DataFrame(values, index=items, columns=columns)
+        if statement_type == 'income_statement':
+            frame.loc[['Basic EPS', 'Diluted EPS']] = rng.uniform(-5, 80, (2, len(columns)))
+        statements.append((statement_type, frame))
+    return statements
+
+
+# Function to build one fetch_ticker_payload-shaped dict
+def make_payload(rng, symbol, years):
+    info = make_info(rng, symbol)
+    return {
+        'ticker': symbol,
+        'data': make_history(rng, years),
+        'info': info,
+        'statements': make_statements(rng, info['marketCap'] / 10),
+        'fetch_seconds': 0.0,
+    }
+
+
+# Function to generate payloads for `tickers` symbols with `years` of history each
+def make_payloads(tickers, years, seed=42):
+    rng = np.random.default_rng(seed)
+    return [make_payload(rng, f"SYN{number:04d}", years) for number in range(tickers)]
@@ -1,17 +1,15 @@
 import psycopg2
 import redis
-import json
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import os
+import zlib
 
-# Database connection parameters
-db_params = {
-    'dbname': os.environ['DB_NAME'],  # replace with your actual database name
-    'user': os.environ['DB_USER'],    # replace with your actual database user
-    'password': os.environ['DB_PASSWORD'],  # replace with your actual database password
-    'host': 'postgres',
-    'port': '5432',
-}
+from dbutil import CRUNCH_STREAM_CHUNK, create_watermark_schema, db_params, get_watermark, set_watermark, stream_rows
+from marketbreadth import cache_market_breadth, update_market_breadth
+from rankingengine import update_rankings
+from runmetrics import RunMetrics
+from sanitize import dumps_finite, sum_finite
+from summarysql import METRICS, build_summary, finite_sql, line_item_metric_source, line_item_metric_sums
 
 # Redis connection parameters
 redis_params = {
@@ -19,83 +17,267 @@ redis_params = {
     'port': 6379
 }
 
-# Function to fetch data from the database
-def fetch_data_from_db(query):
-    conn = psycopg2.connect(**db_params)
+# 'incremental' folds only the stocks changed since the last run into CrunchState;
+# 'full' recomputes everything from scratch (and reseeds CrunchState) for verification
+CRUNCH_MODE = os.environ.get('CRUNCH_MODE', 'incremental')
+# Rows updated this long before the watermark are re-read, so late commits are never missed
+CRUNCH_OVERLAP = timedelta(minutes=int(os.environ.get('CRUNCH_OVERLAP_MINUTES', '60')))
+
+# With CRUNCH_STREAM=1 the full mode reads through server-side cursors (CRUNCH_STREAM_CHUNK rows per
+# round trip, see dbutil) instead of fetchall()
+CRUNCH_STREAM = os.environ.get('CRUNCH_STREAM', '0') == '1'
+
+# Layout of the per-stock latest fundamentals published next to the scalar summary
+SUMMARY_PAGE_SIZE = int(os.environ.get('SUMMARY_PAGE_SIZE', '500'))
+SUMMARY_COMPRESS = os.environ.get('SUMMARY_COMPRESS', '1') == '1'
+SUMMARY_KEY = 'financialSummary'
+SUMMARY_PAGE_KEY_PREFIX = 'financialSummary:fundamentals:'
+SUMMARY_TTL = 3600  # Cache for 1 hour
+SUMMARY_FUNDAMENTAL_COLUMNS = ['stock_id', 'date', 'market_cap', 'trailing_pe', 'price_to_book']
+
+# Stage timers and counters for this run (see runmetrics)
+run_metrics = RunMetrics('dailydatacruncher')
+
+# Function to fetch data from the database; reuses conn when one is given
+def fetch_data_from_db(query, conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = psycopg2.connect(**db_params)
     cursor = conn.cursor()
     cursor.execute(query)
     rows = cursor.fetchall()
     cursor.close()
-    conn.close()
+    if own_conn:
+        conn.close()
     return rows
 
 # Function to fetch stock and financial data
-def fetch_financial_data():
+def fetch_financial_data(conn=None):
     stock_query = 'SELECT id, ticker FROM Stock'
     financial_query = 'SELECT stock_id, date, statement_type, data FROM Financials'
     fundamental_query = 'SELECT stock_id, date, market_cap, trailing_pe, price_to_book FROM Fundamentals'
 
-    stocks = fetch_data_from_db(stock_query)
-    financial_data = fetch_data_from_db(financial_query)
-    fundamentals_data = fetch_data_from_db(fundamental_query)
+    stocks = fetch_data_from_db(stock_query, conn)
+    financial_data = fetch_data_from_db(financial_query, conn)
+    fundamentals_data = fetch_data_from_db(fundamental_query, conn)
 
     return stocks, financial_data, fundamentals_data
 
-# Function to sanitize data
-def sanitize_data(data):
-    if isinstance(data, float):
-        if data == float('inf') or data == float('-inf') or data != data:  # checks for infinity and NaN
-            return None
-    elif isinstance(data, dict):
-        return {k: sanitize_data(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [sanitize_data(v) for v in data]
-    return data
+# Function to pass fundamentals rows through while remembering the latest row of each stock
+def track_latest_fundamentals(rows, latest):
+    for row in rows:
+        current = latest.get(row[0])
+        if current is None or row[1] >= current[1]:
+            latest[row[0]] = row
+        yield row
+
+# Function to crunch the full tables through server-side cursors; returns the raw metric totals and
+# the latest fundamentals row per stock (bounded by the number of stocks, not by table size)
+def crunch_streaming(conn):
+    latest = {}
+    financial_rows = stream_rows(conn, 'SELECT stock_id, date, statement_type, data FROM Financials')
+    fundamental_rows = track_latest_fundamentals(
+        stream_rows(conn, 'SELECT stock_id, date, market_cap, trailing_pe, price_to_book FROM Fundamentals'), latest)
+    totals = aggregate_metrics(financial_rows, fundamental_rows)
+    conn.commit()  # named cursors live in the transaction; end it so later statements start clean
+    return totals, [latest[stock_id] for stock_id in sorted(latest)]
+
+# Function to sum the raw summary metrics over financial and fundamental rows in a single pass.
+# Values are gathered into per-metric columns and cleaned/summed in bulk every CRUNCH_STREAM_CHUNK
+# rows, so streamed input stays bounded and no per-element sanitizing happens in Python. Market cap
+# counts each stock's latest snapshot only, kept per stock (bounded by the number of stocks).
+def aggregate_metrics(financial_data, fundamentals_data):
+    totals = dict.fromkeys(METRICS, 0.0)
+    columns = {metric: [] for metric in METRICS}
+
+    def flush():
+        for metric, values in columns.items():
+            if values:
+                totals[metric] += sum_finite(values)
+                values.clear()
+
+    latest = {}
+    for item in fundamentals_data:
+        current = latest.get(item[0])
+        if current is None or item[1] >= current[0]:
+            latest[item[0]] = (item[1], item[2])
+    columns['market_cap'].extend(market_cap for _, market_cap in latest.values())
+    pending = len(latest)
+    for item in financial_data:
+        if item[2] == 'income_statement':
+            columns['profit'].append(item[3].get('Net Income'))
+            columns['revenue'].append(item[3].get('Total Revenue'))
+            columns['eps'].append(item[3].get('Basic EPS'))
+        elif item[2] == 'balance_sheet':
+            columns['debt'].append(item[3].get('Total Debt'))
+        pending += 1
+        if pending >= CRUNCH_STREAM_CHUNK:
+            flush()
+            pending = 0
+    flush()
+    return totals
 
 # Function to crunch data
 def crunch_data(stocks, financial_data, fundamentals_data):
-    stock_ids = [stock[0] for stock in stocks]
-
-    # Calculate aggregates
-    total_market_cap = sum(sanitize_data(item[2]) or 0 for item in fundamentals_data) / 10000000
-    total_profit = sum(sanitize_data(item[3].get('Net Income')) or 0 for item in financial_data if item[2] == 'income_statement') / 10000000
-    total_revenue = sum(sanitize_data(item[3].get('Total Revenue')) or 0 for item in financial_data if item[2] == 'income_statement') / 10000000
-    combined_eps = sum(sanitize_data(item[3].get('Basic EPS')) or 0 for item in financial_data if item[2] == 'income_statement')
-    total_debt = sum(sanitize_data(item[3].get('Total Debt')) or 0 for item in financial_data if item[2] == 'balance_sheet') / 10000000
-
-    avg_profit_per_mcap = total_profit / (total_market_cap / 1000) if total_market_cap else 0
-    avg_profit_per_revenue = total_profit / (total_revenue / 1000) if total_revenue else 0
-    avg_debt_per_mcap = total_debt / (total_market_cap / 1000) if total_market_cap else 0
-    avg_debt_per_revenue = total_debt / (total_revenue / 1000) if total_revenue else 0
-
-    response_data = {
-        'totalMarketCap': total_market_cap,
-        'totalProfit': total_profit,
-        'combinedEPS': combined_eps,
-        'totalDebt': total_debt,
-        'totalRevenue': total_revenue,
-        'avgProfitPerMcap': avg_profit_per_mcap,
-        'avgProfitPerRevenue': avg_profit_per_revenue,
-        'avgDebtPerMcap': avg_debt_per_mcap,
-        'avgDebtPerRevenue': avg_debt_per_revenue,
-        'fundamentalsData': fundamentals_data,
-    }
-
-    return sanitize_data(response_data)
+    return build_summary(aggregate_metrics(financial_data, fundamentals_data))
+
+# Function to keep only the latest fundamentals row of each stock
+def latest_fundamentals_per_stock(rows):
+    latest = {}
+    for _ in track_latest_fundamentals(rows, latest):
+        pass
+    return [latest[stock_id] for stock_id in sorted(latest)]
+
+# Function to serialize the summary once for both sinks: the scalar document (with an index of the
+# fundamentals pages) and the per-stock latest fundamentals as columnar, optionally zlib-compressed pages
+def serialize_summary(summary, latest_fundamentals, page_size=SUMMARY_PAGE_SIZE, compress=SUMMARY_COMPRESS):
+    pages = []
+    for start in range(0, len(latest_fundamentals), page_size):
+        chunk = latest_fundamentals[start:start + page_size]
+        columns = {}
+        for index, name in enumerate(SUMMARY_FUNDAMENTAL_COLUMNS):
+            values = [row[index] for row in chunk]
+            if name == 'date':
+                values = [value.isoformat() if isinstance(value, date) else value for value in values]
+            columns[name] = values
+        page = dumps_finite(columns, separators=(',', ':')).encode()
+        pages.append(zlib.compress(page) if compress else page)
+
+    document = dict(summary, fundamentals={
+        'columns': SUMMARY_FUNDAMENTAL_COLUMNS,
+        'count': len(latest_fundamentals),
+        'pageSize': page_size,
+        'pages': len(pages),
+        'encoding': 'zlib+json' if compress else 'json',
+        'keyPrefix': SUMMARY_PAGE_KEY_PREFIX,
+    })
+    return {'summary': dumps_finite(document), 'pages': pages}
+
+# Function to create the running aggregate state used by the incremental mode.
+# CrunchState holds each stock's metric sums per source ('fundamentals', 'income_statement',
+# 'balance_sheet'); the fundamentals row carries the stock's latest snapshot, whose market cap is the
+# one the total counts.
+def create_crunch_state(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS CrunchState (
+                stock_id INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                market_cap DOUBLE PRECISION DEFAULT 0,
+                profit DOUBLE PRECISION DEFAULT 0,
+                revenue DOUBLE PRECISION DEFAULT 0,
+                eps DOUBLE PRECISION DEFAULT 0,
+                debt DOUBLE PRECISION DEFAULT 0,
+                latest_date DATE,
+                latest_market_cap BIGINT,
+                latest_trailing_pe REAL,
+                latest_price_to_book REAL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (stock_id, source)
+            )
+        """)
+        create_watermark_schema(cur)
+    conn.commit()
+
+# Function to recompute the CrunchState rows of the given stocks (all stocks when None) inside
+# the database: one grouped query per source, nothing but the row count comes back to Python
+def refresh_stock_state(cur, stock_ids=None):
+    where = "stock_id = ANY(%(stock_ids)s)" if stock_ids is not None else "TRUE"
+    line_item_where = "f.stock_id = ANY(%(stock_ids)s)" if stock_ids is not None else "TRUE"
+    params = {'stock_ids': list(stock_ids) if stock_ids is not None else None}
+    cur.execute(f"DELETE FROM CrunchState WHERE {where}", params)
+    cur.execute(f"""
+        INSERT INTO CrunchState (stock_id, source, profit, revenue, eps, debt)
+        SELECT f.stock_id, f.statement_type, {', '.join(line_item_metric_sums())}
+        FROM {line_item_metric_source()} AND {line_item_where}
+        GROUP BY f.stock_id, f.statement_type
+    """, params)
+    cur.execute(f"""
+        INSERT INTO CrunchState (stock_id, source, market_cap, latest_date, latest_market_cap,
+                                 latest_trailing_pe, latest_price_to_book)
+        SELECT latest.stock_id, 'fundamentals', COALESCE(latest.market_cap, 0)::double precision,
+               latest.date, latest.market_cap,
+               {finite_sql('latest.trailing_pe')}, {finite_sql('latest.price_to_book')}
+        FROM (
+            SELECT DISTINCT ON (stock_id) stock_id, date, market_cap, trailing_pe, price_to_book
+            FROM Fundamentals WHERE {where}
+            ORDER BY stock_id, date DESC
+        ) latest
+    """, params)
+
+# Function to read the summary totals and per-stock latest fundamentals back out of CrunchState
+def read_state_summary(cur):
+    cur.execute(f"SELECT {', '.join(f'COALESCE(SUM({metric}), 0)' for metric in METRICS)} FROM CrunchState")
+    totals = dict(zip(METRICS, cur.fetchone()))
+    cur.execute("""
+        SELECT stock_id, latest_date, latest_market_cap, latest_trailing_pe, latest_price_to_book
+        FROM CrunchState
+        WHERE source = 'fundamentals'
+        ORDER BY stock_id
+    """)
+    return totals, cur.fetchall()
+
+# Function to rebuild CrunchState from every row (bootstrap and --full verification)
+def rebuild_crunch_state(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT GREATEST((SELECT MAX(updated_at) FROM Financials), (SELECT MAX(updated_at) FROM Fundamentals))")
+        watermark = cur.fetchone()[0] or datetime(1900, 1, 1)
+        refresh_stock_state(cur)
+        set_watermark(cur, 'financialSummary', watermark)
+    conn.commit()
+
+# Function to fold the rows changed since the last watermark into CrunchState and return the summary
+def crunch_incremental(conn):
+    create_crunch_state(conn)
+    with conn.cursor() as cur:
+        watermark = get_watermark(cur, 'financialSummary')
+    if watermark is None:
+        print("No crunch watermark yet, rebuilding CrunchState from scratch")
+        rebuild_crunch_state(conn)
+    else:
+        since = watermark - CRUNCH_OVERLAP
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT stock_id, MAX(updated_at) FROM (
+                    SELECT stock_id, updated_at FROM Financials WHERE updated_at > %s
+                    UNION ALL
+                    SELECT stock_id, updated_at FROM Fundamentals WHERE updated_at > %s
+                ) changed
+                GROUP BY stock_id
+            """, (since, since))
+            changed = dict(cur.fetchall())
+            if changed:
+                refresh_stock_state(cur, list(changed))
+                set_watermark(cur, 'financialSummary', max(watermark, max(changed.values())))
+            print(f"Incremental crunch: {len(changed)} stocks changed since {since}")
+        conn.commit()
+
+    with conn.cursor() as cur:
+        totals, latest_fundamentals = read_state_summary(cur)
+    return build_summary(totals), latest_fundamentals
 
 # Function to persist data in the database
-def persist_data_in_db(data):
-    conn = psycopg2.connect(**db_params)
+def persist_data_in_db(serialized, conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = psycopg2.connect(**db_params)
     cursor = conn.cursor()
     create_table_query = '''
     CREATE TABLE IF NOT EXISTS FinancialSummary (
         id SERIAL PRIMARY KEY,
-        date DATE NOT NULL,
+        date DATE NOT NULL UNIQUE,
         data JSONB NOT NULL,
         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     '''
     cursor.execute(create_table_query)
+    # Tables created before date was unique: keep the newest row per date, then add the constraint
+    # the upsert below needs (for new tables the index already exists under this name)
+    cursor.execute('''
+    DELETE FROM FinancialSummary older USING FinancialSummary newer
+    WHERE older.date = newer.date AND older.id < newer.id
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS financialsummary_date_key ON FinancialSummary (date)')
     insert_data_query = '''
     INSERT INTO FinancialSummary (date, data)
     VALUES (%s, %s::jsonb)
@@ -103,18 +285,62 @@ def persist_data_in_db(data):
         data = EXCLUDED.data,
         updated_at = EXCLUDED.updated_at
     '''
-    cursor.execute(insert_data_query, (datetime.now().date(), json.dumps(data, default=str)))
+    cursor.execute(insert_data_query, (datetime.now().date(), serialized['summary']))
     conn.commit()
     cursor.close()
-    conn.close()
+    if own_conn:
+        conn.close()
 
 # Function to store data in Redis
-def store_data_in_redis(data):
-    redis_client = redis.StrictRedis(**redis_params, decode_responses=True)
-    redis_client.set('financialSummary', json.dumps(data, default=str), ex=3600)  # Cache for 1 hour
+def store_data_in_redis(serialized):
+    redis_client = redis.StrictRedis(**redis_params)
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.set(SUMMARY_KEY, serialized['summary'], ex=SUMMARY_TTL)
+    for page_number, page in enumerate(serialized['pages']):
+        pipe.set(f"{SUMMARY_PAGE_KEY_PREFIX}{page_number}", page, ex=SUMMARY_TTL)
+    pipe.execute()
 
 if __name__ == '__main__':
-    stocks, financial_data, fundamentals_data = fetch_financial_data()
-    summary_data = crunch_data(stocks, financial_data, fundamentals_data)
-    persist_data_in_db(summary_data)
-    store_data_in_redis(summary_data)
+    # One connection serves the whole run
+    conn = psycopg2.connect(**db_params)
+    if CRUNCH_MODE == 'full':
+        # Recompute everything in Python from scratch, then reseed the incremental state and cross-check it
+        if CRUNCH_STREAM:
+            with run_metrics.stage('crunch_streaming'):
+                totals, latest_fundamentals = crunch_streaming(conn)
+        else:
+            with run_metrics.stage('fetch'):
+                stocks, financial_data, fundamentals_data = fetch_financial_data(conn)
+            run_metrics.add('rows_read', len(stocks) + len(financial_data) + len(fundamentals_data))
+            with run_metrics.stage('aggregate'):
+                totals = aggregate_metrics(financial_data, fundamentals_data)
+                latest_fundamentals = latest_fundamentals_per_stock(fundamentals_data)
+        summary_data = build_summary(totals)
+        with run_metrics.stage('rebuild_state'):
+            create_crunch_state(conn)
+            rebuild_crunch_state(conn)
+            with conn.cursor() as cur:
+                state_totals, _ = read_state_summary(cur)
+        for metric in METRICS:
+            if abs(totals[metric] - state_totals[metric]) > 1e-6 * max(abs(totals[metric]), 1):
+                print(f"CrunchState drift on {metric}: full={totals[metric]} state={state_totals[metric]}")
+                run_metrics.add('state_drift')
+    else:
+        with run_metrics.stage('crunch_incremental'):
+            summary_data, latest_fundamentals = crunch_incremental(conn)
+    with run_metrics.stage('serialize'):
+        serialized = serialize_summary(summary_data, latest_fundamentals)
+    run_metrics.add('stocks_published', len(latest_fundamentals))
+    run_metrics.add('bytes_published', len(serialized['summary']) + sum(len(page) for page in serialized['pages']))
+    with run_metrics.stage('persist'):
+        persist_data_in_db(serialized, conn)
+    with run_metrics.stage('breadth'):
+        run_metrics.add('breadth_rows', update_market_breadth(conn))
+    with run_metrics.stage('redis'):
+        store_data_in_redis(serialized)
+        cache_market_breadth(conn, redis.StrictRedis(**redis_params))
+    # Ranks the stocks on the CrunchState refreshed above
+    with run_metrics.stage('rankings'):
+        run_metrics.add('rank_changes', update_rankings(conn, redis.StrictRedis(**redis_params)))
+    conn.close()
+    run_metrics.write()
@@ -1,14 +1,95 @@
-import yfinance as yf
 import psycopg2
+import psycopg2.pool
 import pandas as pd
 from datetime import datetime
+import io
 import json
 import os
-import redis
-import openpyxl
+import threading
+import time
 
-# Initialize Redis client
-redis_client = redis.StrictRedis(host='redisYFinance', port=6379, db=0, decode_responses=True)
+from fetchcache import FetchCache
+from jobscheduler import JOB_CLAIM_BATCH, JOB_RETRY_WAIT_SECONDS, JobScheduler, priority_scores
+from lineitems import LineItemNames, create_line_item_schema, migrate_financials, write_line_items
+from pricecache import PRICE_CACHE_DIR, PriceCache
+from runmetrics import RunMetrics, profile_if_selected
+from sanitize import mask_non_finite
+from symboluniverse import load_symbols
+from tradingcalendar import EXCHANGE_TIMEZONE, last_completed_session, missing_range
+from unitofwork import ThroughputCounter, UnitOfWork
+
+# yfinance and redis are imported on first use rather than at import time (yfinance alone takes about
+# half a second); main starts the yfinance import in the background so it overlaps the database setup
+yf = None
+_yfinance_lock = threading.Lock()
+
+# Redis client, created on first use (see get_redis_client)
+redis_client = None
+
+REDIS_HOST = 'redisYFinance'
+REDIS_PORT = 6379
+
+# Number of tickers whose history is buffered before one bulk COPY + upsert into StockData.
+# Set to 0 to fall back to the row-by-row insert_stock_data path.
+BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', '50'))
+
+# Number of pipeline writer threads, each with its own pooled connection and unit of work
+WRITE_WORKERS = int(os.environ.get('WRITE_WORKERS', '1'))
+
+# Postgres connections main's pool opens: its own, the LineItemNames one and one per writer thread
+MAIN_CONNECTIONS = WRITE_WORKERS + 2
+
+# Number of concurrent fetch workers; 1 keeps the sequential loop, more enables fetchpipeline
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', '1'))
+
+# Number of tickers whose history is pulled with batched multi-symbol downloads (batchfetch);
+# 0 keeps one yf.Ticker().history call per ticker
+HISTORY_BATCH_SIZE = int(os.environ.get('HISTORY_BATCH_SIZE', '0'))
+
+# One-off cleanup of Fundamentals rows written per trading day before snapshots were change-detected
+COMPACT_FUNDAMENTALS = os.environ.get('COMPACT_FUNDAMENTALS', '0') == '1'
+
+# Stage timers, counters and latencies for this run (see runmetrics)
+metrics = RunMetrics('datafetcher')
+
+# Redis cache in front of stock.info and the statements (see fetchcache). It stores compressed entries,
+# so it gets its own client without decode_responses. FETCH_CACHE=0 turns it off.
+# The cache is created by main (see create_fetch_cache).
+FETCH_CACHE = os.environ.get('FETCH_CACHE', '1') == '1'
+fetch_cache = None
+
+# Local columnar copy of the fetched history (see pricecache); off when PRICE_CACHE_DIR is empty
+price_cache = PriceCache(PRICE_CACHE_DIR) if PRICE_CACHE_DIR else None
+
+# LineItem names shared by the writers (see lineitems.LineItemNames); set up by main on its own connection
+line_item_names = None
+
+STOCK_DATA_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'dividends', 'stock_splits']
+
+# Function to import yfinance once, on first use
+def load_yfinance():
+    global yf
+    with _yfinance_lock:
+        if yf is None:
+            import yfinance
+            yf = yfinance
+    return yf
+
+# Function to return the shared Redis client (decoded responses), creating it on first use
+def get_redis_client():
+    global redis_client
+    if redis_client is None:
+        import redis
+        redis_client = redis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+    return redis_client
+
+# Function to create the fetch cache when FETCH_CACHE is on and none exists yet
+def create_fetch_cache():
+    global fetch_cache
+    if FETCH_CACHE and fetch_cache is None:
+        import redis
+        fetch_cache = FetchCache(redis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT, db=0), metrics=metrics)
+    return fetch_cache
 
 # Function to create the database and tables
 def create_db_schema1(conn):
@@ -78,6 +159,8 @@ def create_db_schema1(conn):
             )
         """)
         conn.commit()
+    # Typed line items mirrored from Financials.data (see lineitems)
+    create_line_item_schema(conn)
 
 def create_db_schema(conn):
     with conn.cursor() as cur:
@@ -114,6 +197,12 @@ def create_db_schema(conn):
                 UNIQUE(stock_id, date)
             )
         """)
+        # indicatorengine reads only the rows updated since its watermark
+        cur.execute("CREATE INDEX IF NOT EXISTS stockdata_updated_at_idx ON StockData (updated_at)")
+        # StockData is otherwise only indexed by (stock_id, date); this turns marketbreadth's window reads
+        # (and the backend's per-date scans) into index-only range scans. Built here, in prepare_db, so
+        # the cruncher never holds a lock on StockData while writers run.
+        cur.execute("CREATE INDEX IF NOT EXISTS stockdata_date_idx ON StockData (date) INCLUDE (stock_id, close)")
         cur.execute("""
             CREATE TABLE IF NOT EXISTS Fundamentals (
                 id SERIAL PRIMARY KEY,
@@ -146,13 +235,16 @@ def create_db_schema(conn):
             )
         """)
         conn.commit()
+    # Typed line items mirrored from Financials.data (see lineitems)
+    create_line_item_schema(conn)
+
+# The insert functions below do not commit: the caller owns the transaction (see unitofwork.UnitOfWork)
 
 # Function to insert stock information
 def insert_stock(conn, ticker):
     with conn.cursor() as cur:
         cur.execute("INSERT INTO Stock (ticker) VALUES (%s) ON CONFLICT (ticker) DO NOTHING RETURNING id", (ticker,))
         result = cur.fetchone()
-        conn.commit()
         if result:
             return result[0]
         else:
@@ -171,7 +263,98 @@ def insert_stock_data(conn, stock_id, data):
                 close = EXCLUDED.close, volume = EXCLUDED.volume, dividends = EXCLUDED.dividends,
                 stock_splits = EXCLUDED.stock_splits, updated_at = EXCLUDED.updated_at
             """, (stock_id, row[0].to_pydatetime(), row[1], row[2], row[3], row[4], row[5], row[6], row[7], datetime.now()))
-        conn.commit()
+
+# Function to create the session-local staging table used by the bulk StockData path
+def create_stock_data_staging(cur):
+    cur.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS StockDataStaging (
+            seq BIGSERIAL,
+            stock_id INTEGER,
+            date TIMESTAMPTZ,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume BIGINT,
+            dividends REAL,
+            stock_splits REAL
+        )
+    """)
+
+# Function to serialize one history frame into COPY-ready CSV rows
+def write_stock_data_csv(buf, stock_id, data):
+    frame = data.iloc[:, :len(STOCK_DATA_COLUMNS)].copy()
+    frame.columns = STOCK_DATA_COLUMNS
+    # volume is BIGINT; a NaN would otherwise turn the whole column into floats ("123.0")
+    frame['volume'] = frame['volume'].round().astype('Int64')
+    frame.insert(0, 'stock_id', stock_id)
+    # Keep the timezone offset so the ::date cast in the merge matches what the per-row path stored
+    frame.to_csv(buf, header=False, na_rep='', date_format='%Y-%m-%d %H:%M:%S%z')
+    return len(frame)
+
+# Function to bulk upsert the history of a batch of tickers: COPY into staging, then one set-based merge
+def bulk_insert_stock_data(conn, batch):
+    start = time.perf_counter()
+    buf = io.StringIO()
+    rows = 0
+    for stock_id, data in batch:
+        if data is not None and not data.empty:
+            rows += write_stock_data_csv(buf, stock_id, data)
+    if not rows:
+        return 0
+    buf.seek(0)
+    metrics.add('bytes_copied', len(buf.getvalue()))
+
+    with conn.cursor() as cur:
+        create_stock_data_staging(cur)
+        cur.execute("TRUNCATE StockDataStaging")
+        cur.copy_expert("""
+            COPY StockDataStaging (date, stock_id, open, high, low, close, volume, dividends, stock_splits)
+            FROM STDIN WITH (FORMAT csv, NULL '')
+        """, buf)
+        # DISTINCT ON keeps the last copy of a (stock_id, date) pair so ON CONFLICT never sees it twice
+        cur.execute("""
+            INSERT INTO StockData (stock_id, date, open, high, low, close, volume, dividends, stock_splits, updated_at)
+            SELECT DISTINCT ON (stock_id, date::date)
+                stock_id, date::date, open, high, low, close, volume, dividends, stock_splits, %s
+            FROM StockDataStaging
+            ORDER BY stock_id, date::date, seq DESC
+            ON CONFLICT (stock_id, date) DO UPDATE SET
+            open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low,
+            close = EXCLUDED.close, volume = EXCLUDED.volume, dividends = EXCLUDED.dividends,
+            stock_splits = EXCLUDED.stock_splits, updated_at = EXCLUDED.updated_at
+        """, (datetime.now(),))
+        cur.execute("TRUNCATE StockDataStaging")
+
+    elapsed = time.perf_counter() - start
+    metrics.record_stage('bulk_upsert', elapsed)
+    rate = rows / elapsed if elapsed > 0 else float('inf')
+    print(f"Bulk upserted {rows} StockData rows for {len(batch)} tickers in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+    return rows
+
+# Function to flush buffered histories into StockData within the current transaction. When the bulk
+# flush fails (e.g. one ticker's value is out of range), each ticker is written again in its own
+# savepoint and only the ones that still fail are taken out of the batch.
+def flush_pending_stock_data(uow, pending):
+    if not pending:
+        return
+    # Cleared up front: on failure the buffered rows must not be retried against a rolled back batch
+    batch = list(pending)
+    pending.clear()
+    try:
+        with uow.savepoint('stock_data_flush'):
+            uow.count('StockData', bulk_insert_stock_data(uow.conn, [(stock_id, data) for _, stock_id, data in batch]))
+        return
+    except Exception as e:
+        print(f"Bulk flush of {len(batch)} tickers failed, writing them one by one: {e}")
+        metrics.add('bulk_flush_retries')
+    for ticker, stock_id, data in batch:
+        try:
+            with uow.savepoint('stock_data_flush'):
+                uow.count('StockData', bulk_insert_stock_data(uow.conn, [(stock_id, data)]))
+        except Exception as e:
+            print(f"Error writing the history of {ticker}: {e}")
+            uow.fail_ticker(ticker, e)
 
 # Function to insert fundamental data
 def insert_fundamentals(conn, stock_id, date, info):
@@ -196,7 +379,121 @@ def insert_fundamentals(conn, stock_id, date, info):
             info.get('dividendYield'),
             datetime.now()
         ))
+
+FUNDAMENTAL_FIELDS = [
+    ('market_cap', 'marketCap', 'BIGINT'),
+    ('enterprise_value', 'enterpriseValue', 'BIGINT'),
+    ('trailing_pe', 'trailingPE', 'REAL'),
+    ('forward_pe', 'forwardPE', 'REAL'),
+    ('peg_ratio', 'pegRatio', 'REAL'),
+    ('price_to_book', 'priceToBook', 'REAL'),
+    ('dividend_yield', 'dividendYield', 'REAL'),
+]
+
+# Function to store a stock.info snapshot only when it differs from the one in force on that date.
+# The comparison runs in SQL against the column types, so REAL rounding never looks like a change.
+# Returns True when a row was written.
+def insert_fundamentals_snapshot(conn, stock_id, date, info):
+    columns = ', '.join(column for column, _, _ in FUNDAMENTAL_FIELDS)
+    casts = ', '.join(f"%s::{sql_type}" for _, _, sql_type in FUNDAMENTAL_FIELDS)
+    values = [info.get(key) for _, key, _ in FUNDAMENTAL_FIELDS]
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            WITH latest AS (
+                SELECT {columns} FROM Fundamentals
+                WHERE stock_id = %s AND date <= %s
+                ORDER BY date DESC LIMIT 1
+            )
+            INSERT INTO Fundamentals (stock_id, date, {columns}, updated_at)
+            SELECT %s, %s, {casts}, %s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM latest WHERE ({columns}) IS NOT DISTINCT FROM ({casts})
+            )
+            ON CONFLICT (stock_id, date) DO UPDATE SET
+            market_cap = EXCLUDED.market_cap, enterprise_value = EXCLUDED.enterprise_value,
+            trailing_pe = EXCLUDED.trailing_pe, forward_pe = EXCLUDED.forward_pe,
+            peg_ratio = EXCLUDED.peg_ratio, price_to_book = EXCLUDED.price_to_book,
+            dividend_yield = EXCLUDED.dividend_yield, updated_at = EXCLUDED.updated_at
+        """, [stock_id, date, stock_id, date] + values + [datetime.now()] + values)
+        return cur.rowcount > 0
+
+# Function to resolve the fundamentals valid on a given date: the latest snapshot on or before it,
+# or the earliest snapshot for dates before the stock was first fetched
+def get_fundamentals_as_of(conn, stock_id, date):
+    columns = ', '.join(column for column, _, _ in FUNDAMENTAL_FIELDS)
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT date, {columns} FROM Fundamentals
+            WHERE stock_id = %s
+            ORDER BY date > %s, CASE WHEN date <= %s THEN date END DESC, date
+            LIMIT 1
+        """, (stock_id, date, date))
+        row = cur.fetchone()
+    if row is None:
+        return None
+    return dict(zip(['date'] + [column for column, _, _ in FUNDAMENTAL_FIELDS], row))
+
+# Function to collapse the legacy one-row-per-trading-day Fundamentals history into change points
+def compact_fundamentals(conn):
+    columns = ', '.join(column for column, _, _ in FUNDAMENTAL_FIELDS)
+    previous = ', '.join(f"LAG({column}) OVER w" for column, _, _ in FUNDAMENTAL_FIELDS)
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            DELETE FROM Fundamentals f
+            USING (
+                SELECT id, ({columns}) IS NOT DISTINCT FROM ({previous}) AS unchanged,
+                       ROW_NUMBER() OVER w AS rn
+                FROM Fundamentals
+                WINDOW w AS (PARTITION BY stock_id ORDER BY date)
+            ) d
+            WHERE f.id = d.id AND d.rn > 1 AND d.unchanged
+        """)
+        removed = cur.rowcount
         conn.commit()
+    print(f"Compacted Fundamentals: removed {removed} unchanged daily rows")
+    return removed
+
+# Name under which the StockData date shift is recorded in SchemaMigration
+STOCK_DATA_DATES_MIGRATION = 'stockdata_exchange_dates'
+
+# Tables derived from StockData dates; the cruncher rebuilds them from scratch when they are empty
+STOCK_DATA_DERIVED_TABLES = ['StockIndicators', 'MarketBreadth']
+
+# Function to move StockData rows written under a UTC session to their exchange session dates.
+# Casting midnight-IST bars to DATE in UTC stored each bar one day early: Monday's bar sits on a
+# Sunday and no bar lands on a Friday. prepare_db runs this before any writer, so every stored row
+# is in the old convention; a server already running in the exchange time zone has Friday rows and
+# is left alone. The shift is one transaction, as a partly shifted table could not be told apart
+# on a rerun.
+def migrate_stock_data_dates(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM SchemaMigration WHERE name = %s", (STOCK_DATA_DATES_MIGRATION,))
+        if cur.fetchone():
+            return 0
+        cur.execute("""
+            SELECT COUNT(*) FILTER (WHERE EXTRACT(ISODOW FROM date) = 7),
+                   COUNT(*) FILTER (WHERE EXTRACT(ISODOW FROM date) = 5)
+            FROM StockData
+        """)
+        sundays, fridays = cur.fetchone()
+        shifted = 0
+        if sundays > fridays:
+            started = time.perf_counter()
+            # (stock_id, date) is unique and checked row by row, so shifting by one day in place would
+            # collide with the next row; move everything far ahead first, then back to date + 1
+            cur.execute("UPDATE StockData SET date = date + 100001")
+            shifted = cur.rowcount
+            # Touching updated_at hands every moved row to the watermark-driven readers (indicatorengine)
+            cur.execute("UPDATE StockData SET date = date - 100000, updated_at = %s", (datetime.now(),))
+            for table in STOCK_DATA_DERIVED_TABLES:
+                cur.execute("SELECT to_regclass(%s)", (table,))
+                if cur.fetchone()[0]:
+                    cur.execute(f"TRUNCATE {table}")
+            print(f"Moved {shifted} StockData rows to their exchange session dates in {time.perf_counter() - started:.1f}s")
+        cur.execute("INSERT INTO SchemaMigration (name) VALUES (%s) ON CONFLICT (name) DO NOTHING",
+                    (STOCK_DATA_DATES_MIGRATION,))
+    conn.commit()
+    return shifted
 
 # Function to insert financial data
 # def insert_financials(conn, stock_id, date, statement_type, data):
@@ -211,9 +508,10 @@ def insert_fundamentals(conn, stock_id, date, info):
 #         conn.commit()
         
 def insert_financials(conn, stock_id, date, statement_type, data):
+    updated_at = datetime.now()
     with conn.cursor() as cur:
-        # Replace NaN with None and convert DataFrame to JSON
-        json_data = data.where(pd.notnull(data), None).to_json()
+        # Mask NaN/Inf (written as null) and convert DataFrame to JSON
+        json_data = mask_non_finite(data).to_json()
 
         cur.execute("""
             INSERT INTO Financials (
@@ -221,80 +519,347 @@ def insert_financials(conn, stock_id, date, statement_type, data):
             ) VALUES (%s, %s, %s, %s, %s)
             ON CONFLICT (stock_id, date, statement_type) DO UPDATE SET
             data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
-        """, (stock_id, date, statement_type, json_data, datetime.now()))
-        conn.commit()
-
-# Function to determine the period for data fetching
-def determine_period(days_gap):
-    periods = ["1d", "5d", "1mo", "3mo", "6mo", "1y", "2y", "5y", "10y", "ytd", "max"]
-    thresholds = [1, 5, 30, 90, 180, 365, 730, 1825, 3650, 365, 10000]
+        """, (stock_id, date, statement_type, json_data, updated_at))
+    # Same column as typed rows; returns the number of line items written
+    return write_line_items(conn, stock_id, date, statement_type, data, updated_at, line_item_names)
 
-    for period, threshold in zip(periods, thresholds):
-        if days_gap <= threshold:
-            return period
-    return "max"
-
-def fetch_stock_data(ticker, period):
-    periods = ["1d", "5d", "1mo", "3mo", "6mo", "1y", "2y", "5y", "10y", "ytd", "max"]
-    start_index = periods.index(period)
+# Function to fetch the daily history for the sessions in [start, end); start=None fetches everything.
+# An empty result means there are no new sessions, so the range is never widened and retried.
+def fetch_stock_data(ticker, start, end, throttle=None):
+    try:
+        if throttle:
+            throttle()
+        stock = load_yfinance().Ticker(ticker + '.NS')
+        if start is None:
+            data = stock.history(period='max')
+        else:
+            data = stock.history(start=start.isoformat(), end=end.isoformat())
+    except Exception as e:
+        print(f"Error fetching data for {ticker} from {start or 'listing'} to {end}: {e}")
+        metrics.add('fetch_errors')
+        return pd.DataFrame()
+    # Drop anything past the last settled session (e.g. today's partial bar)
+    return data[data.index.date < end] if not data.empty else data
 
-    for p in periods[start_index:]:
-        try:
-            data = yf.Ticker(ticker + '.NS').history(period=p)
-            if not data.empty:
-                return data
-        except Exception as e:
-            print(f"Error fetching data for period {p}: {e}")
-    return pd.DataFrame()
+# Function to open the Postgres connection used by the writers
+def connect_db():
+    return psycopg2.connect(
+        dbname=os.environ['DB_NAME'],
+        user=os.environ['DB_USER'],
+        password=os.environ['DB_PASSWORD'],
+        host='postgres',  # This refers to the service name in docker-compose
+        port='5432',
+        # History timestamps are midnight exchange time; casting them to DATE in UTC would shift a day back
+        options=f"-c timezone={EXCHANGE_TIMEZONE}"
+    )
 
-# Main function to retrieve data and store it in the database
-def main(tickers):
-    conn = psycopg2.connect(
+# Function to create the connection pool shared by the writers
+def create_connection_pool(maxconn):
+    return psycopg2.pool.ThreadedConnectionPool(
+        1, maxconn,
         dbname=os.environ['DB_NAME'],
         user=os.environ['DB_USER'],
         password=os.environ['DB_PASSWORD'],
         host='postgres',  # This refers to the service name in docker-compose
-        port='5432'
+        port='5432',
+        # History timestamps are midnight exchange time; casting them to DATE in UTC would shift a day back
+        options=f"-c timezone={EXCHANGE_TIMEZONE}"
     )
+
+# Function to load the latest StockData date of every known ticker in one query
+def load_last_dates(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT s.ticker, MAX(sd.date)
+            FROM Stock s
+            LEFT JOIN StockData sd ON sd.stock_id = s.id
+            GROUP BY s.ticker
+        """)
+        return dict(cur.fetchall())
+
+# Function to load the latest known market cap of every ticker (for the scheduler's priorities)
+def load_market_caps(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT DISTINCT ON (s.id) s.ticker, f.market_cap
+            FROM Stock s
+            JOIN Fundamentals f ON f.stock_id = s.id
+            ORDER BY s.id, f.date DESC
+        """)
+        return dict(cur.fetchall())
+
+# Function to download everything needed for one ticker (network only, no DB access)
+def fetch_ticker_payload(ticker, history_range, throttle=None, data=None):
+    started = time.perf_counter()
+    stock = load_yfinance().Ticker(ticker + '.NS')
+
+    # Time spent waiting on the rate limiter is reported apart from the requests themselves
+    def wait():
+        if throttle:
+            with metrics.stage('throttle'):
+                throttle()
+
+    if data is None:
+        wait()
+        with metrics.stage('history'):
+            data = fetch_stock_data(ticker, *history_range)
+
+    # Requests for stock.info and the statements, served from the fetch cache when it is enabled
+    def request(kind, attribute):
+        def load():
+            wait()
+            with metrics.stage(kind):
+                value = getattr(stock, attribute)
+            metrics.add('bytes_fetched', value_bytes(value))
+            return value
+        if fetch_cache is None:
+            return load(), None
+        return fetch_cache.get(ticker, kind, load)
+
+    info, _ = request('info', 'info')
+    statements = []
+    digests = {}
+    for statement_type, attribute in [("balance_sheet", "balance_sheet"),
+                                      ("income_statement", "financials"),
+                                      ("cash_flow", "cashflow")]:
+        statement_data, digests[statement_type] = request(statement_type, attribute)
+        statements.append((statement_type, statement_data))
+
+    metrics.add('bytes_fetched', value_bytes(data))
+    metrics.add('history_rows_fetched', len(data))
+    return {'ticker': ticker, 'data': data, 'info': info, 'statements': statements, 'digests': digests,
+            'fetch_seconds': time.perf_counter() - started}
+
+# Function to estimate the size of a fetched value. yfinance does not expose wire sizes, so this is
+# the decoded size: frame memory, or the JSON length of stock.info
+def value_bytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    return len(json.dumps(value, default=str)) if value else 0
+
+# Function to append a ticker's history to the local price cache; a cache failure never fails the fetch
+def cache_prices(ticker, data):
+    try:
+        price_cache.append(ticker, data)
+    except Exception as e:
+        print(f"Error caching prices for {ticker}: {e}")
+
+# Function to write one fetched payload inside the unit of work. done(ticker), e.g. the scheduler's
+# completion, only runs after the transaction holding its writes (and, in bulk mode, its flushed
+# history) commits; failed(ticker, error) runs instead if that transaction is rolled back. A failure
+# of the ticker's own writes is raised to the caller.
+def store_ticker_payload(uow, payload, pending, done=None, failed=None):
+    started = time.perf_counter()
+    ticker = payload['ticker']
+    data = payload['data']
+    written = []
+    with uow.ticker(ticker) as conn:
+        stock_id = insert_stock(conn, ticker)
+
+        if BULK_BATCH_SIZE <= 0:
+            with metrics.stage('db_stock_data'):
+                insert_stock_data(conn, stock_id, data)
+            uow.count('StockData', len(data))
+
+        # Insert the fundamentals snapshot; unchanged stock.info values do not add a row
+        with metrics.stage('db_fundamentals'):
+            if insert_fundamentals_snapshot(conn, stock_id, datetime.now().date(), payload['info']):
+                uow.count('Fundamentals', 1)
+
+        # Insert financial data; a statement whose content digest matches the last committed one is skipped
+        with metrics.stage('db_financials'):
+            for statement_type, statement_data in payload['statements']:
+                digest = payload.get('digests', {}).get(statement_type)
+                if digest and fetch_cache is not None:
+                    if fetch_cache.is_written(ticker, statement_type, digest):
+                        metrics.add('statements_unchanged')
+                        continue
+                    written.append((statement_type, digest))
+                for date in statement_data.columns:
+                    line_items = insert_financials(conn, stock_id, pd.to_datetime(date).to_pydatetime(), statement_type, statement_data[date])
+                    uow.count('Financials', 1)
+                    uow.count('FinancialLineItem', line_items)
+
+    if BULK_BATCH_SIZE > 0:
+        pending.append((ticker, stock_id, data))
+    for kind, digest in written:
+        uow.after_commit(lambda kind=kind, digest=digest: fetch_cache.mark_written(ticker, kind, digest), ticker)
+    if price_cache is not None:
+        uow.after_commit(lambda: cache_prices(ticker, data), ticker)
+    if done is not None:
+        uow.after_commit(lambda: done(ticker), ticker)
+    if failed is not None:
+        uow.after_rollback(lambda error: failed(ticker, error), ticker)
+    # From here on the ticker shares its batch's fate: if the commit fails, the whole batch rolls back
+    # and each of its tickers, this one included, is failed by its rollback callback. A ticker whose
+    # history alone breaks the bulk flush is failed on its own (see flush_pending_stock_data).
+    try:
+        if BULK_BATCH_SIZE > 0 and len(pending) >= BULK_BATCH_SIZE:
+            flush_pending_stock_data(uow, pending)
+        uow.maybe_commit()
+    except Exception as e:
+        print(f"Error writing the batch of {ticker}: {e}")
+        uow.rollback(e)
+        metrics.add('batch_rollbacks')
+    # Per-ticker latency: its own fetch plus write time, excluding queueing and batch commit waits
+    metrics.observe('ticker', payload.get('fetch_seconds', 0.0) + time.perf_counter() - started)
+
+# Function to commit a writer's batch. A failed commit has rolled the batch back and failed its tickers
+# through their rollback callbacks, so the run carries on.
+def commit_batch(uow):
+    try:
+        uow.commit()
+    except Exception as e:
+        print(f"Error committing batch: {e}")
+        metrics.add('batch_rollbacks')
+
+# Function to create the unit of work (and its bulk StockData buffer) for one writer connection
+def create_writer(conn, counter):
+    uow = UnitOfWork(conn, counter=counter)
+    pending = []
+    uow.before_commit(lambda: flush_pending_stock_data(uow, pending))
+    return uow, pending
+
+# Function to create the schema and run the one-off maintenance before any writer starts
+def prepare_db(conn):
     create_db_schema(conn)
+    migrate_stock_data_dates(conn)
+    migrate_financials(conn)
+    if COMPACT_FUNDAMENTALS:
+        compact_fundamentals(conn)
+    conn.commit()
+    # Writers only append what they fetch, so history already in StockData is copied over first
+    if price_cache is not None:
+        try:
+            price_cache.backfill(conn)
+        except Exception as e:
+            print(f"Error backfilling the price cache: {e}")
+        # The backfill only reads; this ends its transaction
+        conn.rollback()
+
+# Main function to retrieve data and store it in the database. shardedingest runs it once per worker
+# process with its own scheduler, the schema already prepared, the run report left to the coordinator
+# and its share of the request rate (rate_per_host, requests per second) and claim size (claim_batch);
+# left as None they come from FETCH_RATE_PER_HOST and HISTORY_BATCH_SIZE/JOB_CLAIM_BATCH.
+def main(tickers, scheduler=None, prepare=True, write_report=True, rate_per_host=None, claim_batch=None):
+    # Import yfinance while the database work below runs
+    threading.Thread(target=load_yfinance, name='import-yfinance', daemon=True).start()
+    create_fetch_cache()
+    global line_item_names
+    pool = create_connection_pool(MAIN_CONNECTIONS)
+    conn = pool.getconn()
+    if prepare:
+        prepare_db(conn)
+    line_item_names = LineItemNames(pool.getconn())
+    last_dates = load_last_dates(conn)
+    market_caps = load_market_caps(conn)
+    conn.commit()
+    counter = ThroughputCounter()
 
-    for ticker in tickers:
-        print(f"Processing {ticker}...")
-        if redis_client.get(ticker):
-            print(f"Skipping {ticker}, already processed.")
+    # Due tickers go into the shared Redis queue; every datafetcher process then claims from it
+    scheduler = scheduler or JobScheduler(get_redis_client())
+    queued = scheduler.schedule(tickers, priority_scores(tickers, market_caps, last_dates))
+    print(f"{queued} of {len(tickers)} tickers due, {scheduler.pending()} waiting in the queue")
+    session = last_completed_session()
+    ranges = {}
+
+    histories = {}
+    limiter = throttle = None
+    if FETCH_WORKERS > 1 or rate_per_host is not None:
+        import fetchpipeline
+        rate = fetchpipeline.FETCH_RATE_PER_HOST if rate_per_host is None else rate_per_host
+        limiter = fetchpipeline.HostRateLimiter(rate=rate)
+        throttle = limiter.throttle_for(fetchpipeline.YAHOO_HOST)
+    if HISTORY_BATCH_SIZE > 0:
+        import batchfetch
+        history_fetcher = batchfetch.BatchHistoryFetcher(empty_store=batchfetch.EmptySymbolStore(get_redis_client()))
+
+    def fetch(ticker, throttle=None):
+        with profile_if_selected(ticker, 'fetch'):
+            return fetch_ticker_payload(ticker, ranges[ticker], throttle, histories.pop(ticker, None))
+
+    # Each pipeline writer thread gets its own pooled connection and unit of work
+    writers = threading.local()
+
+    def store(payload):
+        print(f"Processing {payload['ticker']}...")
+        if not hasattr(writers, 'uow'):
+            writers.uow, writers.pending = create_writer(pool.getconn(), counter)
+        with profile_if_selected(payload['ticker'], 'store'):
+            store_ticker_payload(writers.uow, payload, writers.pending, scheduler.complete, scheduler.fail)
+
+    def writer_done():
+        if hasattr(writers, 'uow'):
+            commit_batch(writers.uow)
+            pool.putconn(writers.uow.conn)
+            del writers.uow, writers.pending
+
+    uow, pending = create_writer(conn, counter)
+    claim_size = claim_batch or (HISTORY_BATCH_SIZE if HISTORY_BATCH_SIZE > 0 else JOB_CLAIM_BATCH)
+    skipped = 0
+    while True:
+        claimed = scheduler.claim(claim_size)
+        if not claimed:
+            # Queue drained: wait for pending retries only if one is due soon
+            wait = scheduler.next_retry_in()
+            if wait is None or wait > JOB_RETRY_WAIT_SECONDS:
+                break
+            time.sleep(wait)
             continue
-        stock_id = insert_stock(conn, ticker)
-        stock = yf.Ticker(ticker + '.NS')
-
-        # Check latest date in StockData
-        with conn.cursor() as cur:
-            cur.execute("SELECT MAX(date) FROM StockData WHERE stock_id = %s", (stock_id,))
-            result = cur.fetchone()
-            last_date = result[0] if result[0] else datetime(1900, 1, 1).date()  # Default to very old date if no data
-            days_gap = (datetime.now().date() - last_date).days
-
-        period = determine_period(days_gap)
-        # Fetch and insert historical stock data
-        data = fetch_stock_data(ticker, period)
-        print(data.columns)  # Print columns to debug the names
-        insert_stock_data(conn, stock_id, data)
-
-        # Fetch and insert daily fundamental data
-        info = stock.info
-        for date in data.index:
-            insert_fundamentals(conn, stock_id, date.to_pydatetime(), info)
-
-        # Fetch and insert financial data
-        for statement_type, statement_data in [("balance_sheet", stock.balance_sheet),
-                                               ("income_statement", stock.financials),
-                                               ("cash_flow", stock.cashflow)]:
-            for date in statement_data.columns:
-                insert_financials(conn, stock_id, pd.to_datetime(date).to_pydatetime(), statement_type, statement_data[date])
-
-        # Mark ticker as processed in Redis
-        redis_client.set(ticker, 'processed')
-
-    conn.close()
+
+        # Up-to-date tickers are completed before anything touches the network
+        chunk = []
+        for ticker in claimed:
+            history_range = missing_range(last_dates.get(ticker), session)
+            if history_range is None:
+                print(f"Skipping {ticker}, already up to date through {last_dates[ticker]}.")
+                scheduler.complete(ticker)
+                skipped += 1
+                continue
+            ranges[ticker] = history_range
+            chunk.append(ticker)
+
+        if HISTORY_BATCH_SIZE > 0 and chunk:
+            # One multi-symbol download per missing range instead of one history call per ticker
+            with metrics.stage('history_batch'):
+                histories.update(history_fetcher.fetch({ticker: ranges[ticker] for ticker in chunk}, throttle))
+
+        if FETCH_WORKERS > 1:
+            _, failed = fetchpipeline.run_pipeline(chunk, fetch, store, FETCH_WORKERS, limiter=limiter,
+                                                   writers=WRITE_WORKERS, writer_done=writer_done,
+                                                   on_failure=scheduler.fail)
+            metrics.add('pipeline_failures', failed)
+            continue
+        for ticker in chunk:
+            print(f"Processing {ticker}...")
+            # Fetch and store historical, fundamental and financial data
+            try:
+                payload = fetch(ticker, throttle)
+                with profile_if_selected(ticker, 'store'):
+                    store_ticker_payload(uow, payload, pending, scheduler.complete, scheduler.fail)
+            except Exception as e:
+                print(f"Error storing {ticker}: {e}")
+                metrics.add('store_errors')
+                scheduler.fail(ticker, e)
+        # Commit per claim so completions are recorded well within the leases
+        commit_batch(uow)
+
+    commit_batch(uow)
+    pool.putconn(conn)
+    pool.putconn(line_item_names.conn)
+    line_item_names = None
+    pool.closeall()
+    if fetch_cache is not None:
+        fetch_cache.drain()
+    print(counter.report())
+    for table, rows in counter.rows.items():
+        metrics.add(f"rows_written_{table.lower()}", rows)
+    metrics.add('tickers_committed', counter.tickers)
+    metrics.add('tickers_failed', counter.failed)
+    metrics.add('tickers_not_due', len(tickers) - queued)
+    metrics.add('tickers_up_to_date', skipped)
+    if write_report:
+        metrics.write()
     print("Data retrieval and storage complete.")
 
 if __name__ == "__main__":
@@ -302,8 +867,6 @@ if __name__ == "__main__":
     # tickers = ['AAPL', 'MSFT', 'GOOGL']
     # main(tickers)
 
-    excel_file_path = './MCAP28032024.xlsx'
-    # Load the symbols from the Excel file
-    df = pd.read_excel(excel_file_path)
-    symbols = df['Symbol'].tolist()
+    # Load the symbols from the Excel file (through its compiled sidecar, see symboluniverse)
+    symbols = load_symbols()
     main(symbols)
@@ -0,0 +1,52 @@
+import os
+
+# Postgres helpers shared by dailydatacruncher and the engines it runs (indicatorengine, marketbreadth).
+# Like summarysql it imports none of them, so the cruncher can import the engines at module level.
+
+# Database connection parameters
+db_params = {
+    'dbname': os.environ['DB_NAME'],  # replace with your actual database name
+    'user': os.environ['DB_USER'],    # replace with your actual database user
+    'password': os.environ['DB_PASSWORD'],  # replace with your actual database password
+    'host': 'postgres',
+    'port': '5432',
+}
+
+# Rows per round trip when a query is streamed through a server-side cursor
+CRUNCH_STREAM_CHUNK = int(os.environ.get('CRUNCH_STREAM_CHUNK', '5000'))
+
+_stream_cursor_seq = 0
+
+# Function to stream rows through a named (server-side) cursor, CRUNCH_STREAM_CHUNK rows per round trip,
+# so only one chunk is ever held in memory regardless of table size
+def stream_rows(conn, query, chunk_size=None, params=None):
+    global _stream_cursor_seq
+    _stream_cursor_seq += 1
+    with conn.cursor(name=f"crunch_stream_{_stream_cursor_seq}") as cursor:
+        cursor.itersize = chunk_size or CRUNCH_STREAM_CHUNK
+        cursor.execute(query, params)
+        for row in cursor:
+            yield row
+
+# Function to create the table of named watermarks: the updated_at up to which a derived table has
+# consumed its source rows
+def create_watermark_schema(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS CrunchWatermark (
+            name TEXT PRIMARY KEY,
+            watermark TIMESTAMP NOT NULL
+        )
+    """)
+
+# Function to read a watermark, or None before its first run
+def get_watermark(cur, name):
+    cur.execute("SELECT watermark FROM CrunchWatermark WHERE name = %s", (name,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+# Function to store a watermark
+def set_watermark(cur, name, watermark):
+    cur.execute("""
+        INSERT INTO CrunchWatermark (name, watermark) VALUES (%s, %s)
+        ON CONFLICT (name) DO UPDATE SET watermark = EXCLUDED.watermark
+    """, (name, watermark))
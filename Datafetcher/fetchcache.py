@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+# Redis cache in front of the slow-changing yfinance calls (stock.info and the three statements).
+# Each entry keeps the fetched value, when it was fetched and a content digest. Within its TTL an
+# entry is served as is; for its stale window after that it is still served while a background refresh
+# replaces it (stale-while-revalidate); past that it is fetched inline. Digests of what was
+# last written to the database let datafetcher skip rewriting unchanged statements.
+
+# stock.info feeds the daily fundamentals snapshot, so it is never served much older than a day;
+# statements change quarterly
+INFO_TTL_HOURS = float(os.environ.get('FETCH_CACHE_INFO_TTL_HOURS', '12'))
+INFO_STALE_HOURS = float(os.environ.get('FETCH_CACHE_INFO_STALE_HOURS', '12'))
+STATEMENT_TTL_HOURS = float(os.environ.get('FETCH_CACHE_STATEMENT_TTL_HOURS', '168'))
+STATEMENT_STALE_HOURS = float(os.environ.get('FETCH_CACHE_STATEMENT_STALE_HOURS', '336'))
+FETCH_CACHE_TTL_HOURS = {
+    'info': (INFO_TTL_HOURS, INFO_STALE_HOURS),
+    'balance_sheet': (STATEMENT_TTL_HOURS, STATEMENT_STALE_HOURS),
+    'income_statement': (STATEMENT_TTL_HOURS, STATEMENT_STALE_HOURS),
+    'cash_flow': (STATEMENT_TTL_HOURS, STATEMENT_STALE_HOURS),
+}
+FETCH_CACHE_REVALIDATE_WORKERS = int(os.environ.get('FETCH_CACHE_REVALIDATE_WORKERS', '2'))
+
+CACHE_KEY_PREFIX = 'fetchcache:'
+WRITTEN_KEY_PREFIX = 'fetchcache:written:'
+REFRESH_LOCK_MS = 10 * 60 * 1000
+
+
+# Function to fingerprint a fetched value; frames hash their values, index and columns
+def content_digest(value):
+    digest = hashlib.sha1()
+    if isinstance(value, pd.DataFrame):
+        digest.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+        digest.update(json.dumps([str(column) for column in value.columns]).encode())
+    else:
+        digest.update(json.dumps(value, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+# Function to tell whether a fetched value is worth caching (yfinance returns empty frames/dicts on errors)
+def is_cacheable(value):
+    if value is None:
+        return False
+    if isinstance(value, pd.DataFrame):
+        return not value.empty
+    return bool(value)
+
+
+# Function to turn a value the JSON encoder does not know into one it does (numpy scalars, timestamps)
+def json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not cacheable")
+
+
+# Function to encode one frame axis; dates are tagged so they come back as a DatetimeIndex
+def encode_axis(axis):
+    if isinstance(axis, pd.DatetimeIndex):
+        return {'dates': [label.isoformat() for label in axis]}
+    return {'labels': axis.tolist()}
+
+
+# Function to rebuild a frame axis written by encode_axis
+def decode_axis(encoded):
+    if 'dates' in encoded:
+        return pd.DatetimeIndex(encoded['dates'])
+    return pd.Index(encoded['labels'])
+
+
+# Function to serialize a cache entry as compressed JSON. Data only: a frame is stored as its axes and
+# values, so reading an entry back never runs code, whoever wrote it. Floats round-trip exactly.
+def encode_entry(entry):
+    value = entry['value']
+    if isinstance(value, pd.DataFrame):
+        value = {'frame': {'index': encode_axis(value.index), 'columns': encode_axis(value.columns),
+                           'data': value.to_numpy().tolist()}}
+    else:
+        value = {'json': value}
+    return zlib.compress(json.dumps(dict(entry, value=value), default=json_default).encode())
+
+
+# Function to read back an entry written by encode_entry; raises on anything else (e.g. an old pickled entry)
+def decode_entry(raw):
+    entry = json.loads(zlib.decompress(raw))
+    entry['fetched_at'] = float(entry['fetched_at'])
+    value = entry['value']
+    if 'frame' in value:
+        frame = value['frame']
+        entry['value'] = pd.DataFrame(frame['data'], index=decode_axis(frame['index']), columns=decode_axis(frame['columns']))
+    else:
+        entry['value'] = value['json']
+    return entry
+
+
+# Cache of yfinance call results. redis_client must not decode responses: entries are compressed JSON.
+# Redis errors never fail a fetch, and entries that do not decode are misses: the cache then behaves
+# as if it were empty.
+class FetchCache:
+    # ttl_hours maps each kind to (fresh hours, stale hours)
+    def __init__(self, redis_client, ttl_hours=None, metrics=None, revalidate_workers=FETCH_CACHE_REVALIDATE_WORKERS):
+        self.redis_client = redis_client
+        self.ttl_hours = ttl_hours or FETCH_CACHE_TTL_HOURS
+        self.metrics = metrics
+        self.executor = ThreadPoolExecutor(max_workers=max(revalidate_workers, 1), thread_name_prefix='revalidate')
+        self.pending = []
+        self.pending_lock = threading.Lock()
+
+    def _count(self, event):
+        if self.metrics is not None:
+            self.metrics.add(f"fetch_cache_{event}")
+
+    def _read(self, key):
+        raw = self.redis_client.get(key)
+        if not raw:
+            return None
+        try:
+            return decode_entry(raw)
+        except (zlib.error, ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring undecodable fetch cache entry {key}: {e}")
+            self._count('decode_errors')
+            return None
+
+    def _write(self, key, kind, value):
+        entry = {'fetched_at': time.time(), 'digest': content_digest(value), 'value': value}
+        expiry = int(sum(self.ttl_hours[kind]) * 3600)
+        self.redis_client.set(key, encode_entry(entry), ex=max(expiry, 1))
+        return entry
+
+    def _load(self, key, kind, loader):
+        value = loader()
+        if is_cacheable(value):
+            try:
+                return self._write(key, kind, value)
+            except Exception as e:
+                print(f"Error writing {key} to the fetch cache: {e}")
+        return {'fetched_at': time.time(), 'digest': None, 'value': value}
+
+    def _revalidate(self, key, kind, loader):
+        try:
+            self._load(key, kind, loader)
+            self._count('revalidated')
+            self.redis_client.delete(key + ':refreshing')
+        except Exception as e:
+            # The refresh lock expires on its own
+            print(f"Error revalidating {key}: {e}")
+
+    # Function to return (value, digest) for one ticker's call of the given kind; loader does the request.
+    # The digest is None when the value was not cacheable (e.g. an empty response).
+    def get(self, ticker, kind, loader):
+        key = f"{CACHE_KEY_PREFIX}{kind}:{ticker}"
+        try:
+            entry = self._read(key)
+        except Exception as e:
+            print(f"Error reading {key} from the fetch cache: {e}")
+            entry = None
+
+        if entry is not None:
+            fresh_hours, stale_hours = self.ttl_hours[kind]
+            age_hours = (time.time() - entry['fetched_at']) / 3600
+            if age_hours < fresh_hours:
+                self._count('hits')
+                return entry['value'], entry['digest']
+            if age_hours < fresh_hours + stale_hours:
+                self._count('stale_hits')
+                # Only one worker refreshes a given key at a time
+                if self._claim_refresh(key):
+                    future = self.executor.submit(self._revalidate, key, kind, loader)
+                    with self.pending_lock:
+                        self.pending.append(future)
+                return entry['value'], entry['digest']
+
+        self._count('misses')
+        entry = self._load(key, kind, loader)
+        return entry['value'], entry['digest']
+
+    def _claim_refresh(self, key):
+        try:
+            return self.redis_client.set(key + ':refreshing', b'1', nx=True, px=REFRESH_LOCK_MS)
+        except Exception as e:
+            print(f"Error locking {key} for refresh: {e}")
+            return False
+
+    # Function to check whether the content with this digest is what was last written to the database
+    def is_written(self, ticker, kind, digest):
+        try:
+            written = self.redis_client.hget(WRITTEN_KEY_PREFIX + ticker, kind)
+        except Exception as e:
+            print(f"Error reading written digests of {ticker}: {e}")
+            return False
+        return written is not None and written.decode() == digest
+
+    # Function to remember the digest of what was just committed to the database
+    def mark_written(self, ticker, kind, digest):
+        try:
+            self.redis_client.hset(WRITTEN_KEY_PREFIX + ticker, kind, digest)
+        except Exception as e:
+            print(f"Error recording written digest of {ticker}: {e}")
+
+    # Function to wait for background refreshes at the end of a run
+    def drain(self):
+        with self.pending_lock:
+            pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,118 @@
+import os
+import queue
+import threading
+import time
+
+# Pipeline settings; the number of workers itself comes from FETCH_WORKERS in datafetcher
+FETCH_QUEUE_SIZE = int(os.environ.get('FETCH_QUEUE_SIZE', '16'))
+FETCH_RATE_PER_HOST = float(os.environ.get('FETCH_RATE_PER_HOST', '4'))  # requests per second
+FETCH_BURST_PER_HOST = int(os.environ.get('FETCH_BURST_PER_HOST', '4'))
+
+YAHOO_HOST = 'query2.finance.yahoo.com'
+
+_DONE = object()
+
+
+# Token bucket rate limiter keyed by host, shared by all fetch workers
+class HostRateLimiter:
+    def __init__(self, rate=FETCH_RATE_PER_HOST, burst=FETCH_BURST_PER_HOST):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def acquire(self, host):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                tokens, last = self.buckets.get(host, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                if tokens >= 1:
+                    self.buckets[host] = (tokens - 1, now)
+                    return
+                self.buckets[host] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+
+    def throttle_for(self, host):
+        return lambda: self.acquire(host)
+
+
+# Function to run fetch workers concurrently and feed the writer stage through a bounded queue.
+# fetch(ticker, throttle) does network I/O only and returns a payload; store(payload) runs on one of
+# `writers` writer threads (each caller-side writer keeps its own DB connection), and writer_done()
+# runs on each writer thread once the queue is drained. on_failure(ticker, error) is called for every
+# ticker whose fetch or store raised. Fetch workers block on the full queue when the writers fall
+# behind, which keeps at most queue_size payloads in memory.
+def run_pipeline(tickers, fetch, store, workers, queue_size=FETCH_QUEUE_SIZE, limiter=None, host=YAHOO_HOST,
+                 writers=1, writer_done=None, on_failure=None):
+    limiter = limiter or HostRateLimiter()
+    throttle = limiter.throttle_for(host)
+    results = queue.Queue(maxsize=max(queue_size, 1))
+    pending = iter(tickers)
+    pending_lock = threading.Lock()
+    stats_lock = threading.Lock()
+    stats = {'stored': 0, 'failed': 0}
+
+    def next_ticker():
+        with pending_lock:
+            return next(pending, None)
+
+    def record(outcome, ticker=None, error=None):
+        with stats_lock:
+            stats[outcome] += 1
+        if on_failure and error is not None:
+            try:
+                on_failure(ticker, error)
+            except Exception as e:
+                print(f"Error recording failure of {ticker}: {e}")
+
+    def fetch_worker():
+        while True:
+            ticker = next_ticker()
+            if ticker is None:
+                break
+            try:
+                results.put((ticker, fetch(ticker, throttle), None))
+            except Exception as e:
+                results.put((ticker, None, e))
+
+    def writer():
+        try:
+            while True:
+                item = results.get()
+                if item is _DONE:
+                    break
+                ticker, payload, error = item
+                if error is not None:
+                    print(f"Error fetching {ticker}: {error}")
+                    record('failed', ticker, error)
+                    continue
+                try:
+                    store(payload)
+                    record('stored')
+                except Exception as e:
+                    print(f"Error storing {ticker}: {e}")
+                    record('failed', ticker, e)
+        finally:
+            if writer_done:
+                try:
+                    writer_done()
+                except Exception as e:
+                    print(f"Error finishing writer: {e}")
+
+    fetchers = [threading.Thread(target=fetch_worker, name=f"fetch-worker-{i}", daemon=True) for i in range(workers)]
+    writer_threads = [threading.Thread(target=writer, name=f"writer-{i}", daemon=True) for i in range(max(writers, 1))]
+    for thread in fetchers + writer_threads:
+        thread.start()
+    for thread in fetchers:
+        thread.join()
+    for _ in writer_threads:
+        results.put(_DONE)
+    for thread in writer_threads:
+        thread.join()
+
+    print(f"Pipeline finished: {stats['stored']} tickers stored, {stats['failed']} failed")
+    return stats['stored'], stats['failed']
@@ -0,0 +1,323 @@
+import io
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from dbutil import create_watermark_schema, db_params, get_watermark, set_watermark, stream_rows
+
+# Technical indicators materialized into StockIndicators after each fetch. Windows count trading
+# rows (not calendar days). All tickers are computed at once on a (row, ticker) matrix in which
+# every ticker's closes are right-aligned, so row t - 1 is always the ticker's previous session.
+SMA_WINDOWS = [20, 50, 100, 200]
+EMA_SPANS = [12, 26, 50, 200]
+RSI_PERIOD = 14
+YEAR_WINDOW = 252
+RETURN_WINDOWS = [1, 5, 21, 252]
+
+# Calendar days of history re-read before the last computed date so the longest window is full again
+LOOKBACK_DAYS = int(os.environ.get('INDICATOR_LOOKBACK_DAYS', '400'))
+# Stocks loaded, computed and written per chunk, so a full build never holds the whole history
+INDICATOR_CHUNK_STOCKS = int(os.environ.get('INDICATOR_CHUNK_STOCKS', '200'))
+# StockData rows updated this long before the watermark are re-read, so late commits are never missed
+INDICATOR_OVERLAP = timedelta(minutes=int(os.environ.get('INDICATOR_OVERLAP_MINUTES', '60')))
+INDICATOR_WATERMARK = 'stockIndicators'
+
+INDICATOR_COLUMNS = (
+    ['close']
+    + [f"sma_{window}" for window in SMA_WINDOWS]
+    + [f"ema_{span}" for span in EMA_SPANS]
+    + ['rsi_14', 'rsi_avg_gain', 'rsi_avg_loss', 'high_52w', 'low_52w']
+    + [f"return_{window}d" for window in RETURN_WINDOWS]
+)
+
+
+# Function to create the StockIndicators table
+def create_indicator_schema(conn):
+    columns = ',\n                '.join(f"{column} DOUBLE PRECISION" for column in INDICATOR_COLUMNS)
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS StockIndicators (
+                stock_id INTEGER NOT NULL REFERENCES Stock(id),
+                date DATE NOT NULL,
+                {columns},
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (stock_id, date)
+            )
+        """)
+        # The screeners read the latest row of every stock
+        cur.execute("CREATE INDEX IF NOT EXISTS stockindicators_date_idx ON StockIndicators (date, stock_id)")
+        create_watermark_schema(cur)
+    conn.commit()
+
+
+# Function to find the stocks with new StockData and their last indicator date (None for new stocks).
+# Only StockData rows updated since the watermark are read (served by stockdata_updated_at_idx); the
+# first run, with no watermark yet, compares every stock. Returns (stale pairs, the watermark to store
+# once they are written).
+def load_stale_stocks(conn):
+    with conn.cursor() as cur:
+        watermark = get_watermark(cur, INDICATOR_WATERMARK)
+        if watermark is None:
+            changed = "SELECT stock_id, MAX(date) AS last_data, MAX(updated_at) AS updated_at FROM StockData GROUP BY stock_id"
+            params = ()
+        else:
+            changed = """
+                SELECT stock_id, MAX(date) AS last_data, MAX(updated_at) AS updated_at
+                FROM StockData WHERE updated_at > %s GROUP BY stock_id
+            """
+            params = (watermark - INDICATOR_OVERLAP,)
+        cur.execute(f"""
+            WITH changed AS ({changed})
+            SELECT c.stock_id, li.last_date, c.last_data, c.updated_at
+            FROM changed c
+            LEFT JOIN LATERAL (
+                SELECT MAX(date) AS last_date FROM StockIndicators WHERE stock_id = c.stock_id
+            ) li ON TRUE
+            ORDER BY c.stock_id
+        """, params)
+        rows = cur.fetchall()
+    # A stock can change without a new session (e.g. a late correction); its indicators stay as they are
+    stale = [(stock_id, last_date) for stock_id, last_date, last_data, _ in rows
+             if last_date is None or last_data > last_date]
+    updated = [updated_at for *_, updated_at in rows if updated_at is not None]
+    if updated:
+        watermark = max([watermark, *updated]) if watermark is not None else max(updated)
+    return stale, watermark
+
+
+# Function to load, for a chunk of stale (stock_id, last_date) pairs, the closes needed to extend their
+# indicators: the full history for new stocks, otherwise LOOKBACK_DAYS before the last indicator row
+# onwards. Rows are streamed through a named cursor. Returns {stock_id: (dates, closes, last_indicator_date)}.
+def load_close_history(conn, stale):
+    last_dates = dict(stale)
+    history = {}
+    rows = stream_rows(conn, """
+        SELECT sd.stock_id, sd.date, sd.close
+        FROM StockData sd
+        JOIN unnest(%s::integer[], %s::date[]) AS stale(stock_id, last_date) ON stale.stock_id = sd.stock_id
+        WHERE sd.close IS NOT NULL
+          AND (stale.last_date IS NULL OR sd.date > stale.last_date - %s)
+        ORDER BY sd.stock_id, sd.date
+    """, params=(list(last_dates), list(last_dates.values()), timedelta(days=LOOKBACK_DAYS)))
+    for stock_id, date, close in rows:
+        dates, closes, _ = history.setdefault(stock_id, ([], [], last_dates[stock_id]))
+        dates.append(date)
+        closes.append(close)
+    return history
+
+
+# Function to load the recursive state (EMAs, Wilder averages) stored on each stock's last indicator row
+def load_recursive_state(conn, stock_ids):
+    state_columns = [f"ema_{span}" for span in EMA_SPANS] + ['rsi_avg_gain', 'rsi_avg_loss']
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT DISTINCT ON (stock_id) stock_id, {', '.join(state_columns)}
+            FROM StockIndicators
+            WHERE stock_id = ANY(%s)
+            ORDER BY stock_id, date DESC
+        """, (list(stock_ids),))
+        return {row[0]: dict(zip(state_columns, row[1:])) for row in cur.fetchall()}
+
+
+# Function to build the right-aligned (row, ticker) close matrix
+def build_close_matrix(history, stock_ids):
+    length = max(len(history[stock_id][1]) for stock_id in stock_ids)
+    closes = np.full((length, len(stock_ids)), np.nan)
+    starts = np.zeros(len(stock_ids), dtype=np.int64)
+    for column, stock_id in enumerate(stock_ids):
+        values = np.asarray(history[stock_id][1], dtype=np.float64)
+        starts[column] = length - len(values)
+        closes[starts[column]:, column] = values
+    return closes, starts
+
+
+# Function to compute a trailing mean over `window` rows; NaN until the window is full
+def rolling_mean(matrix, window):
+    valid = ~np.isnan(matrix)
+    sums = np.vstack([np.zeros((1, matrix.shape[1])), np.cumsum(np.where(valid, matrix, 0.0), axis=0)])
+    counts = np.vstack([np.zeros((1, matrix.shape[1]), dtype=np.int64), np.cumsum(valid, axis=0)])
+    out = np.full(matrix.shape, np.nan)
+    if window <= matrix.shape[0]:
+        window_sums = sums[window:] - sums[:-window]
+        window_counts = counts[window:] - counts[:-window]
+        out[window - 1:] = np.where(window_counts == window, window_sums / window, np.nan)
+    return out
+
+
+# Function to compute a trailing max/min over up to `window` rows (shorter histories use what exists)
+def rolling_extreme(matrix, window, reducer):
+    padded = np.vstack([np.full((window - 1, matrix.shape[1]), np.nan), matrix])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window, axis=0)
+    return reducer.reduce(windows, axis=-1)
+
+
+# Function to compute the return over `window` rows
+def trailing_return(matrix, window):
+    out = np.full(matrix.shape, np.nan)
+    if window < matrix.shape[0]:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[window:] = matrix[window:] / matrix[:-window] - 1
+    return out
+
+
+# Function to run the EMA recursion across all tickers at once. Rows before `starts` (the already
+# materialized lookback) are skipped; `seed` carries each ticker's last stored EMA (NaN if none).
+def exponential_average(matrix, span, starts, seed):
+    alpha = 2.0 / (span + 1)
+    ema = seed.copy()
+    out = np.full(matrix.shape, np.nan)
+    for row in range(matrix.shape[0]):
+        active = row >= starts
+        price = matrix[row]
+        updated = np.where(np.isnan(ema), price, alpha * price + (1 - alpha) * ema)
+        ema = np.where(active & ~np.isnan(price), updated, ema)
+        out[row] = np.where(active, ema, np.nan)
+    return out
+
+
+# Function to run Wilder's RSI across all tickers at once, continuing from stored average gain/loss
+def wilder_rsi(matrix, starts, seed_gain, seed_loss, period=RSI_PERIOD):
+    avg_gain, avg_loss = seed_gain.copy(), seed_loss.copy()
+    seeded = ~np.isnan(avg_gain) & ~np.isnan(avg_loss)
+    gain_sum = np.zeros(matrix.shape[1])
+    loss_sum = np.zeros(matrix.shape[1])
+    seen = np.zeros(matrix.shape[1], dtype=np.int64)
+    rsi = np.full(matrix.shape, np.nan)
+    gains = np.full(matrix.shape, np.nan)
+    losses = np.full(matrix.shape, np.nan)
+
+    for row in range(1, matrix.shape[0]):
+        change = matrix[row] - matrix[row - 1]
+        usable = (row > starts) | (seeded & (row >= starts))
+        usable &= ~np.isnan(change)
+        gain = np.where(change > 0, change, 0.0)
+        loss = np.where(change < 0, -change, 0.0)
+
+        # Warm-up: plain average of the first `period` changes
+        warming = usable & ~seeded
+        gain_sum = np.where(warming, gain_sum + gain, gain_sum)
+        loss_sum = np.where(warming, loss_sum + loss, loss_sum)
+        seen = np.where(warming, seen + 1, seen)
+        just_seeded = warming & (seen == period)
+        avg_gain = np.where(just_seeded, gain_sum / period, avg_gain)
+        avg_loss = np.where(just_seeded, loss_sum / period, avg_loss)
+
+        smoothing = usable & seeded
+        avg_gain = np.where(smoothing, (avg_gain * (period - 1) + gain) / period, avg_gain)
+        avg_loss = np.where(smoothing, (avg_loss * (period - 1) + loss) / period, avg_loss)
+        seeded = seeded | just_seeded
+
+        emit = seeded & (row >= starts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            value = np.where(avg_loss == 0, 100.0, 100 - 100 / (1 + avg_gain / avg_loss))
+        rsi[row] = np.where(emit, value, np.nan)
+        gains[row] = np.where(emit, avg_gain, np.nan)
+        losses[row] = np.where(emit, avg_loss, np.nan)
+    return rsi, gains, losses
+
+
+# Function to compute every indicator column for the given stocks; returns the matrices by column name,
+# the per-ticker first row that still needs writing, and the stock order of the columns
+def compute_indicators(history, state):
+    stock_ids = sorted(history)
+    closes, starts = build_close_matrix(history, stock_ids)
+    # Rows up to and including the last materialized date are lookback only
+    first_new = starts.copy()
+    for column, stock_id in enumerate(stock_ids):
+        dates, _, last_date = history[stock_id]
+        if last_date is not None:
+            first_new[column] = starts[column] + sum(1 for date in dates if date <= last_date)
+
+    def seed(name):
+        values = [state.get(stock_id, {}).get(name) for stock_id in stock_ids]
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+
+    results = {'close': closes}
+    for window in SMA_WINDOWS:
+        results[f"sma_{window}"] = rolling_mean(closes, window)
+    for span in EMA_SPANS:
+        results[f"ema_{span}"] = exponential_average(closes, span, first_new, seed(f"ema_{span}"))
+    results['rsi_14'], results['rsi_avg_gain'], results['rsi_avg_loss'] = wilder_rsi(
+        closes, first_new, seed('rsi_avg_gain'), seed('rsi_avg_loss'))
+    results['high_52w'] = rolling_extreme(closes, YEAR_WINDOW, np.fmax)
+    results['low_52w'] = rolling_extreme(closes, YEAR_WINDOW, np.fmin)
+    for window in RETURN_WINDOWS:
+        results[f"return_{window}d"] = trailing_return(closes, window)
+    return results, first_new, starts, stock_ids
+
+
+# Function to turn the computed matrices into a frame of the new StockIndicators rows, one block of
+# rows per stock sliced straight out of the matrices
+def indicator_frame(history, results, first_new, starts, stock_ids):
+    matrix = np.stack([results[column] for column in INDICATOR_COLUMNS], axis=-1)
+    matrix = np.where(np.isfinite(matrix), matrix, np.nan)
+    blocks, ids, dates = [], [], []
+    for column, stock_id in enumerate(stock_ids):
+        block = matrix[first_new[column]:, column]
+        offset = first_new[column] - starts[column]
+        blocks.append(block)
+        ids.append(np.full(len(block), stock_id, dtype=np.int64))
+        dates.extend(history[stock_id][0][offset:offset + len(block)])
+    frame = pd.DataFrame(np.concatenate(blocks) if blocks else np.empty((0, len(INDICATOR_COLUMNS))), columns=INDICATOR_COLUMNS)
+    frame.insert(0, 'date', dates)
+    frame.insert(0, 'stock_id', np.concatenate(ids) if ids else np.empty(0, dtype=np.int64))
+    return frame
+
+
+# Function to upsert a frame of indicator rows: COPY into a session-local staging table, then one
+# set-based merge
+def store_indicator_frame(conn, frame):
+    if frame.empty:
+        return 0
+    buf = io.StringIO()
+    frame.to_csv(buf, header=False, index=False, na_rep='')
+    buf.seek(0)
+    columns = ', '.join(INDICATOR_COLUMNS)
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in INDICATOR_COLUMNS + ['updated_at'])
+    with conn.cursor() as cur:
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS StockIndicatorsStaging (LIKE StockIndicators)")
+        cur.execute("TRUNCATE StockIndicatorsStaging")
+        cur.copy_expert(f"COPY StockIndicatorsStaging (stock_id, date, {columns}) FROM STDIN WITH (FORMAT csv, NULL '')", buf)
+        cur.execute(f"""
+            INSERT INTO StockIndicators (stock_id, date, {columns}, updated_at)
+            SELECT stock_id, date, {columns}, %s FROM StockIndicatorsStaging
+            ON CONFLICT (stock_id, date) DO UPDATE SET {updates}
+        """, (datetime.now(),))
+        cur.execute("TRUNCATE StockIndicatorsStaging")
+    conn.commit()
+    return len(frame)
+
+
+# Function to bring StockIndicators up to date with StockData, recomputing only each stock's new tail.
+# Stocks are processed INDICATOR_CHUNK_STOCKS at a time, each chunk written before the next is loaded;
+# the watermark moves once every chunk is in, so an interrupted run is picked up again.
+def update_indicators(conn, chunk_stocks=INDICATOR_CHUNK_STOCKS):
+    create_indicator_schema(conn)
+    stale, watermark = load_stale_stocks(conn)
+    written = 0
+    chunk_stocks = max(chunk_stocks, 1)
+    for position in range(0, len(stale), chunk_stocks):
+        history = load_close_history(conn, stale[position:position + chunk_stocks])
+        if not history:
+            continue
+        state = load_recursive_state(conn, history)
+        results, first_new, starts, stock_ids = compute_indicators(history, state)
+        written += store_indicator_frame(conn, indicator_frame(history, results, first_new, starts, stock_ids))
+    if watermark is not None:
+        with conn.cursor() as cur:
+            set_watermark(cur, INDICATOR_WATERMARK, watermark)
+    conn.commit()
+    if not stale:
+        print("StockIndicators already up to date")
+        return 0
+    print(f"Materialized {written} StockIndicators rows for {len(stale)} stocks")
+    return written
+
+
+if __name__ == '__main__':
+    conn = psycopg2.connect(**db_params)
+    update_indicators(conn)
+    conn.close()
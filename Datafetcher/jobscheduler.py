@@ -0,0 +1,158 @@
+import os
+import socket
+import time
+import uuid
+
+# Redis work queue for the daily refresh, shared by any number of datafetcher processes/containers.
+#
+#   jobs:queue         sorted set of tickers ready to run, lowest score first (see JOB_PRIORITY)
+#   jobs:delayed       sorted set of failed tickers, scored by the epoch second their retry is due
+#   jobs:last_success  hash ticker -> epoch second of the last committed run
+#   jobs:failures      hash ticker -> consecutive failures
+#   jobs:lease:<t>     lease held by the worker running ticker t (SET NX PX), so nobody else runs it
+#
+# A ticker is due again JOB_REFRESH_HOURS after its last success. A worker that dies simply lets its
+# leases expire; the next schedule() call puts those tickers back in the queue.
+JOB_REFRESH_HOURS = float(os.environ.get('JOB_REFRESH_HOURS', '20'))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '900'))
+JOB_MAX_RETRIES = int(os.environ.get('JOB_MAX_RETRIES', '3'))
+JOB_RETRY_BASE_SECONDS = int(os.environ.get('JOB_RETRY_BASE_SECONDS', '60'))
+JOB_RETRY_MAX_SECONDS = int(os.environ.get('JOB_RETRY_MAX_SECONDS', '3600'))
+# A worker with nothing left to claim waits for pending retries only if one is due within this long
+JOB_RETRY_WAIT_SECONDS = int(os.environ.get('JOB_RETRY_WAIT_SECONDS', '300'))
+# Tickers leased per claim when history batching does not set the size
+JOB_CLAIM_BATCH = int(os.environ.get('JOB_CLAIM_BATCH', '50'))
+# 'market_cap' runs the largest companies first, 'staleness' the ones with the oldest data first
+JOB_PRIORITY = os.environ.get('JOB_PRIORITY', 'market_cap')
+
+QUEUE_KEY = 'jobs:queue'
+DELAYED_KEY = 'jobs:delayed'
+LAST_SUCCESS_KEY = 'jobs:last_success'
+FAILURES_KEY = 'jobs:failures'
+LEASE_KEY_PREFIX = 'jobs:lease:'
+# Queue score of a ticker whose retry is due: ahead of every priority score
+RETRY_SCORE = -1e18
+
+
+# Function to compute the retry delay after `failures` consecutive failures (exponential, capped)
+def retry_delay(failures, base=JOB_RETRY_BASE_SECONDS, cap=JOB_RETRY_MAX_SECONDS):
+    return min(cap, base * 2 ** max(failures - 1, 0))
+
+
+# Function to score tickers for the queue (lower runs first). market_caps maps ticker -> latest market
+# cap; last_dates maps ticker -> last stored date. Tickers without data go first under 'staleness'
+# and after the known ones under 'market_cap'.
+def priority_scores(tickers, market_caps=None, last_dates=None, mode=JOB_PRIORITY):
+    scores = {}
+    for ticker in tickers:
+        if mode == 'staleness':
+            last_date = (last_dates or {}).get(ticker)
+            scores[ticker] = last_date.toordinal() if last_date else 0
+        else:
+            market_cap = (market_caps or {}).get(ticker)
+            scores[ticker] = -float(market_cap) if market_cap else 0
+    return scores
+
+
+# Redis-backed scheduler; redis_client must decode responses
+class JobScheduler:
+    def __init__(self, redis_client, lease_seconds=JOB_LEASE_SECONDS, refresh_hours=JOB_REFRESH_HOURS,
+                 max_retries=JOB_MAX_RETRIES):
+        self.redis_client = redis_client
+        self.lease_ms = lease_seconds * 1000
+        self.refresh_seconds = refresh_hours * 3600
+        self.max_retries = max_retries
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    # Function to queue every ticker that is due, not waiting for a retry and not leased. Safe to call
+    # from several workers at once: ZADD NX never duplicates or reorders a queued ticker.
+    def schedule(self, tickers, scores):
+        now = time.time()
+        tickers = list(tickers)
+        if not tickers:
+            return 0
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hmget(LAST_SUCCESS_KEY, tickers)
+        for ticker in tickers:
+            pipe.zscore(DELAYED_KEY, ticker)
+            pipe.exists(LEASE_KEY_PREFIX + ticker)
+        replies = pipe.execute()
+        last_success = replies[0]
+
+        due = {}
+        for index, ticker in enumerate(tickers):
+            retry_at, leased = replies[1 + 2 * index], replies[2 + 2 * index]
+            if retry_at is not None or leased:
+                continue
+            if last_success[index] is not None and now - float(last_success[index]) < self.refresh_seconds:
+                continue
+            due[ticker] = scores.get(ticker, 0)
+        if due:
+            self.redis_client.zadd(QUEUE_KEY, due, nx=True)
+        self.clear_legacy_flags(tickers)
+        return len(due)
+
+    # Function to drop the old one-shot "<ticker> = processed" checkpoints this scheduler replaces
+    def clear_legacy_flags(self, tickers):
+        values = self.redis_client.mget(tickers)
+        legacy = [ticker for ticker, value in zip(tickers, values) if value == 'processed']
+        if legacy:
+            self.redis_client.delete(*legacy)
+
+    # Function to move failed tickers whose backoff has elapsed back into the queue
+    def promote_due_retries(self):
+        now = time.time()
+        ready = self.redis_client.zrangebyscore(DELAYED_KEY, '-inf', now)
+        for ticker in ready:
+            # Only the worker whose ZREM succeeds re-queues it; retries go to the front
+            if self.redis_client.zrem(DELAYED_KEY, ticker):
+                self.redis_client.zadd(QUEUE_KEY, {ticker: RETRY_SCORE}, nx=True)
+
+    # Function to take up to `count` tickers off the queue and lease them to this worker
+    def claim(self, count):
+        self.promote_due_retries()
+        claimed = []
+        while len(claimed) < count:
+            popped = self.redis_client.zpopmin(QUEUE_KEY, count - len(claimed))
+            if not popped:
+                break
+            for ticker, _ in popped:
+                if self.redis_client.set(LEASE_KEY_PREFIX + ticker, self.owner, nx=True, px=self.lease_ms):
+                    claimed.append(ticker)
+        return claimed
+
+    def _release(self, ticker):
+        key = LEASE_KEY_PREFIX + ticker
+        if self.redis_client.get(key) == self.owner:
+            self.redis_client.delete(key)
+
+    # Function to record a committed ticker
+    def complete(self, ticker):
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.hset(LAST_SUCCESS_KEY, ticker, time.time())
+        pipe.hdel(FAILURES_KEY, ticker)
+        pipe.execute()
+        self._release(ticker)
+
+    # Function to record a failed ticker: retried with exponential backoff, given up on for this
+    # refresh after max_retries (the next schedule() starts over). Returns whether a retry is scheduled.
+    def fail(self, ticker, error=None):
+        failures = self.redis_client.hincrby(FAILURES_KEY, ticker, 1)
+        if failures <= self.max_retries:
+            delay = retry_delay(failures)
+            self.redis_client.zadd(DELAYED_KEY, {ticker: time.time() + delay})
+            print(f"{ticker} failed ({error}), retry {failures}/{self.max_retries} in {delay}s")
+        else:
+            self.redis_client.hdel(FAILURES_KEY, ticker)
+            print(f"{ticker} failed ({error}), giving up after {self.max_retries} retries")
+        self._release(ticker)
+        return failures <= self.max_retries
+
+    # Function to tell whether any work is left: queued now, or waiting for a retry
+    def pending(self):
+        return self.redis_client.zcard(QUEUE_KEY) + self.redis_client.zcard(DELAYED_KEY)
+
+    # Function to return the seconds until the next retry is due, or None when none is waiting
+    def next_retry_in(self):
+        earliest = self.redis_client.zrange(DELAYED_KEY, 0, 0, withscores=True)
+        return max(0.0, earliest[0][1] - time.time()) if earliest else None
@@ -0,0 +1,187 @@
+import numbers
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+# Normalized, typed copy of the statements kept in Financials.data: one row per
+# (stock, statement, line item, period end) with the value as a double, and line item names stored once
+# in the LineItem dictionary. Metric lookups and cross-sectional queries ("latest Total Revenue of every
+# stock") then read an index instead of decoding a JSONB document per row. Financials stays the
+# source of the raw documents; both are written in the same transaction by insert_financials.
+
+# Stocks migrated per transaction when FinancialLineItem is backfilled from Financials
+LINE_ITEM_MIGRATION_BATCH = int(os.environ.get('LINE_ITEM_MIGRATION_BATCH', '200'))
+
+MIGRATION_NAME = 'financial_line_items'
+
+
+# Function to create the line item tables and indexes
+def create_line_item_schema(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS LineItem (
+                id SERIAL PRIMARY KEY,
+                name TEXT UNIQUE NOT NULL
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS FinancialLineItem (
+                stock_id INTEGER NOT NULL REFERENCES Stock(id),
+                period_end DATE NOT NULL,
+                statement_type TEXT NOT NULL,
+                line_item_id INTEGER NOT NULL REFERENCES LineItem(id),
+                value DOUBLE PRECISION NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (stock_id, statement_type, period_end, line_item_id)
+            )
+        """)
+        # Covers "latest value of one line item for every stock" (DISTINCT ON stock_id ordered by
+        # period_end DESC) and top-N rankings as index-only scans; the primary key covers per-stock reads
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_financiallineitem_item_stock
+            ON FinancialLineItem (line_item_id, statement_type, stock_id, period_end DESC) INCLUDE (value)
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS SchemaMigration (
+                name TEXT PRIMARY KEY,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    conn.commit()
+
+
+# Function to pick the finite numeric values out of one statement column (a Series indexed by line
+# item name). Missing, NaN/Inf and non-numeric entries (strings, booleans) have no row, matching what
+# the JSON document holds as a number.
+def finite_line_items(data):
+    series = pd.Series(data)
+    if series.dtype == object or pd.api.types.is_bool_dtype(series.dtype):
+        series = series[series.map(lambda value: isinstance(value, numbers.Real) and not isinstance(value, (bool, np.bool_)))]
+    values = series.to_numpy(dtype='float64')
+    keep = np.isfinite(values)
+    return [str(name) for name in series.index[keep]], values[keep].tolist()
+
+
+# Function to look up the ids of line item names, adding the missing ones. The names are upserted in
+# sorted order in a statement of their own, so writers adding overlapping names lock them in the same
+# order, and the ids are re-selected afterwards: an INSERT ... RETURNING leaves out names that another
+# writer added concurrently.
+def line_item_ids(conn, names):
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO LineItem (name) SELECT unnest(%s::text[]) ORDER BY 1
+            ON CONFLICT (name) DO NOTHING
+        """, (sorted(set(names)),))
+        cur.execute("SELECT name, id FROM LineItem WHERE name = ANY(%s)", (list(names),))
+        return dict(cur.fetchall())
+
+
+# The LineItem dictionary shared by the writers of one process. Names it has not seen are added on a
+# connection of its own in autocommit mode, so they are committed before any writer's batch uses them
+# and no writer holds a name's lock until its batch commits; known ids are kept in memory.
+class LineItemNames:
+    def __init__(self, conn):
+        conn.autocommit = True
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.ids = {}
+
+    def lookup(self, names):
+        missing = [name for name in names if name not in self.ids]
+        if missing:
+            with self.lock:
+                self.ids.update(line_item_ids(self.conn, missing))
+        return [self.ids[name] for name in names]
+
+
+# Function to replace the line items of one statement column; does not commit (the caller owns the
+# transaction, see unitofwork.UnitOfWork). With line_item_names (a LineItemNames) new names are committed
+# first; without it they are added in the caller's transaction.
+def write_line_items(conn, stock_id, period_end, statement_type, data, updated_at, line_item_names=None):
+    names, values = finite_line_items(data)
+    with conn.cursor() as cur:
+        # Items dropped by a restatement go too, as they do from the JSON document
+        cur.execute("""
+            DELETE FROM FinancialLineItem f
+            USING LineItem li
+            WHERE f.line_item_id = li.id AND f.stock_id = %s AND f.statement_type = %s
+              AND f.period_end = %s AND NOT (li.name = ANY(%s))
+        """, (stock_id, statement_type, period_end, names))
+        if not names:
+            return 0
+        if line_item_names is not None:
+            ids = line_item_names.lookup(names)
+        else:
+            known = line_item_ids(conn, names)
+            ids = [known[name] for name in names]
+        cur.execute("""
+            INSERT INTO FinancialLineItem (stock_id, period_end, statement_type, line_item_id, value, updated_at)
+            SELECT %s, %s, %s, item.id, item.value, %s
+            FROM unnest(%s::integer[], %s::double precision[]) AS item(id, value)
+            ON CONFLICT (stock_id, statement_type, period_end, line_item_id) DO UPDATE SET
+            value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+            WHERE FinancialLineItem.value IS DISTINCT FROM EXCLUDED.value
+        """, (stock_id, period_end, statement_type, updated_at, ids, values))
+    return len(names)
+
+
+# Function to backfill FinancialLineItem from the JSONB documents already in Financials. Runs once
+# (recorded in SchemaMigration), in batches of stocks with a commit after each; a batch interrupted
+# half-way is simply redone on the next run.
+def migrate_financials(conn, batch_size=LINE_ITEM_MIGRATION_BATCH):
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM SchemaMigration WHERE name = %s", (MIGRATION_NAME,))
+        if cur.fetchone():
+            return 0
+        cur.execute("SELECT DISTINCT stock_id FROM Financials ORDER BY stock_id")
+        stock_ids = [row[0] for row in cur.fetchall()]
+
+    started = time.perf_counter()
+    migrated = 0
+    for position in range(0, len(stock_ids), batch_size):
+        batch = stock_ids[position:position + batch_size]
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO LineItem (name)
+                SELECT DISTINCT e.key
+                FROM Financials f CROSS JOIN LATERAL jsonb_each(f.data) e
+                WHERE f.stock_id = ANY(%s) AND jsonb_typeof(e.value) = 'number'
+                ORDER BY e.key
+                ON CONFLICT (name) DO NOTHING
+            """, (batch,))
+            cur.execute("""
+                INSERT INTO FinancialLineItem (stock_id, period_end, statement_type, line_item_id, value, updated_at)
+                SELECT f.stock_id, f.date, f.statement_type, li.id, (e.value #>> '{}')::double precision, f.updated_at
+                FROM Financials f
+                CROSS JOIN LATERAL jsonb_each(f.data) e
+                JOIN LineItem li ON li.name = e.key
+                WHERE f.stock_id = ANY(%s) AND f.date IS NOT NULL AND jsonb_typeof(e.value) = 'number'
+                ON CONFLICT (stock_id, statement_type, period_end, line_item_id) DO NOTHING
+            """, (batch,))
+            migrated += cur.rowcount
+        conn.commit()
+        print(f"Migrated line items of {position + len(batch)} of {len(stock_ids)} stocks")
+
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO SchemaMigration (name) VALUES (%s) ON CONFLICT (name) DO NOTHING", (MIGRATION_NAME,))
+    conn.commit()
+    if stock_ids:
+        print(f"Migrated {migrated} line items from Financials in {time.perf_counter() - started:.1f}s")
+    return migrated
+
+
+# Function to read the latest reported value of one line item for every stock, as (stock_id,
+# period_end, value) rows; served by idx_financiallineitem_item_stock
+def latest_line_item_values(conn, name, statement_type):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT DISTINCT ON (f.stock_id) f.stock_id, f.period_end, f.value
+            FROM FinancialLineItem f
+            JOIN LineItem li ON li.id = f.line_item_id
+            WHERE li.name = %s AND f.statement_type = %s
+            ORDER BY f.stock_id, f.period_end DESC
+        """, (name, statement_type))
+        return cur.fetchall()
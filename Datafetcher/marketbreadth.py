@@ -0,0 +1,199 @@
+import json
+import os
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from indicatorengine import YEAR_WINDOW, rolling_extreme, rolling_mean
+
+# Daily market breadth, one MarketBreadth row per trading day, maintained by dailydatacruncher.
+# All stocks are computed at once on a (date, stock) close matrix. Every count covers the stocks that
+# traded that day: one advances or declines against its last close; a new 52-week high/low is a close
+# above/below every close of the previous YEAR_WINDOW - 1 sessions; the moving-average shares count
+# only stocks with a full window. A stock's last close is carried over up to BREADTH_FILL_SESSIONS
+# sessions without a row, so a single gap in its history does not drop it from the windows. Only
+# dates after the last stored row (minus a small overlap for late ticker commits) are recomputed, and
+# the latest window is cached in Redis for the breadth charts.
+BREADTH_MA_WINDOWS = [50, 200]
+BREADTH_FILL_SESSIONS = 5
+
+# Trading days before the last stored date that are recomputed, for tickers committed after a run
+BREADTH_OVERLAP_DAYS = int(os.environ.get('BREADTH_OVERLAP_DAYS', '5'))
+# Calendar days of history loaded before the first date being computed, so the 52-week window is full
+BREADTH_LOOKBACK_DAYS = int(os.environ.get('BREADTH_LOOKBACK_DAYS', '400'))
+# Calendar days computed per pass on the first (full history) build, to bound memory
+BREADTH_CHUNK_DAYS = int(os.environ.get('BREADTH_CHUNK_DAYS', '730'))
+# Trading days of breadth published to Redis, and for how long
+BREADTH_CACHE_DAYS = int(os.environ.get('BREADTH_CACHE_DAYS', '260'))
+BREADTH_CACHE_TTL = 36 * 3600
+BREADTH_KEY = 'marketBreadth'
+
+BREADTH_COLUMNS = (
+    ['stocks', 'advances', 'declines', 'unchanged', 'new_highs_52w', 'new_lows_52w']
+    + [f"{kind}_sma_{window}" for window in BREADTH_MA_WINDOWS for kind in ('above', 'with')]
+    + [f"pct_above_sma_{window}" for window in BREADTH_MA_WINDOWS]
+)
+
+
+# Function to create the MarketBreadth table. Its date-range reads of StockData use stockdata_date_idx,
+# which datafetcher creates with the rest of the StockData schema before any writer starts.
+def create_breadth_schema(conn):
+    counts = ',\n                '.join(f"{column} INTEGER NOT NULL" for column in BREADTH_COLUMNS
+                                        if not column.startswith('pct_'))
+    shares = ',\n                '.join(f"{column} DOUBLE PRECISION" for column in BREADTH_COLUMNS
+                                        if column.startswith('pct_'))
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS MarketBreadth (
+                date DATE PRIMARY KEY,
+                {counts},
+                {shares},
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    conn.commit()
+
+
+# Function to load every close between two dates as a (date, stock) matrix; NaN where a stock has no row
+def load_close_matrix(conn, start, end):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT date, stock_id, close FROM StockData
+            WHERE date >= %s AND date <= %s AND close IS NOT NULL
+        """, (start, end))
+        rows = cur.fetchall()
+    if not rows:
+        return [], np.empty((0, 0))
+    dates, stock_ids, closes = zip(*rows)
+    unique_dates, date_rows = np.unique(np.array(dates, dtype='datetime64[D]'), return_inverse=True)
+    _, stock_columns = np.unique(np.array(stock_ids, dtype=np.int64), return_inverse=True)
+    matrix = np.full((len(unique_dates), stock_columns.max() + 1), np.nan)
+    matrix[date_rows, stock_columns] = np.array(closes, dtype=np.float64)
+    matrix[~np.isfinite(matrix)] = np.nan
+    return [value.item() for value in unique_dates], matrix
+
+
+# Function to carry each stock's last close forward over up to `limit` rows without one
+def fill_gaps(closes, limit=BREADTH_FILL_SESSIONS):
+    rows = np.arange(closes.shape[0])[:, None]
+    last = np.maximum.accumulate(np.where(np.isnan(closes), -1, rows), axis=0)
+    filled = np.take_along_axis(closes, np.maximum(last, 0), axis=0)
+    return np.where((last >= 0) & (rows - last <= limit), filled, np.nan)
+
+
+# Function to compute the breadth columns for every row of the close matrix; returns {column: array}
+def compute_breadth(closes):
+    traded = ~np.isnan(closes)
+    filled = fill_gaps(closes)
+    previous = np.vstack([np.full((1, closes.shape[1]), np.nan), filled[:-1]])
+    with np.errstate(invalid='ignore'):
+        change = closes - previous
+        prior_high = rolling_extreme(previous, YEAR_WINDOW - 1, np.fmax)
+        prior_low = rolling_extreme(previous, YEAR_WINDOW - 1, np.fmin)
+        breadth = {
+            'stocks': traded.sum(axis=1),
+            'advances': (change > 0).sum(axis=1),
+            'declines': (change < 0).sum(axis=1),
+            'unchanged': (change == 0).sum(axis=1),
+            'new_highs_52w': (closes > prior_high).sum(axis=1),
+            'new_lows_52w': (closes < prior_low).sum(axis=1),
+        }
+        for window in BREADTH_MA_WINDOWS:
+            average = rolling_mean(filled, window)
+            above = (closes > average).sum(axis=1)
+            counted = (traded & ~np.isnan(average)).sum(axis=1)
+            breadth[f"above_sma_{window}"] = above
+            breadth[f"with_sma_{window}"] = counted
+            breadth[f"pct_above_sma_{window}"] = np.where(counted > 0, 100.0 * above / np.maximum(counted, 1), np.nan)
+    return breadth
+
+
+# Function to turn the computed columns into MarketBreadth rows for the dates on or after `first`
+def breadth_rows(dates, breadth, first):
+    now = datetime.now()
+    rows = []
+    for index, day in enumerate(dates):
+        if day < first:
+            continue
+        values = []
+        for column in BREADTH_COLUMNS:
+            value = breadth[column][index]
+            if column.startswith('pct_'):
+                values.append(None if np.isnan(value) else float(value))
+            else:
+                values.append(int(value))
+        rows.append((day, *values, now))
+    return rows
+
+
+# Function to upsert MarketBreadth rows
+def store_breadth_rows(conn, rows):
+    columns = ', '.join(BREADTH_COLUMNS)
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in BREADTH_COLUMNS + ['updated_at'])
+    with conn.cursor() as cur:
+        execute_values(cur, f"""
+            INSERT INTO MarketBreadth (date, {columns}, updated_at) VALUES %s
+            ON CONFLICT (date) DO UPDATE SET {updates}
+        """, rows, page_size=1000)
+    conn.commit()
+
+
+# Function to find the first date to (re)compute: BREADTH_OVERLAP_DAYS trading days before the last
+# stored one, or the first StockData date when MarketBreadth is empty. None when nothing is stored at all.
+def first_breadth_date(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT date FROM MarketBreadth ORDER BY date DESC LIMIT 1 OFFSET %s", (BREADTH_OVERLAP_DAYS,))
+        row = cur.fetchone()
+        if row is not None:
+            return row[0] + timedelta(days=1)
+        cur.execute("SELECT MIN(date) FROM StockData")
+        return cur.fetchone()[0]
+
+
+# Function to bring MarketBreadth up to date with StockData; returns the number of rows written
+def update_market_breadth(conn):
+    create_breadth_schema(conn)
+    first = first_breadth_date(conn)
+    with conn.cursor() as cur:
+        cur.execute("SELECT MAX(date) FROM StockData")
+        last = cur.fetchone()[0]
+    if first is None or last is None or first > last:
+        print("MarketBreadth already up to date")
+        return 0
+
+    written = 0
+    chunk_start = first
+    while chunk_start <= last:
+        chunk_end = min(last, chunk_start + timedelta(days=BREADTH_CHUNK_DAYS - 1))
+        dates, closes = load_close_matrix(conn, chunk_start - timedelta(days=BREADTH_LOOKBACK_DAYS), chunk_end)
+        rows = breadth_rows(dates, compute_breadth(closes), chunk_start) if dates else []
+        if rows:
+            store_breadth_rows(conn, rows)
+            written += len(rows)
+        chunk_start = chunk_end + timedelta(days=1)
+    print(f"Materialized {written} MarketBreadth rows from {first} to {last}")
+    return written
+
+
+# Function to read the latest `days` breadth rows, oldest first, as a columnar document
+def latest_breadth(conn, days=BREADTH_CACHE_DAYS):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT date, {', '.join(BREADTH_COLUMNS)} FROM (
+                SELECT * FROM MarketBreadth ORDER BY date DESC LIMIT %s
+            ) latest
+            ORDER BY date
+        """, (days,))
+        rows = cur.fetchall()
+    columns = ['date'] + BREADTH_COLUMNS
+    document = {column: [row[index] for row in rows] for index, column in enumerate(columns)}
+    document['date'] = [value.isoformat() if isinstance(value, date) else value for value in document['date']]
+    return document
+
+
+# Function to publish the latest breadth window to Redis
+def cache_market_breadth(conn, redis_client, days=BREADTH_CACHE_DAYS):
+    document = latest_breadth(conn, days)
+    redis_client.set(BREADTH_KEY, json.dumps(document, separators=(',', ':')), ex=BREADTH_CACHE_TTL)
+    return len(document['date'])
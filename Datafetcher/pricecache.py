@@ -0,0 +1,183 @@
+import itertools
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Local columnar copy of StockData history, written by datafetcher next to the database so that
+# analytical passes can scan prices from disk. Each ticker has its own directory with one raw
+# little-endian file per column (<column>.bin), all of equal length and sorted by date; they are
+# appended in place and read back with np.memmap, so loads return views without copying the data.
+# Off unless PRICE_CACHE_DIR is set. Point it at persistent storage: an empty cache is backfilled from
+# the whole StockData table on the next run.
+PRICE_CACHE_DIR = os.environ.get('PRICE_CACHE_DIR', '')
+# StockData rows per round trip when the cache is backfilled
+PRICE_CACHE_BACKFILL_CHUNK = int(os.environ.get('PRICE_CACHE_BACKFILL_CHUNK', '50000'))
+
+# date is stored as int64 days since the epoch (datetime64[D]); the rest mirror StockData
+PRICE_COLUMNS = {
+    'date': np.dtype('<i8'),
+    'open': np.dtype('<f8'),
+    'high': np.dtype('<f8'),
+    'low': np.dtype('<f8'),
+    'close': np.dtype('<f8'),
+    'volume': np.dtype('<f8'),
+    'dividends': np.dtype('<f8'),
+    'stock_splits': np.dtype('<f8'),
+}
+HISTORY_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+
+
+# Function to turn a yfinance history index into trading dates (the exchange-local calendar day)
+def trading_days(index):
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.normalize().values.astype('datetime64[D]').astype(np.int64)
+
+
+# Function to turn a date-like value into int64 epoch days
+def to_epoch_day(value):
+    return int(np.datetime64(pd.Timestamp(value).date(), 'D').astype(np.int64))
+
+
+# Per-ticker memory-mapped column store
+class PriceCache:
+    def __init__(self, directory=PRICE_CACHE_DIR):
+        self.directory = directory
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+    def _path(self, ticker, column):
+        return os.path.join(self.directory, ticker, f"{column}.bin")
+
+    def _lock(self, ticker):
+        with self.locks_lock:
+            return self.locks.setdefault(ticker, threading.Lock())
+
+    # Number of complete rows: an interrupted append can leave some column files longer than others
+    def _length(self, ticker):
+        lengths = []
+        for column, dtype in PRICE_COLUMNS.items():
+            path = self._path(ticker, column)
+            lengths.append(os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0)
+        return min(lengths)
+
+    def _column(self, ticker, column, length):
+        if length == 0:
+            return np.empty(0, dtype=PRICE_COLUMNS[column])
+        return np.memmap(self._path(ticker, column), dtype=PRICE_COLUMNS[column], mode='r', shape=(length,))
+
+    # Function to append a history frame; cached rows from the frame's first date onwards are replaced,
+    # so re-fetching the last few days (or a full refresh) does not duplicate them
+    def append(self, ticker, data):
+        if data is None or data.empty:
+            return 0
+        frame = data.iloc[:, :len(HISTORY_COLUMNS)]
+        days = trading_days(frame.index)
+        order = np.argsort(days, kind='stable')
+        days = days[order]
+        # Keep the last row of a repeated day, like the DISTINCT ON in the StockData merge
+        keep = np.append(days[1:] != days[:-1], True)
+        values = frame.to_numpy(dtype=np.float64, na_value=np.nan)[order][keep]
+        days = days[keep]
+
+        with self._lock(ticker):
+            os.makedirs(os.path.join(self.directory, ticker), exist_ok=True)
+            length = self._length(ticker)
+            cut = int(np.searchsorted(self._column(ticker, 'date', length), days[0], side='left'))
+            columns = [days] + [values[:, position] for position in range(values.shape[1])]
+            for (column, dtype), array in zip(PRICE_COLUMNS.items(), columns):
+                with open(self._path(ticker, column), 'r+b' if os.path.exists(self._path(ticker, column)) else 'wb') as f:
+                    f.truncate(cut * dtype.itemsize)
+                    f.seek(cut * dtype.itemsize)
+                    f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+        return len(days)
+
+    # Function to return the last cached trading date of a ticker, or None
+    def last_date(self, ticker):
+        length = self._length(ticker)
+        if length == 0:
+            return None
+        return pd.Timestamp(np.datetime64(int(self._column(ticker, 'date', length)[-1]), 'D')).date()
+
+    # Function to return the first cached trading date of a ticker, or None
+    def first_date(self, ticker):
+        if self._length(ticker) == 0:
+            return None
+        return pd.Timestamp(np.datetime64(int(self._column(ticker, 'date', 1)[0]), 'D')).date()
+
+    # Function to return (rows, first date, last date) of a ticker's cached series; dates are None when empty
+    def span(self, ticker):
+        length = self._length(ticker)
+        if length == 0:
+            return 0, None, None
+        dates = self._column(ticker, 'date', length)
+        return length, *(pd.Timestamp(np.datetime64(int(day), 'D')).date() for day in (dates[0], dates[-1]))
+
+    # Function to fill the cache from StockData for the tickers whose cached series does not match what
+    # is stored: a different row count, first or last session catches a missing series, a cache turned
+    # on after the database was filled (datafetcher only appends what it fetches), gaps in the middle
+    # and a stale tail. Rows are streamed through a named cursor and written one ticker at a time; the
+    # caller owns the transaction. Returns the number of tickers filled.
+    def backfill(self, conn):
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT s.ticker, stored.rows, stored.first, stored.last
+                FROM Stock s
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS rows, MIN(date) AS first, MAX(date) AS last FROM StockData WHERE stock_id = s.id
+                ) stored
+                WHERE stored.rows > 0
+            """)
+            stale = [ticker for ticker, *stored in cur.fetchall() if self.span(ticker) != tuple(stored)]
+        if not stale:
+            return 0
+
+        filled = 0
+        with conn.cursor(name='price_cache_backfill') as cur:
+            cur.itersize = PRICE_CACHE_BACKFILL_CHUNK
+            cur.execute("""
+                SELECT s.ticker, sd.date, sd.open, sd.high, sd.low, sd.close, sd.volume, sd.dividends, sd.stock_splits
+                FROM StockData sd
+                JOIN Stock s ON s.id = sd.stock_id
+                WHERE s.ticker = ANY(%s)
+                ORDER BY s.ticker, sd.date
+            """, (stale,))
+            for ticker, rows in itertools.groupby(cur, key=lambda row: row[0]):
+                rows = list(rows)
+                frame = pd.DataFrame([row[2:] for row in rows], columns=HISTORY_COLUMNS,
+                                     index=pd.DatetimeIndex([row[1] for row in rows]), dtype=np.float64)
+                self.append(ticker, frame)
+                filled += 1
+        print(f"Backfilled the price cache of {filled} tickers from StockData")
+        return filled
+
+    # Function to load one ticker as {column: array}; date comes back as datetime64[D]. The arrays are
+    # read-only views over the memory-mapped files, restricted to start <= date <= end.
+    def load(self, ticker, start=None, end=None, columns=None):
+        length = self._length(ticker)
+        dates = self._column(ticker, 'date', length)
+        lo = int(np.searchsorted(dates, to_epoch_day(start), side='left')) if start is not None else 0
+        hi = int(np.searchsorted(dates, to_epoch_day(end), side='right')) if end is not None else length
+        result = {}
+        for column in columns or PRICE_COLUMNS:
+            view = self._column(ticker, column, length)[lo:hi]
+            result[column] = view.view('datetime64[D]') if column == 'date' else view
+        return result
+
+    # Function to load several tickers at once; tickers without cached rows are left out
+    def load_many(self, tickers, start=None, end=None, columns=None):
+        result = {}
+        for ticker in tickers:
+            frame = self.load(ticker, start, end, columns)
+            if len(next(iter(frame.values()))):
+                result[ticker] = frame
+        return result
+
+    # Function to list the tickers present in the cache
+    def tickers(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if os.path.isdir(os.path.join(self.directory, name)))
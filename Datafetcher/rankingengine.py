@@ -0,0 +1,269 @@
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from lineitems import latest_line_item_values
+
+# Cross-sectional rankings behind the backend's top-N screens (/api/stocks/top and /top-n-individual),
+# maintained by dailydatacruncher after the crunch. Every metric is computed for every stock from
+# indexed sources (CrunchState's latest fundamentals, the latest statement in FinancialLineItem) and
+# compared with the values ranked last time (RankValue); only stocks whose value or market cap bucket
+# changed are written. Each (metric, bucket) list is a Redis sorted set of tickers scored by the value,
+# so a top-N query is a ZREVRANGE (bottom-N a ZRANGE). The RANK_TOP_N stocks at either end of every
+# list that changed are also materialized into MetricRank, picked by partial selection.
+RANK_TOP_N = int(os.environ.get('RANK_TOP_N', '100'))
+RANK_KEY_PREFIX = 'rank:'
+
+# Same thresholds as the backend's marketCapCategory filter; stocks without a market cap are only in 'all'
+MARKET_CAP_BUCKETS = [
+    ('largecap', 200000000000, None),
+    ('midcap', 50000000000, 200000000000),
+    ('smallcap', 10000000000, 50000000000),
+    ('microcap', 0, 10000000000),
+]
+ALL_BUCKET = 'all'
+
+FUNDAMENTAL_METRICS = ['market_cap', 'trailing_pe', 'price_to_book']
+# metric: (line item, statement), read from each stock's latest statement of that type
+LINE_ITEM_METRICS = {
+    'revenue': ('Total Revenue', 'income_statement'),
+    'gross_profit': ('Gross Profit', 'income_statement'),
+    'cost_of_revenue': ('Cost Of Revenue', 'income_statement'),
+    'eps': ('Basic EPS', 'income_statement'),
+    'debt': ('Total Debt', 'balance_sheet'),
+    'current_assets': ('Current Assets', 'balance_sheet'),
+    'total_assets': ('Total Assets', 'balance_sheet'),
+    'total_tax_payable': ('Total Tax Payable', 'balance_sheet'),
+    'long_term_equity_investment': ('Long Term Equity Investment', 'balance_sheet'),
+    'free_cash_flow': ('Free Cash Flow', 'cash_flow'),
+    'repayment_of_debt': ('Repayment Of Debt', 'cash_flow'),
+}
+# metric: (numerator, denominator)
+RATIO_METRICS = {
+    'market_cap_revenue': ('market_cap', 'revenue'),
+    'market_cap_grossprofit': ('market_cap', 'gross_profit'),
+    'market_cap_debt': ('market_cap', 'debt'),
+    'revenue_cost_revenue': ('revenue', 'cost_of_revenue'),
+    'total_debt_repayment_of_debt': ('debt', 'repayment_of_debt'),
+}
+
+
+# Function to create the ranking tables
+def create_ranking_schema(conn):
+    with conn.cursor() as cur:
+        # The values ranked by the last run, to find what changed
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS RankValue (
+                metric TEXT NOT NULL,
+                stock_id INTEGER NOT NULL REFERENCES Stock(id),
+                value DOUBLE PRECISION NOT NULL,
+                bucket TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (metric, stock_id)
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS MetricRank (
+                metric TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                direction TEXT NOT NULL,
+                rank INTEGER NOT NULL,
+                stock_id INTEGER NOT NULL REFERENCES Stock(id),
+                value DOUBLE PRECISION NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (metric, bucket, direction, rank)
+            )
+        """)
+    conn.commit()
+
+
+# Function to return the Redis key of one ranked list
+def rank_key(metric, bucket):
+    return f"{RANK_KEY_PREFIX}{metric}:{bucket}"
+
+
+# Function to spread (stock_id, value) rows over an array aligned with the sorted stock ids; NaN where
+# a stock has no row
+def align_values(stock_ids, rows):
+    values = np.full(len(stock_ids), np.nan)
+    if not rows:
+        return values
+    row_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    row_values = np.array([np.nan if row[1] is None else row[1] for row in rows], dtype=np.float64)
+    positions = np.minimum(np.searchsorted(stock_ids, row_ids), len(stock_ids) - 1)
+    found = stock_ids[positions] == row_ids
+    values[positions[found]] = row_values[found]
+    return values
+
+
+# Function to compute every ranked metric for every stock; returns ({metric: values}, market caps),
+# values aligned with stock_ids and NaN where a stock is not ranked (missing, zero or not finite,
+# as the backend's queries skip them)
+def compute_metric_values(conn, stock_ids):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT stock_id, latest_market_cap, latest_trailing_pe, latest_price_to_book
+            FROM CrunchState WHERE source = 'fundamentals'
+        """)
+        fundamentals = cur.fetchall()
+    inputs = {}
+    for position, metric in enumerate(FUNDAMENTAL_METRICS, start=1):
+        inputs[metric] = align_values(stock_ids, [(row[0], row[position]) for row in fundamentals])
+    for metric, (name, statement_type) in LINE_ITEM_METRICS.items():
+        rows = latest_line_item_values(conn, name, statement_type)
+        inputs[metric] = align_values(stock_ids, [(stock_id, value) for stock_id, _, value in rows])
+
+    values = dict(inputs)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for metric, (numerator, denominator) in RATIO_METRICS.items():
+            values[metric] = np.where(inputs[denominator] != 0, inputs[numerator] / inputs[denominator], np.nan)
+    for metric in values:
+        values[metric] = np.where(np.isfinite(values[metric]) & (values[metric] != 0), values[metric], np.nan)
+    return values, inputs['market_cap']
+
+
+# Function to assign each stock its market cap bucket name, or None without a positive market cap
+def market_cap_buckets(market_caps):
+    buckets = np.full(len(market_caps), None, dtype=object)
+    with np.errstate(invalid='ignore'):
+        positive = market_caps > 0
+        for name, low, high in MARKET_CAP_BUCKETS:
+            member = positive & (market_caps >= low)
+            if high is not None:
+                member &= market_caps < high
+            buckets[member] = name
+    return buckets
+
+
+# Function to pick the positions of the n largest values, largest first (ties by stock id), without
+# sorting the rest of the list
+def top_positions(values, stock_ids, n):
+    n = min(n, len(values))
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+    if n < len(values):
+        # Every stock tied with the n-th largest value is a candidate, so the cut at n also goes by stock id
+        threshold = values[np.argpartition(-values, n - 1)[n - 1]]
+        candidates = np.flatnonzero(values >= threshold)
+    else:
+        candidates = np.arange(len(values))
+    return candidates[np.lexsort((stock_ids[candidates], -values[candidates]))][:n]
+
+
+# Function to rebuild the materialized ends of one list; only ranks whose stock or value moved are written
+def materialize_list(cur, metric, bucket, stock_ids, values, now, n=RANK_TOP_N):
+    for direction, signed in (('top', values), ('last', -values)):
+        positions = top_positions(signed, stock_ids, n)
+        rows = [(metric, bucket, direction, rank, int(stock_ids[position]), float(values[position]), now)
+                for rank, position in enumerate(positions, start=1)]
+        if rows:
+            execute_values(cur, """
+                INSERT INTO MetricRank (metric, bucket, direction, rank, stock_id, value, updated_at) VALUES %s
+                ON CONFLICT (metric, bucket, direction, rank) DO UPDATE SET
+                stock_id = EXCLUDED.stock_id, value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+                WHERE (MetricRank.stock_id, MetricRank.value) IS DISTINCT FROM (EXCLUDED.stock_id, EXCLUDED.value)
+            """, rows, page_size=1000)
+        cur.execute("DELETE FROM MetricRank WHERE metric = %s AND bucket = %s AND direction = %s AND rank > %s",
+                    (metric, bucket, direction, len(rows)))
+
+
+# Function to bring RankValue, the Redis sorted sets and MetricRank up to date with the current values.
+# Run after the crunch, which refreshes CrunchState. Returns the number of (metric, stock) changes.
+def update_rankings(conn, redis_client, n=RANK_TOP_N):
+    started = time.perf_counter()
+    create_ranking_schema(conn)
+    with conn.cursor() as cur:
+        cur.execute("SELECT id, ticker FROM Stock ORDER BY id")
+        stocks = cur.fetchall()
+        cur.execute("SELECT metric, stock_id, value, bucket FROM RankValue")
+        previous = {}
+        for metric, stock_id, value, bucket in cur.fetchall():
+            previous.setdefault(metric, {})[stock_id] = (value, bucket)
+    if not stocks:
+        return 0
+    stock_ids = np.array([stock_id for stock_id, _ in stocks], dtype=np.int64)
+    tickers = dict(stocks)
+    values, market_caps = compute_metric_values(conn, stock_ids)
+    buckets = market_cap_buckets(market_caps)
+
+    # Lists that lost their Redis key (flushed or evicted) are republished in full. Every list that held
+    # a stock last run must still exist, bucket lists included; an empty one never had a key.
+    expected = {}
+    for metric in values:
+        before = previous.get(metric, {})
+        keys = {rank_key(metric, bucket) for _, bucket in before.values() if bucket is not None}
+        if before:
+            keys.add(rank_key(metric, ALL_BUCKET))
+        expected[metric] = sorted(keys)
+    checked = [metric for metric in values if expected[metric]]
+    pipe = redis_client.pipeline(transaction=False)
+    for metric in checked:
+        pipe.exists(*expected[metric])
+    republish = {metric for metric, found in zip(checked, pipe.execute()) if found < len(expected[metric])}
+
+    now = datetime.now()
+    changes = 0
+    pipe = redis_client.pipeline(transaction=True)
+    with conn.cursor() as cur:
+        for metric, metric_values in values.items():
+            ranked = np.flatnonzero(~np.isnan(metric_values))
+            current = {int(stock_ids[position]): (float(metric_values[position]), buckets[position])
+                       for position in ranked}
+            before = previous.get(metric, {})
+            changed = [stock_id for stock_id, entry in current.items() if before.get(stock_id) != entry]
+            removed = [stock_id for stock_id in before if stock_id not in current]
+            changes += len(changed) + len(removed)
+
+            if metric in republish:
+                for bucket in [ALL_BUCKET] + [name for name, _, _ in MARKET_CAP_BUCKETS]:
+                    pipe.delete(rank_key(metric, bucket))
+                published = list(current)
+            else:
+                published = changed
+            additions = {}
+            for stock_id in published:
+                value, bucket = current[stock_id]
+                for key_bucket in (ALL_BUCKET, bucket):
+                    if key_bucket is not None:
+                        additions.setdefault(rank_key(metric, key_bucket), {})[tickers[stock_id]] = value
+            for stock_id in removed:
+                pipe.zrem(rank_key(metric, ALL_BUCKET), tickers[stock_id])
+                if before[stock_id][1] is not None:
+                    pipe.zrem(rank_key(metric, before[stock_id][1]), tickers[stock_id])
+            for stock_id in changed:
+                old_bucket = before.get(stock_id, (None, None))[1]
+                if old_bucket is not None and old_bucket != current[stock_id][1]:
+                    pipe.zrem(rank_key(metric, old_bucket), tickers[stock_id])
+            for key, mapping in additions.items():
+                pipe.zadd(key, mapping)
+
+            if changed:
+                execute_values(cur, """
+                    INSERT INTO RankValue (metric, stock_id, value, bucket, updated_at) VALUES %s
+                    ON CONFLICT (metric, stock_id) DO UPDATE SET
+                    value = EXCLUDED.value, bucket = EXCLUDED.bucket, updated_at = EXCLUDED.updated_at
+                """, [(metric, stock_id) + current[stock_id] + (now,) for stock_id in changed], page_size=1000)
+            if removed:
+                cur.execute("DELETE FROM RankValue WHERE metric = %s AND stock_id = ANY(%s)", (metric, removed))
+
+            # Only the lists a change touched are re-ranked
+            touched = set()
+            for stock_id in changed + removed:
+                touched.add(ALL_BUCKET)
+                touched.add(before.get(stock_id, (None, None))[1])
+                touched.add(current.get(stock_id, (None, None))[1])
+            if metric in republish:
+                touched.add(ALL_BUCKET)
+                touched.update(name for name, _, _ in MARKET_CAP_BUCKETS)
+            touched.discard(None)
+            for bucket in touched:
+                member = ranked if bucket == ALL_BUCKET else ranked[buckets[ranked] == bucket]
+                materialize_list(cur, metric, bucket, stock_ids[member], metric_values[member], now, n)
+    # Redis first: if the commit then fails, the next run finds the same changes and reapplies them
+    pipe.execute()
+    conn.commit()
+    print(f"Rankings: {changes} changes across {len(values)} metrics in {time.perf_counter() - started:.2f}s")
+    return changes
@@ -1,7 +1,14 @@
 #!/bin/bash
 
-# Run datafetcher.py first
-python datafetcher.py
+# Run datafetcher.py first; with INGEST_SHARDS > 1 the refresh is split across that many processes
+if [ "${INGEST_SHARDS:-1}" -gt 1 ]; then
+  python shardedingest.py
+else
+  python datafetcher.py
+fi
+
+# Refresh the precomputed indicators (only the new tail of each stock is recomputed)
+python indicatorengine.py
 
 # After datafetcher.py completes, run dailydatacruncher.py
 # python dailydatacruncher.py
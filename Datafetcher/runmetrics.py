@@ -0,0 +1,181 @@
+import cProfile
+import io
+import json
+import math
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+# Run instrumentation shared by datafetcher and dailydatacruncher: stage timers with p50/p95,
+# counters (rows, bytes, errors, ...) and latency samples, written out at the end of a run as a JSON
+# report and, optionally, a Prometheus text-format file (e.g. for node_exporter's textfile collector).
+RUN_REPORT_DIR = os.environ.get('RUN_REPORT_DIR', 'run_reports')
+METRICS_PROM_FILE = os.environ.get('METRICS_PROM_FILE', '')
+# Set PROFILE_TICKER to one symbol to run it under cProfile + tracemalloc; output goes to RUN_REPORT_DIR
+PROFILE_TICKER = os.environ.get('PROFILE_TICKER', '')
+
+
+# Function to take the nearest-rank percentile of an already sorted list: the smallest value with at
+# least `fraction` of the samples at or below it. The rank is rounded first so that float error
+# (0.07 * 100 = 7.000000000000001) does not push it one place up.
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    index = max(0, math.ceil(round(fraction * len(ordered), 9)) - 1)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+# Function to summarize a list of durations in seconds
+def summarize_samples(samples):
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'total': sum(ordered),
+        'p50': percentile(ordered, 0.50),
+        'p95': percentile(ordered, 0.95),
+        'max': ordered[-1] if ordered else 0.0,
+    }
+
+
+# Thread-safe collector for one run
+class RunMetrics:
+    def __init__(self, job):
+        self.job = job
+        self.lock = threading.Lock()
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.latencies = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.perf_counter() - start)
+
+    def record_stage(self, name, seconds):
+        with self.lock:
+            self.stages.setdefault(name, []).append(seconds)
+
+    # Function to record a latency sample for one unit of work (e.g. one ticker's fetch + write)
+    def observe(self, name, seconds):
+        with self.lock:
+            self.latencies.setdefault(name, []).append(seconds)
+
+    def add(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    # Function to copy the raw samples and counters, e.g. to ship them from a worker process
+    def snapshot(self):
+        with self.lock:
+            return {
+                'stages': {name: list(samples) for name, samples in self.stages.items()},
+                'latencies': {name: list(samples) for name, samples in self.latencies.items()},
+                'counters': dict(self.counters),
+            }
+
+    # Function to fold another collector's snapshot into this one, so percentiles cover both
+    def merge(self, snapshot):
+        with self.lock:
+            for name, samples in snapshot['stages'].items():
+                self.stages.setdefault(name, []).extend(samples)
+            for name, samples in snapshot['latencies'].items():
+                self.latencies.setdefault(name, []).extend(samples)
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        with self.lock:
+            stages = {name: summarize_samples(samples) for name, samples in self.stages.items()}
+            latencies = {name: summarize_samples(samples) for name, samples in self.latencies.items()}
+            counters = dict(self.counters)
+        return {
+            'job': self.job,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'elapsed': time.perf_counter() - self.started,
+            'stages': stages,
+            'latency': latencies,
+            'counters': counters,
+        }
+
+    # Function to render the report in the Prometheus text exposition format
+    def prometheus(self, report=None):
+        report = report or self.report()
+        job = report['job']
+        lines = [
+            '# TYPE ingest_run_elapsed_seconds gauge',
+            f'ingest_run_elapsed_seconds{{job="{job}"}} {report["elapsed"]:.6f}',
+        ]
+        for kind, metric in (('stages', 'ingest_stage_seconds'), ('latency', 'ingest_latency_seconds')):
+            lines.append(f'# TYPE {metric} summary')
+            for name, summary in sorted(report[kind].items()):
+                labels = f'job="{job}",stage="{name}"'
+                lines.append(f'{metric}{{{labels},quantile="0.5"}} {summary["p50"]:.6f}')
+                lines.append(f'{metric}{{{labels},quantile="0.95"}} {summary["p95"]:.6f}')
+                lines.append(f'{metric}_sum{{{labels}}} {summary["total"]:.6f}')
+                lines.append(f'{metric}_count{{{labels}}} {summary["count"]}')
+        lines.append('# TYPE ingest_counter_total counter')
+        for name, value in sorted(report['counters'].items()):
+            lines.append(f'ingest_counter_total{{job="{job}",counter="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    # Function to write the JSON report (and the Prometheus file when configured); returns the report
+    def write(self, directory=RUN_REPORT_DIR, prom_file=METRICS_PROM_FILE):
+        report = self.report()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{self.job}-{self.started_at.strftime('%Y%m%dT%H%M%S')}.json")
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Run report written to {path}")
+        if prom_file:
+            # Write then rename so a scraper never reads a half-written file
+            with open(prom_file + '.tmp', 'w') as f:
+                f.write(self.prometheus(report))
+            os.replace(prom_file + '.tmp', prom_file)
+        slowest = sorted(report['stages'].items(), key=lambda item: item[1]['total'], reverse=True)
+        print(f"{self.job} finished in {report['elapsed']:.1f}s; " + ', '.join(
+            f"{name} {summary['total']:.1f}s (p95 {summary['p95'] * 1000:.0f}ms)" for name, summary in slowest[:5]))
+        return report
+
+
+# Function to profile one unit of work (CPU with cProfile, allocations with tracemalloc) when `ticker`
+# matches PROFILE_TICKER; a no-op otherwise. `label` names the part being profiled (e.g. fetch, store).
+@contextmanager
+def profile_if_selected(ticker, label='', directory=RUN_REPORT_DIR, selected=None):
+    selected = PROFILE_TICKER if selected is None else selected
+    if not selected or ticker != selected:
+        yield
+        return
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+
+        os.makedirs(directory or '.', exist_ok=True)
+        name = f"{ticker}-{label}" if label else ticker
+        path = os.path.join(directory or '.', f"profile-{name}.pstats")
+        profiler.dump_stats(path)
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(15)
+        print(text.getvalue())
+        print(f"Profile of {name} written to {path}; peak traced memory {peak / 1e6:.1f} MB")
+        for stat in snapshot.statistics('lineno')[:10]:
+            print(stat)
@@ -0,0 +1,90 @@
+import json
+import re
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+# Shared NaN/Inf cleaning used by datafetcher and dailydatacruncher. Values are masked in bulk on
+# NumPy/pandas columns rather than walked one by one.
+
+_NON_FINITE = re.compile(r'-?Infinity|NaN')
+_NON_FINITE_OR_STRING = re.compile(r'"(?:[^"\\]|\\.)*"|(-?Infinity|NaN)')
+
+
+# Function to mask NaN and +/-Inf in a pandas Series/DataFrame or NumPy array.
+# Numeric pandas data keeps its dtype with NaN as the missing marker (to_json writes null);
+# object data gets None. Arrays come back as float64 with NaN.
+def mask_non_finite(data):
+    if isinstance(data, pd.Series):
+        if pd.api.types.is_numeric_dtype(data.dtype):
+            return data.where(np.isfinite(data))
+        numeric = pd.to_numeric(data, errors='coerce')
+        return data.where(~(data.isna() | numeric.isin([np.inf, -np.inf])), None)
+    if isinstance(data, pd.DataFrame):
+        return data.apply(mask_non_finite)
+    values = np.asarray(data, dtype=np.float64)
+    return np.where(np.isfinite(values), values, np.nan)
+
+
+# Function to turn an iterable of numbers/None into a float64 array with every non-finite value as NaN
+def finite_array(values):
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'iuf':
+        array = values.astype(np.float64)
+    else:
+        if not isinstance(values, (list, tuple, np.ndarray)):
+            values = list(values)
+        array = None
+        # The float64 conversion would also parse numeric strings ('1.5') and booleans; like summarysql,
+        # which only sums JSON numbers, they count as nothing
+        if not any(isinstance(value, (str, bool, np.bool_)) for value in values):
+            try:
+                array = np.asarray(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                pass
+        if array is None:
+            # Mixed content (e.g. stray strings in a statement): fall back to a per-element conversion
+            array = np.array([value if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan
+                              for value in values], dtype=np.float64)
+    return np.where(np.isfinite(array), array, np.nan)
+
+
+# Function to sum values while treating None, NaN and +/-Inf as 0 (the old sum(sanitize_data(x) or 0 ...))
+def sum_finite(values):
+    return float(np.nansum(finite_array(values)))
+
+
+# Fallback for objects the stdlib encoder does not know: NumPy scalars/arrays, pandas NA and dates
+def _encode_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is pd.NaT or value is pd.NA:
+        return None
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def _replace_non_finite(match):
+    return 'null' if match.group(1) else match.group(0)
+
+
+# Function to encode to JSON with non-finite floats as null, without walking the object first.
+# The C encoder runs with allow_nan=True and the NaN/Infinity tokens it emits are rewritten to null
+# afterwards. Splitting on '"' puts everything outside string literals at even positions, so
+# only those segments are rewritten; output with escaped quotes takes a slower tokenizing pass.
+def dumps_finite(obj, **kwargs):
+    kwargs.setdefault('default', _encode_default)
+    text = json.dumps(obj, allow_nan=True, **kwargs)
+    if 'NaN' not in text and 'Infinity' not in text:
+        return text
+    if '\\"' in text:
+        return _NON_FINITE_OR_STRING.sub(_replace_non_finite, text)
+    parts = text.split('"')
+    for index in range(0, len(parts), 2):
+        part = parts[index]
+        if 'NaN' in part or 'Infinity' in part:
+            parts[index] = _NON_FINITE.sub('null', part)
+    return '"'.join(parts)
@@ -0,0 +1,183 @@
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import traceback
+
+from fetchpipeline import FETCH_RATE_PER_HOST
+from jobscheduler import JOB_CLAIM_BATCH, JobScheduler
+from runmetrics import RunMetrics
+
+# Sharded datafetcher run: the symbol list is split across INGEST_SHARDS worker processes, each
+# running datafetcher.main with its own Postgres connection pool, fetch workers (FETCH_WORKERS,
+# WRITE_WORKERS, HISTORY_BATCH_SIZE apply per shard) and interpreter, so the pandas parsing and JSON
+# conversion run on every core instead of one. Shards schedule their own tickers into the shared Redis
+# job queue (see jobscheduler) and claim from it, so a shard that runs out of work picks up tickers
+# left over by slower ones. The coordinator merges their progress, failures and run metrics.
+#
+# Every shard opens up to WRITE_WORKERS + 2 connections (datafetcher.MAIN_CONNECTIONS); keep
+# INGEST_SHARDS * (WRITE_WORKERS + 2) below the connections Postgres allows (run_sharded warns if not).
+INGEST_SHARDS = int(os.environ.get('INGEST_SHARDS', str(os.cpu_count() or 1)))
+# Seconds between merged progress lines
+INGEST_PROGRESS_SECONDS = float(os.environ.get('INGEST_PROGRESS_SECONDS', '30'))
+
+
+# Scheduler that also reports every completion and failure to the coordinator
+class ReportingScheduler(JobScheduler):
+    def __init__(self, redis_client, shard, events, **kwargs):
+        super().__init__(redis_client, **kwargs)
+        self.shard = shard
+        self.events = events
+
+    def complete(self, ticker):
+        super().complete(ticker)
+        self.events.put(('done', self.shard, ticker, None))
+
+    def fail(self, ticker, error=None):
+        retrying = super().fail(ticker, error)
+        self.events.put(('retry' if retrying else 'failed', self.shard, ticker, str(error)))
+        return retrying
+
+
+# Function to split the symbol list into shards. The list is ordered by market cap, so taking every
+# n-th symbol gives each shard a similar mix of large and small companies.
+def split_shards(tickers, shards):
+    shards = max(shards, 1)
+    return [tickers[index::shards] for index in range(shards) if tickers[index::shards]]
+
+
+# Function to work out the settings each shard runs with. Yahoo rate-limits per client address, so the
+# per-host request budget is divided between the shards. Claims are kept small enough that the queue is
+# spread over all shards (about four claims each) instead of drained by the first. They are passed to
+# datafetcher.main as arguments: its modules read the environment when first imported, and a spawned
+# shard imports them (through this module) before it could change it.
+def shard_settings(shards, tickers, rate=FETCH_RATE_PER_HOST, claim_batch=JOB_CLAIM_BATCH):
+    shards = max(shards, 1)
+    return {
+        'rate_per_host': rate / shards,
+        'claim_batch': max(1, min(claim_batch, tickers // (shards * 4))),
+    }
+
+
+# Function to work out how many Postgres connections the shards open between them, warning when that is
+# more than the server allows non-superusers (the coordinator's own connection is closed by then)
+def connection_budget(shards, per_shard, available):
+    needed = shards * per_shard
+    if needed > available:
+        print(f"Warning: {shards} shards open up to {needed} Postgres connections but only {available} are "
+              f"available; lower INGEST_SHARDS or WRITE_WORKERS")
+    return needed
+
+
+# Function run in each shard process
+def run_shard(shard, tickers, events, settings):
+    import datafetcher
+
+    scheduler = ReportingScheduler(datafetcher.get_redis_client(), shard, events)
+    error = None
+    try:
+        datafetcher.main(tickers, scheduler=scheduler, prepare=False, write_report=False, **settings)
+    except Exception as e:
+        traceback.print_exc()
+        error = f"{type(e).__name__}: {e}"
+    events.put(('finished', shard, None, {'error': error, 'metrics': datafetcher.metrics.snapshot()}))
+
+
+# Function to print one merged progress line
+def print_progress(progress, retrying, failures, started):
+    done = sum(counts['done'] for counts in progress.values())
+    elapsed = time.perf_counter() - started
+    shards = ', '.join(f"{shard}: {counts['done']}" for shard, counts in sorted(progress.items()))
+    print(f"Progress: {done} tickers done, {len(retrying)} awaiting retry, {len(failures)} failed "
+          f"in {elapsed:.0f}s ({done / elapsed if elapsed > 0 else 0:.1f}/sec; per shard {shards})")
+
+
+# Function to run the refresh across `shards` processes and wait for all of them. Returns the merged
+# run report; shard errors are listed under 'shard_errors' and given-up tickers under 'failures'.
+def run_sharded(tickers, shards=INGEST_SHARDS):
+    import datafetcher
+
+    # Schema creation and one-off maintenance run once here, not concurrently in every shard
+    conn = datafetcher.connect_db()
+    datafetcher.prepare_db(conn)
+    with conn.cursor() as cur:
+        cur.execute("SELECT current_setting('max_connections')::int - current_setting('superuser_reserved_connections')::int")
+        available = cur.fetchone()[0]
+    conn.close()
+
+    parts = split_shards(tickers, shards)
+    connection_budget(len(parts), datafetcher.MAIN_CONNECTIONS, available)
+    context = multiprocessing.get_context('spawn')
+    events = context.Queue()
+    settings = shard_settings(len(parts), len(tickers))
+    processes = {}
+    for shard, part in enumerate(parts):
+        processes[shard] = context.Process(target=run_shard, args=(shard, part, events, settings),
+                                           name=f"ingest-shard-{shard}")
+        processes[shard].start()
+    print(f"Started {len(processes)} shards for {len(tickers)} tickers")
+
+    merged = RunMetrics('datafetcher')
+    started = time.perf_counter()
+    progress = {shard: {'done': 0, 'retried': 0, 'failed': 0} for shard in processes}
+    retrying, failures, shard_errors, finished = set(), {}, {}, set()
+    last_progress = time.monotonic()
+    while len(finished) < len(processes):
+        try:
+            kind, shard, ticker, detail = events.get(timeout=1)
+        except queue.Empty:
+            # A shard killed from outside (OOM, signal) never reports; its leased tickers expire and
+            # are picked up by the next run
+            for shard, process in processes.items():
+                if shard not in finished and not process.is_alive():
+                    shard_errors[shard] = f"exited with code {process.exitcode} without reporting"
+                    finished.add(shard)
+            kind = None
+
+        if kind == 'done':
+            progress[shard]['done'] += 1
+            retrying.discard(ticker)
+            failures.pop(ticker, None)
+        elif kind == 'retry':
+            progress[shard]['retried'] += 1
+            retrying.add(ticker)
+        elif kind == 'failed':
+            progress[shard]['failed'] += 1
+            retrying.discard(ticker)
+            failures[ticker] = detail
+        elif kind == 'finished':
+            finished.add(shard)
+            merged.merge(detail['metrics'])
+            if detail['error']:
+                shard_errors[shard] = detail['error']
+
+        if time.monotonic() - last_progress >= INGEST_PROGRESS_SECONDS:
+            print_progress(progress, retrying, failures, started)
+            last_progress = time.monotonic()
+
+    for process in processes.values():
+        process.join()
+    print_progress(progress, retrying, failures, started)
+
+    merged.add('shards', len(processes))
+    merged.add('shards_failed', len(shard_errors))
+    for shard, counts in progress.items():
+        merged.add(f"shard_{shard}_tickers_done", counts['done'])
+    report = merged.write()
+    report['failures'] = failures
+    report['shard_errors'] = shard_errors
+    for ticker, error in sorted(failures.items()):
+        print(f"Failed: {ticker}: {error}")
+    if retrying:
+        print(f"{len(retrying)} tickers still waiting for a retry; the next run picks them up")
+    for shard, error in sorted(shard_errors.items()):
+        print(f"Shard {shard} failed: {error}")
+    return report
+
+
+if __name__ == '__main__':
+    from symboluniverse import load_symbols
+
+    report = run_sharded(load_symbols())
+    sys.exit(1 if report['shard_errors'] else 0)
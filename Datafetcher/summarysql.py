@@ -0,0 +1,97 @@
+# Summary aggregation shared by dailydatacruncher (Postgres) and yfinancedatafetcher's local SQLite
+# mode. Only builds SQL and runs it on the connection it is given, so it has no driver or Redis imports.
+
+METRICS = ['market_cap', 'profit', 'revenue', 'eps', 'debt']
+
+FINANCIAL_METRICS = [
+    ('profit', 'income_statement', 'Net Income'),
+    ('revenue', 'income_statement', 'Total Revenue'),
+    ('eps', 'income_statement', 'Basic EPS'),
+    ('debt', 'balance_sheet', 'Total Debt'),
+]
+
+# Function to build the SQL that reads one numeric key out of a Financials document, or NULL
+# when it is missing or not a number (the SQL counterpart of sum_finite)
+def json_number_sql(key, dialect):
+    if dialect == 'sqlite':
+        return f"""CASE WHEN json_type(data, '$."{key}"') IN ('integer', 'real') THEN json_extract(data, '$."{key}"') END"""
+    return f"CASE WHEN jsonb_typeof(data->'{key}') = 'number' THEN (data->>'{key}')::double precision END"
+
+# Function to build the per-row SQL expression of every FINANCIAL_METRICS entry
+def financial_metric_expressions(dialect):
+    expressions = []
+    for _, statement_type, key in FINANCIAL_METRICS:
+        expressions.append(f"CASE WHEN statement_type = '{statement_type}' THEN {json_number_sql(key, dialect)} END")
+    return expressions
+
+# Function to build the SUM of every FINANCIAL_METRICS entry over FinancialLineItem rows (see
+# lineitems) joined to LineItem as li; each metric is one indexed line item, no JSON is decoded
+def line_item_metric_sums():
+    return [f"COALESCE(SUM(f.value) FILTER (WHERE f.statement_type = '{statement_type}' AND li.name = '{key}'), 0)"
+            for _, statement_type, key in FINANCIAL_METRICS]
+
+# Function to build the FROM/WHERE clause that reads the FINANCIAL_METRICS line items
+def line_item_metric_source():
+    names = ', '.join(f"'{key}'" for _, _, key in FINANCIAL_METRICS)
+    return f"""FinancialLineItem f
+        JOIN LineItem li ON li.id = f.line_item_id
+        WHERE f.statement_type IN ('income_statement', 'balance_sheet') AND li.name IN ({names})"""
+
+# Function to map NaN/Infinity REAL values to NULL in SQL
+def finite_sql(column):
+    return f"CASE WHEN {column} IN ('NaN', 'Infinity', '-Infinity') THEN NULL ELSE {column} END"
+
+# Function to compute the summary metric totals inside the database with one grouped query;
+# only the five scalars come back to Python. dialect is 'postgres' (typed line items) or 'sqlite'
+# (JSON1 over Financials.data).
+def aggregate_metrics_sql(conn, dialect='postgres'):
+    if dialect == 'sqlite':
+        sums = ',\n            '.join(f"COALESCE(SUM({expression}), 0)" for expression in financial_metric_expressions(dialect))
+        source = "Financials\n        WHERE statement_type IN ('income_statement', 'balance_sheet')"
+    else:
+        sums = ',\n            '.join(line_item_metric_sums())
+        source = line_item_metric_source()
+    market_cap_type = 'REAL' if dialect == 'sqlite' else 'double precision'
+    # Market cap is a point-in-time figure: the total counts each stock's latest snapshot only
+    query = f"""
+        SELECT
+            (SELECT CAST(COALESCE(SUM(fu.market_cap), 0) AS {market_cap_type})
+             FROM Fundamentals fu
+             JOIN (SELECT stock_id, MAX(date) AS date FROM Fundamentals GROUP BY stock_id) latest
+             ON latest.stock_id = fu.stock_id AND latest.date = fu.date),
+            {sums}
+        FROM {source}
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(query)
+        return dict(zip(METRICS, cur.fetchone()))
+    finally:
+        cur.close()
+
+# Function to turn raw metric totals into the summary payload
+def build_summary(totals):
+    total_market_cap = totals['market_cap'] / 10000000
+    total_profit = totals['profit'] / 10000000
+    total_revenue = totals['revenue'] / 10000000
+    combined_eps = totals['eps']
+    total_debt = totals['debt'] / 10000000
+
+    avg_profit_per_mcap = total_profit / (total_market_cap / 1000) if total_market_cap else 0
+    avg_profit_per_revenue = total_profit / (total_revenue / 1000) if total_revenue else 0
+    avg_debt_per_mcap = total_debt / (total_market_cap / 1000) if total_market_cap else 0
+    avg_debt_per_revenue = total_debt / (total_revenue / 1000) if total_revenue else 0
+
+    response_data = {
+        'totalMarketCap': total_market_cap,
+        'totalProfit': total_profit,
+        'combinedEPS': combined_eps,
+        'totalDebt': total_debt,
+        'totalRevenue': total_revenue,
+        'avgProfitPerMcap': avg_profit_per_mcap,
+        'avgProfitPerRevenue': avg_profit_per_revenue,
+        'avgDebtPerMcap': avg_debt_per_mcap,
+        'avgDebtPerRevenue': avg_debt_per_revenue,
+    }
+
+    return response_data
@@ -0,0 +1,82 @@
+import hashlib
+import os
+import time
+
+# The ticker universe comes from one column of the market cap sheet. Parsing the .xlsx takes over a
+# second (openpyxl plus pandas), so the column is compiled once into a plain-text sidecar, one symbol
+# per line, named after a hash of the sheet and the column. Later runs read the sidecar in
+# milliseconds; editing or replacing the sheet changes the hash, so a stale list is never used.
+SYMBOL_SHEET = os.environ.get('SYMBOL_SHEET', './MCAP28032024.xlsx')
+SYMBOL_COLUMN = os.environ.get('SYMBOL_COLUMN', 'Symbol')
+# Where sidecars are written; empty means next to the sheet
+SYMBOL_CACHE_DIR = os.environ.get('SYMBOL_CACHE_DIR', '')
+
+SIDECAR_SUFFIX = '.symbols'
+
+
+# Function to hash the sheet's bytes together with the column name
+def sheet_digest(path, column):
+    digest = hashlib.sha256(column.encode())
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+# Function to return the sidecar path of a sheet/column digest
+def sidecar_path(path, digest, cache_dir=SYMBOL_CACHE_DIR):
+    directory = cache_dir or os.path.dirname(os.path.abspath(path))
+    return os.path.join(directory, f"{os.path.basename(path)}.{digest}{SIDECAR_SUFFIX}")
+
+
+# Function to read one column of the first sheet, top to bottom, skipping blank cells. openpyxl is
+# imported here, so runs served from the sidecar never load it.
+def read_sheet_column(path, column):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        header = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+        if column not in header:
+            raise ValueError(f"{path} has no '{column}' column")
+        # The first column of that name, as pd.read_excel would pick it
+        position = header.index(column) + 1
+        values = []
+        for (value,) in sheet.iter_rows(min_row=2, min_col=position, max_col=position, values_only=True):
+            if value is not None and str(value).strip():
+                values.append(str(value).strip())
+        return values
+    finally:
+        workbook.close()
+
+
+# Function to write the sidecar atomically and drop sidecars of older versions of the sheet
+def write_sidecar(path, target, symbols):
+    directory = os.path.dirname(target)
+    os.makedirs(directory, exist_ok=True)
+    with open(target + '.tmp', 'w') as f:
+        f.write('\n'.join(symbols) + '\n')
+    os.replace(target + '.tmp', target)
+    prefix = os.path.basename(path) + '.'
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(SIDECAR_SUFFIX) and os.path.join(directory, name) != target:
+            os.remove(os.path.join(directory, name))
+
+
+# Function to load the ticker symbols in sheet order, from the sidecar when it matches the sheet
+def load_symbols(path=SYMBOL_SHEET, column=SYMBOL_COLUMN, cache_dir=SYMBOL_CACHE_DIR):
+    started = time.perf_counter()
+    target = sidecar_path(path, sheet_digest(path, column), cache_dir)
+    if os.path.exists(target):
+        with open(target) as f:
+            return [line for line in f.read().split('\n') if line]
+
+    symbols = read_sheet_column(path, column)
+    try:
+        write_sidecar(path, target, symbols)
+    except OSError as e:
+        # A read-only checkout still works, it just parses the sheet every time
+        print(f"Could not write symbol cache {target}: {e}")
+    print(f"Read {len(symbols)} symbols from {path} in {time.perf_counter() - started:.2f}s")
+    return symbols
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+# The modules under test are flat scripts in Datafetcher/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+# Stand-in for a psycopg2 connection that records statements and commits; set fail_commit to make
+# the next commit raise, and queue rows in results for the fetchone calls that follow
+class FakeConnection:
+    def __init__(self):
+        self.statements = []
+        self.results = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.fail_commit = None
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            rowcount = 0
+
+            def execute(self, statement, params=None):
+                connection.statements.append(statement)
+
+            def fetchone(self):
+                return connection.results.pop(0) if connection.results else None
+
+        return Cursor()
+
+    def commit(self):
+        if self.fail_commit is not None:
+            error, self.fail_commit = self.fail_commit, None
+            raise error
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def fake_conn():
+    return FakeConnection()
@@ -0,0 +1,128 @@
+import sys
+import types
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from batchfetch import BatchHistoryFetcher, EmptySymbolStore, FixtureProvider, YFinanceDownloadProvider
+
+
+class FailingProvider:
+    def __init__(self):
+        self.calls = 0
+
+    def download(self, symbols, start, end):
+        self.calls += 1
+        raise ConnectionError('rate limited')
+
+
+# Answers only for the symbols it was given frames for, like yf.download after a per-symbol failure
+class PartialProvider:
+    def __init__(self, frames):
+        self.frames = frames
+
+    def download(self, symbols, start, end):
+        return pd.concat({symbol: self.frames[symbol] for symbol in symbols if symbol in self.frames}, axis=1)
+
+
+def history(days):
+    index = pd.DatetimeIndex([pd.Timestamp(day) for day in days])
+    return pd.DataFrame({column: [1.0] * len(days) for column in ['Open', 'High', 'Low', 'Close', 'Volume']}, index=index)
+
+
+def test_failed_download_returns_none_and_marks_nothing_empty():
+    provider = FailingProvider()
+    store = EmptySymbolStore()
+    fetcher = BatchHistoryFetcher(provider=provider, empty_store=store)
+
+    results = fetcher.fetch({'AAA': (None, date(2026, 10, 16)), 'BBB': (None, date(2026, 10, 16))})
+
+    assert results == {'AAA': None, 'BBB': None}
+    assert not store.is_known_empty('AAA') and not store.is_known_empty('BBB')
+    # Nothing was remembered, so the next run asks again
+    fetcher.fetch({'AAA': (None, date(2026, 10, 16))})
+    assert provider.calls == 2
+
+
+def test_symbols_left_out_of_the_download_are_not_marked_empty():
+    provider = PartialProvider({'AAA': history(['2026-10-14', '2026-10-15'])})
+    store = EmptySymbolStore()
+
+    results = BatchHistoryFetcher(provider=provider, empty_store=store).fetch(
+        {'AAA': (None, date(2026, 10, 16)), 'BBB': (None, date(2026, 10, 16))})
+
+    assert len(results['AAA']) == 2
+    assert results['BBB'] is None
+    assert not store.is_known_empty('BBB')
+
+
+def test_reported_empty_history_is_remembered(tmp_path):
+    history(['2026-10-14', '2026-10-15']).to_csv(tmp_path / 'AAA.csv')
+    store = EmptySymbolStore()
+    fetcher = BatchHistoryFetcher(provider=FixtureProvider(str(tmp_path)), empty_store=store)
+
+    results = fetcher.fetch({'AAA': (None, date(2026, 10, 16)), 'BBB': (None, date(2026, 10, 16))})
+
+    assert len(results['AAA']) == 2
+    assert results['BBB'].empty
+    assert store.is_known_empty('BBB') and not store.is_known_empty('AAA')
+    # A range request with no new sessions is not escalated
+    results = fetcher.fetch({'AAA': (date(2026, 10, 16), date(2026, 10, 17))})
+    assert results['AAA'].empty and not store.is_known_empty('AAA')
+
+
+# Stand-in for the yfinance module: download answers with the given wide frame, Ticker(...).history with
+# the per-ticker frames (missing symbols have no rows, symbols in failing raise)
+def stub_yfinance(monkeypatch, wide, histories=None, failing=()):
+    checked = []
+
+    class Ticker:
+        def __init__(self, symbol):
+            self.symbol = symbol
+
+        def history(self, **kwargs):
+            checked.append(self.symbol)
+            if self.symbol in failing:
+                raise ConnectionError('read timed out')
+            return (histories or {}).get(self.symbol, history([]))
+
+    monkeypatch.setitem(sys.modules, 'yfinance', types.SimpleNamespace(download=lambda *args, **kwargs: wide, Ticker=Ticker))
+    return checked
+
+
+def test_yfinance_all_nan_symbols_are_empty_once_confirmed(monkeypatch):
+    traded = history(['2026-10-14', '2026-10-15'])
+    failed = traded.copy()
+    failed[:] = np.nan
+    wide = pd.concat({'AAA.NS': traded, 'BBB.NS': failed, 'CCC.NS': failed}, axis=1)
+    # CCC has rows after all, so its all-NaN columns were a failure inside the download
+    checked = stub_yfinance(monkeypatch, wide, histories={'CCC.NS': traded})
+    store = EmptySymbolStore()
+    fetcher = BatchHistoryFetcher(provider=YFinanceDownloadProvider(), empty_store=store)
+
+    results = fetcher.fetch({symbol: (None, date(2026, 10, 16)) for symbol in ['AAA', 'BBB', 'CCC']})
+
+    assert len(results['AAA']) == 2
+    assert results['BBB'].empty and store.is_known_empty('BBB')
+    assert results['CCC'] is None and not store.is_known_empty('CCC')
+    assert checked == ['BBB.NS', 'CCC.NS']
+    # The delisted symbol is skipped from now on
+    fetcher.fetch({'BBB': (None, date(2026, 10, 17))})
+    assert fetcher.requests_made == 3
+
+
+def test_yfinance_empty_download_answers_every_symbol(monkeypatch):
+    checked = stub_yfinance(monkeypatch, pd.DataFrame(), failing={'BBB.NS'})
+    store = EmptySymbolStore()
+    fetcher = BatchHistoryFetcher(provider=YFinanceDownloadProvider(), empty_store=store)
+
+    # No new sessions in the range: nothing to fall back on and nothing to check
+    results = fetcher.fetch({'AAA': (date(2026, 10, 16), date(2026, 10, 17)), 'BBB': (date(2026, 10, 16), date(2026, 10, 17))})
+    assert results['AAA'].empty and results['BBB'].empty
+    assert checked == []
+
+    # A full-history request is only remembered as empty where the per-ticker check succeeds
+    results = fetcher.fetch({'AAA': (None, date(2026, 10, 16)), 'BBB': (None, date(2026, 10, 16))})
+    assert results['AAA'].empty and store.is_known_empty('AAA')
+    assert results['BBB'] is None and not store.is_known_empty('BBB')
@@ -0,0 +1,106 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+for name in ('DB_NAME', 'DB_USER', 'DB_PASSWORD'):
+    os.environ.setdefault(name, 'test')  # dbutil reads these at import time
+
+import dailydatacruncher
+from dailydatacruncher import CRUNCH_OVERLAP
+from summarysql import METRICS
+
+WATERMARK = datetime(2026, 10, 16, 18, 0)
+
+
+# Stand-in for the Postgres side of the incremental crunch: answers the watermark, change and
+# CrunchState reads, and records which stocks were refreshed and where the watermark moved
+class CrunchConnection:
+    def __init__(self, watermark, changed=(), newest=None):
+        self.watermark = watermark
+        self.changed = list(changed)
+        self.newest = newest
+        self.since = None
+        self.refreshed = []
+        self.watermarks = []
+        self.commits = 0
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            rows = None
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, statement, params=None):
+                if 'SELECT watermark FROM CrunchWatermark' in statement:
+                    self.rows = [(connection.watermark,)] if connection.watermark else []
+                elif 'INSERT INTO CrunchWatermark' in statement:
+                    connection.watermarks.append(params[1])
+                elif 'SELECT GREATEST' in statement:
+                    self.rows = [(connection.newest,)]
+                elif 'MAX(updated_at)' in statement:
+                    connection.since = params
+                    self.rows = connection.changed
+                elif statement.startswith('DELETE FROM CrunchState'):
+                    connection.refreshed.append(params['stock_ids'])
+                elif 'FROM CrunchState' in statement and 'SUM' in statement:
+                    self.rows = [tuple(1.0 for _ in METRICS)]
+                elif 'FROM CrunchState' in statement:
+                    self.rows = []
+
+            def fetchone(self):
+                return self.rows[0] if self.rows else None
+
+            def fetchall(self):
+                return self.rows
+
+        return Cursor()
+
+    def commit(self):
+        self.commits += 1
+
+
+def test_first_run_rebuilds_every_stock():
+    conn = CrunchConnection(None, newest=WATERMARK)
+
+    summary, latest = dailydatacruncher.crunch_incremental(conn)
+
+    assert conn.refreshed == [None]
+    assert conn.watermarks == [WATERMARK]
+    assert summary['totalMarketCap'] == pytest.approx(1e-7) and latest == []
+
+
+def test_changes_are_read_from_the_overlap_before_the_watermark():
+    changed = [(5, WATERMARK + timedelta(minutes=5)), (7, WATERMARK - timedelta(minutes=10))]
+    conn = CrunchConnection(WATERMARK, changed)
+
+    dailydatacruncher.crunch_incremental(conn)
+
+    # A row committed late with an older updated_at is still picked up
+    assert conn.since == (WATERMARK - CRUNCH_OVERLAP, WATERMARK - CRUNCH_OVERLAP)
+    assert conn.refreshed == [[5, 7]]
+    assert conn.watermarks == [WATERMARK + timedelta(minutes=5)]
+
+
+def test_watermark_never_moves_back():
+    conn = CrunchConnection(WATERMARK, [(7, WATERMARK - timedelta(minutes=10))])
+
+    dailydatacruncher.crunch_incremental(conn)
+
+    assert conn.refreshed == [[7]]
+    assert conn.watermarks == [WATERMARK]
+
+
+def test_no_changes_refresh_nothing():
+    conn = CrunchConnection(WATERMARK)
+
+    dailydatacruncher.crunch_incremental(conn)
+
+    assert conn.refreshed == []
+    assert conn.watermarks == []
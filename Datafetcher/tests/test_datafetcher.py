@@ -0,0 +1,195 @@
+import pandas as pd
+import pytest
+
+import datafetcher
+from conftest import FakeConnection
+from unitofwork import ThroughputCounter
+
+
+def payload(ticker):
+    index = pd.DatetimeIndex(['2026-10-15', '2026-10-16'])
+    return {'ticker': ticker, 'data': pd.DataFrame({'Close': [1.0, 2.0]}, index=index), 'info': {}, 'statements': []}
+
+
+def test_failed_bulk_flush_fails_only_the_ticker_that_still_fails(fake_conn, monkeypatch):
+    monkeypatch.setattr(datafetcher, 'BULK_BATCH_SIZE', 2)
+    monkeypatch.setattr(datafetcher, 'price_cache', None)
+    monkeypatch.setattr(datafetcher, 'insert_stock', lambda conn, ticker: len(ticker))
+    monkeypatch.setattr(datafetcher, 'insert_fundamentals_snapshot', lambda conn, stock_id, date, info: False)
+    flushed = []
+
+    def bulk_insert(conn, batch):
+        stock_ids = [stock_id for stock_id, _ in batch]
+        if 4 in stock_ids:
+            raise ValueError('value out of range for type bigint')
+        flushed.append(stock_ids)
+        return sum(len(data) for _, data in batch)
+
+    monkeypatch.setattr(datafetcher, 'bulk_insert_stock_data', bulk_insert)
+    counter = ThroughputCounter()
+    uow, pending = datafetcher.create_writer(fake_conn, counter)
+    uow.batch_size = 10
+    done, failed = [], []
+
+    for ticker in ['AAA', 'BB', 'CCCC', 'DD', 'EEE']:
+        datafetcher.store_ticker_payload(uow, payload(ticker), pending, done.append,
+                                         lambda ticker, error: failed.append((ticker, type(error))))
+    datafetcher.commit_batch(uow)
+
+    # The [CCCC, DD] flush failed as a whole; written one by one, only CCCC still fails
+    assert failed == [('CCCC', ValueError)]
+    assert done == ['AAA', 'BB', 'DD', 'EEE']
+    assert flushed == [[3, 2], [2], [3]]
+    assert pending == []
+    assert fake_conn.commits == 1 and fake_conn.rollbacks == 0
+    assert (counter.tickers, counter.failed, counter.rows['StockData']) == (4, 1, 8)
+    assert fake_conn.statements.count("ROLLBACK TO SAVEPOINT stock_data_flush") == 2
+
+
+def test_failed_commit_fails_the_whole_batch(fake_conn, monkeypatch):
+    monkeypatch.setattr(datafetcher, 'BULK_BATCH_SIZE', 2)
+    monkeypatch.setattr(datafetcher, 'price_cache', None)
+    monkeypatch.setattr(datafetcher, 'insert_stock', lambda conn, ticker: len(ticker))
+    monkeypatch.setattr(datafetcher, 'insert_fundamentals_snapshot', lambda conn, stock_id, date, info: False)
+    monkeypatch.setattr(datafetcher, 'bulk_insert_stock_data', lambda conn, batch: 0)
+    uow, pending = datafetcher.create_writer(fake_conn, ThroughputCounter())
+    uow.batch_size = 10
+    done, failed = [], []
+
+    for ticker in ['AAA', 'BB', 'CCCC']:
+        datafetcher.store_ticker_payload(uow, payload(ticker), pending, done.append,
+                                         lambda ticker, error: failed.append(ticker))
+    fake_conn.fail_commit = ConnectionError('server closed the connection')
+    datafetcher.commit_batch(uow)
+
+    assert failed == ['AAA', 'BB', 'CCCC']
+    assert done == []
+
+
+def test_legacy_stock_data_dates_are_shifted_once(fake_conn):
+    # Not yet recorded; 3 Sunday rows against none on a Friday; both derived tables exist
+    fake_conn.results = [None, (3, 0), ('stockindicators',), ('marketbreadth',)]
+
+    datafetcher.migrate_stock_data_dates(fake_conn)
+
+    statements = [' '.join(statement.split()) for statement in fake_conn.statements]
+    assert statements[2] == "UPDATE StockData SET date = date + 100001"
+    assert statements[3].startswith("UPDATE StockData SET date = date - 100000, updated_at =")
+    assert "TRUNCATE StockIndicators" in statements and "TRUNCATE MarketBreadth" in statements
+    assert statements[-1].startswith("INSERT INTO SchemaMigration")
+    assert fake_conn.commits == 1
+
+
+def test_stock_data_already_in_exchange_dates_is_left_alone(fake_conn):
+    fake_conn.results = [None, (0, 40)]
+    datafetcher.migrate_stock_data_dates(fake_conn)
+    assert not any(statement.lstrip().startswith('UPDATE') for statement in fake_conn.statements)
+    assert fake_conn.statements[-1].startswith("INSERT INTO SchemaMigration")
+
+    recorded = type(fake_conn)()
+    recorded.results = [(1,)]
+    datafetcher.migrate_stock_data_dates(recorded)
+    assert len(recorded.statements) == 1 and recorded.commits == 0
+
+
+# Stand-in for yfinance: every Ticker serves two settled sessions, stock.info and three statements;
+# BOOM fails its stock.info request
+class StubTicker:
+    created = []
+
+    def __init__(self, symbol):
+        StubTicker.created.append(symbol)
+        self.symbol = symbol
+        statement = pd.DataFrame({'2026-03-31': {'Total Revenue': 10.0}})
+        self.balance_sheet = self.financials = self.cashflow = statement
+
+    def history(self, period=None, start=None, end=None):
+        index = pd.DatetimeIndex(['2026-10-12', '2026-10-13']).tz_localize('Asia/Kolkata')
+        return pd.DataFrame({'Open': 1.0, 'High': 1.0, 'Low': 1.0, 'Close': [1.0, 2.0], 'Volume': 100}, index=index)
+
+    @property
+    def info(self):
+        if self.symbol == 'BOOM.NS':
+            raise ConnectionError('rate limited')
+        return {'marketCap': 1000}
+
+
+class StubYFinance:
+    Ticker = StubTicker
+
+
+# Stand-in for the Redis job queue: hands out every ticker once
+class StubScheduler:
+    def __init__(self):
+        self.queue, self.completed, self.failed = [], [], []
+
+    def schedule(self, tickers, scores):
+        self.queue = list(tickers)
+        return len(tickers)
+
+    def pending(self):
+        return len(self.queue)
+
+    def claim(self, count):
+        claimed, self.queue = self.queue[:count], self.queue[count:]
+        return claimed
+
+    def complete(self, ticker):
+        self.completed.append(ticker)
+
+    def fail(self, ticker, error):
+        self.failed.append((ticker, type(error)))
+
+    def next_retry_in(self):
+        return None
+
+
+class StubPool:
+    def getconn(self):
+        return FakeConnection()
+
+    def putconn(self, conn):
+        pass
+
+    def closeall(self):
+        pass
+
+
+@pytest.mark.parametrize('fetch_workers', [1, 3])
+def test_main_fetches_through_the_host_rate_limiter(monkeypatch, fetch_workers):
+    import fetchpipeline
+
+    acquired = []
+
+    class RecordingLimiter(fetchpipeline.HostRateLimiter):
+        def acquire(self, host):
+            acquired.append(host)
+
+    monkeypatch.setattr(fetchpipeline, 'HostRateLimiter', RecordingLimiter)
+    monkeypatch.setattr(datafetcher, 'yf', StubYFinance)
+    monkeypatch.setattr(datafetcher, 'FETCH_WORKERS', fetch_workers)
+    monkeypatch.setattr(datafetcher, 'FETCH_CACHE', False)
+    monkeypatch.setattr(datafetcher, 'fetch_cache', None)
+    monkeypatch.setattr(datafetcher, 'price_cache', None)
+    monkeypatch.setattr(datafetcher, 'HISTORY_BATCH_SIZE', 0)
+    monkeypatch.setattr(datafetcher, 'create_connection_pool', lambda maxconn: StubPool())
+    monkeypatch.setattr(datafetcher, 'load_last_dates', lambda conn: {})
+    monkeypatch.setattr(datafetcher, 'load_market_caps', lambda conn: {})
+    monkeypatch.setattr(datafetcher, 'insert_stock', lambda conn, ticker: len(ticker))
+    monkeypatch.setattr(datafetcher, 'insert_fundamentals_snapshot', lambda conn, stock_id, date, info: True)
+    monkeypatch.setattr(datafetcher, 'insert_financials', lambda conn, stock_id, date, statement_type, data: 1)
+    flushed = []
+    monkeypatch.setattr(datafetcher, 'bulk_insert_stock_data',
+                        lambda conn, batch: flushed.extend(stock_id for stock_id, _ in batch) or 0)
+    StubTicker.created = []
+    scheduler = StubScheduler()
+
+    datafetcher.main(['AAA', 'BOOM', 'CC'], scheduler=scheduler, prepare=False, write_report=False, rate_per_host=2)
+
+    assert sorted(scheduler.completed) == ['AAA', 'CC']
+    assert scheduler.failed == [('BOOM', ConnectionError)]
+    assert sorted(flushed) == [2, 3]
+    assert sorted(set(StubTicker.created)) == ['AAA.NS', 'BOOM.NS', 'CC.NS']
+    # Every request goes through the Yahoo host's bucket: history, stock.info and the three statements,
+    # and for BOOM history and the failed stock.info
+    assert acquired == [fetchpipeline.YAHOO_HOST] * (2 * 5 + 2)
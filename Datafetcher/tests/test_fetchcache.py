@@ -0,0 +1,54 @@
+import pickle
+import zlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fetchcache import FetchCache
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+def statement():
+    return pd.DataFrame(
+        [[1.2345678901234567, np.nan], [123456789012345.0, -0.1]],
+        index=['Total Revenue', 'Basic EPS'],
+        columns=pd.to_datetime(['2026-03-31', '2025-03-31']),
+    )
+
+
+def cache():
+    return FetchCache(fakeredis.FakeStrictRedis(), revalidate_workers=1)
+
+
+def test_cached_values_round_trip_exactly():
+    fetch_cache = cache()
+    info = {'marketCap': 123456789012, 'trailingPE': 21.37, 'sector': 'Energy', 'officers': [{'name': 'A'}]}
+    fetch_cache.get('AAA', 'balance_sheet', statement)
+    fetch_cache.get('AAA', 'info', lambda: info)
+
+    frame, digest = fetch_cache.get('AAA', 'balance_sheet', lambda: pytest.fail('served from the cache'))
+    pd.testing.assert_frame_equal(frame, statement(), check_exact=True, check_index_type=False)
+    assert frame.columns.equals(statement().columns)
+    assert digest is not None
+    assert fetch_cache.get('AAA', 'info', lambda: pytest.fail('served from the cache'))[0] == info
+    fetch_cache.drain()
+
+
+@pytest.mark.parametrize('raw', [
+    zlib.compress(pickle.dumps({'fetched_at': 0.0, 'digest': None, 'value': 'old'})),
+    b'not compressed',
+    zlib.compress(b'{"value": {"json": 1}}'),
+])
+def test_undecodable_entries_are_misses(raw):
+    fetch_cache = cache()
+    fetch_cache.redis_client.set('fetchcache:info:AAA', raw)
+    calls = []
+
+    value, _ = fetch_cache.get('AAA', 'info', lambda: calls.append(1) or {'marketCap': 1})
+
+    assert value == {'marketCap': 1} and calls == [1]
+    # The miss rewrote the entry in the current format
+    assert fetch_cache.get('AAA', 'info', lambda: pytest.fail('served from the cache'))[0] == {'marketCap': 1}
+    fetch_cache.drain()
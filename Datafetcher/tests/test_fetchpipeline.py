@@ -0,0 +1,79 @@
+import threading
+import time
+
+from fetchpipeline import HostRateLimiter, run_pipeline
+
+TICKERS = ['AAA', 'BB', 'BOOM', 'CCCC', 'DD', 'EEE']
+
+
+def stub_fetch(ticker, throttle):
+    throttle()
+    if ticker == 'BOOM':
+        raise ConnectionError('no route to host')
+    return {'ticker': ticker, 'close': float(len(ticker))}
+
+
+def test_single_worker_stores_payloads_in_ticker_order():
+    stored, failures, finished = [], [], []
+
+    result = run_pipeline(TICKERS, stub_fetch, stored.append, workers=1, limiter=HostRateLimiter(rate=0),
+                          writer_done=lambda: finished.append(threading.current_thread().name),
+                          on_failure=lambda ticker, error: failures.append((ticker, type(error))))
+
+    assert result == (5, 1)
+    assert stored == [{'ticker': ticker, 'close': float(len(ticker))} for ticker in TICKERS if ticker != 'BOOM']
+    assert failures == [('BOOM', ConnectionError)]
+    assert finished == ['writer-0']
+
+
+def test_concurrent_workers_store_every_payload_once():
+    stored, lock = [], threading.Lock()
+
+    def store(payload):
+        with lock:
+            stored.append(payload['ticker'])
+        if payload['ticker'] == 'CCCC':
+            raise ValueError('bad row')
+
+    tickers = [f"T{i}" for i in range(50)] + TICKERS
+    failures = []
+    result = run_pipeline(tickers, stub_fetch, store, workers=4, queue_size=2, limiter=HostRateLimiter(rate=0),
+                          writers=3, on_failure=lambda ticker, error: failures.append(ticker))
+
+    assert result == (len(tickers) - 2, 2)
+    assert sorted(stored) == sorted(ticker for ticker in tickers if ticker != 'BOOM')
+    assert sorted(failures) == ['BOOM', 'CCCC']
+
+
+def test_fetches_share_the_host_rate_limit():
+    acquired = []
+
+    class RecordingLimiter(HostRateLimiter):
+        def acquire(self, host):
+            acquired.append(host)
+
+    run_pipeline(TICKERS, stub_fetch, lambda payload: None, workers=3, limiter=RecordingLimiter(), host='example.test')
+
+    assert acquired == ['example.test'] * len(TICKERS)
+
+
+def test_slow_writer_bounds_the_payloads_in_flight():
+    lock = threading.Lock()
+    counts = {'fetched': 0, 'stored': 0, 'peak': 0}
+
+    def fetch(ticker, throttle):
+        with lock:
+            counts['fetched'] += 1
+            counts['peak'] = max(counts['peak'], counts['fetched'] - counts['stored'])
+        return {'ticker': ticker}
+
+    def store(payload):
+        time.sleep(0.002)
+        with lock:
+            counts['stored'] += 1
+
+    run_pipeline([f"T{i}" for i in range(100)], fetch, store, workers=4, queue_size=3, limiter=HostRateLimiter(rate=0))
+
+    # At most a full queue, one payload per writer and one per blocked fetch worker
+    assert counts['stored'] == 100
+    assert counts['peak'] <= 3 + 1 + 4
@@ -0,0 +1,88 @@
+import os
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+for name in ('DB_NAME', 'DB_USER', 'DB_PASSWORD'):
+    os.environ.setdefault(name, 'test')  # dbutil reads these at import time
+
+import indicatorengine
+from indicatorengine import EMA_SPANS, INDICATOR_COLUMNS, LOOKBACK_DAYS, compute_indicators, indicator_frame
+
+DATES = [day.date() for day in pd.bdate_range('2020-01-01', periods=600)]
+
+
+# Function to build a synthetic price matrix: two stocks with the full history, one listed late
+def synthetic_closes():
+    rng = np.random.default_rng(7)
+    closes = {
+        1: 100 * np.cumprod(1 + rng.normal(0, 0.02, len(DATES))),
+        2: 50 * np.cumprod(1 + rng.normal(0, 0.02, len(DATES))),
+        3: 20 * np.cumprod(1 + rng.normal(0, 0.02, 30)),
+    }
+    return {stock_id: (DATES[-len(values):], values) for stock_id, values in closes.items()}
+
+
+# Function to compute and frame the rows for {stock_id: (dates, closes, last_indicator_date)}
+def materialize(history, state):
+    return indicator_frame(history, *compute_indicators(history, state))
+
+
+# Function to run the incremental path the way update_indicators does: each stock reloads
+# LOOKBACK_DAYS before its last indicator row and continues from the state stored on that row
+def extend(closes, stored, upto):
+    history, state = {}, {}
+    for stock_id, (dates, values) in closes.items():
+        rows = stored[stored.stock_id == stock_id]
+        last_date = rows.date.iloc[-1] if len(rows) else None
+        keep = [index for index, day in enumerate(dates)
+                if day <= upto and (last_date is None or day > last_date - timedelta(days=LOOKBACK_DAYS))]
+        if keep and (last_date is None or dates[keep[-1]] > last_date):
+            history[stock_id] = ([dates[index] for index in keep], [values[index] for index in keep], last_date)
+        if len(rows):
+            state[stock_id] = rows.iloc[-1].to_dict()
+    return pd.concat([stored, materialize(history, state)], ignore_index=True)
+
+
+def test_incremental_runs_match_a_full_build():
+    closes = synthetic_closes()
+    full = materialize({stock_id: (dates, values, None) for stock_id, (dates, values) in closes.items()}, {})
+
+    stored = pd.DataFrame(columns=full.columns)
+    for upto in [DATES[500], DATES[501], DATES[550], DATES[-1]]:
+        stored = extend(closes, stored, upto)
+
+    stored = stored.sort_values(['stock_id', 'date'], ignore_index=True)
+    full = full.sort_values(['stock_id', 'date'], ignore_index=True)
+    assert stored[['stock_id', 'date']].values.tolist() == full[['stock_id', 'date']].values.tolist()
+    np.testing.assert_allclose(stored[INDICATOR_COLUMNS].to_numpy(dtype=float), full[INDICATOR_COLUMNS].to_numpy(dtype=float),
+                               rtol=1e-9, atol=1e-9)
+
+
+def test_full_build_matches_the_textbook_formulas():
+    closes = synthetic_closes()
+    full = materialize({stock_id: (dates, values, None) for stock_id, (dates, values) in closes.items()}, {})
+    first = full[full.stock_id == 1].reset_index(drop=True)
+    series = pd.Series(closes[1][1])
+
+    np.testing.assert_allclose(first.sma_20, series.rolling(20).mean(), equal_nan=True)
+    for span in EMA_SPANS:
+        np.testing.assert_allclose(first[f"ema_{span}"], series.ewm(span=span, adjust=False).mean())
+    np.testing.assert_allclose(first.high_52w, series.rolling(252, min_periods=1).max())
+    np.testing.assert_allclose(first.return_5d, series.pct_change(5), equal_nan=True)
+    # The late listing has no 50-session average yet but does have its short windows
+    late = full[full.stock_id == 3]
+    assert len(late) == 30 and late.sma_50.isna().all() and late.sma_20.notna().sum() == 11
+
+
+def test_frame_holds_only_rows_after_the_last_indicator_date():
+    closes = synthetic_closes()
+    dates, values = closes[1]
+    history = {1: (dates[-300:], values[-300:], dates[-3])}
+    state = {1: dict.fromkeys([f"ema_{span}" for span in EMA_SPANS] + ['rsi_avg_gain', 'rsi_avg_loss'], 1.0)}
+
+    frame = indicatorengine.indicator_frame(history, *compute_indicators(history, state))
+
+    assert frame.date.tolist() == dates[-2:]
+    assert list(frame.columns) == ['stock_id', 'date'] + INDICATOR_COLUMNS
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+from lineitems import MIGRATION_NAME, finite_line_items, migrate_financials, write_line_items
+
+
+# Stand-in for a psycopg2 connection: records (statement, params), answers fetches with the rows queued
+# for the first statement fragment that matches, and reports rowcount for the inserts
+class ScriptedConnection:
+    def __init__(self, answers=None, rowcount=0):
+        self.answers = answers or {}
+        self.rowcount = rowcount
+        self.executed = []
+        self.commits = 0
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            rows = []
+            rowcount = 0
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, statement, params=None):
+                connection.executed.append((' '.join(statement.split()), params))
+                self.rows = next((rows for fragment, rows in connection.answers.items() if fragment in statement), [])
+                self.rowcount = connection.rowcount if statement.lstrip().startswith('INSERT') else 0
+
+            def fetchone(self):
+                return self.rows[0] if self.rows else None
+
+            def fetchall(self):
+                return self.rows
+
+        return Cursor()
+
+    def commit(self):
+        self.commits += 1
+
+    def statements(self, fragment):
+        return [params for statement, params in self.executed if fragment in statement]
+
+
+class StubLineItemNames:
+    def lookup(self, names):
+        return [len(name) for name in names]
+
+
+def test_only_finite_numbers_become_line_items():
+    column = pd.Series({'Total Revenue': 900.0, 'Net Income': np.nan, 'Ratio': np.inf, 'Note': 'n/a',
+                        'Flag': True, 'Shares': 3})
+
+    assert finite_line_items(column) == (['Total Revenue', 'Shares'], [900.0, 3.0])
+    assert finite_line_items(pd.Series({'Flag': True})) == ([], [])
+    assert finite_line_items(pd.Series({'A': 1.0, 'B': -np.inf})) == (['A'], [1.0])
+
+
+def test_write_replaces_the_items_of_one_column():
+    conn = ScriptedConnection()
+
+    written = write_line_items(conn, 7, '2026-03-31', 'income_statement',
+                               pd.Series({'Total Revenue': 900.0, 'EBIT': np.nan, 'Basic EPS': 4.25}),
+                               '2026-10-18', StubLineItemNames())
+
+    assert written == 2
+    # Items no longer reported (EBIT became NaN) are deleted, the rest upserted
+    assert conn.statements('DELETE FROM FinancialLineItem') == [
+        (7, 'income_statement', '2026-03-31', ['Total Revenue', 'Basic EPS'])]
+    assert conn.statements('INSERT INTO FinancialLineItem') == [
+        (7, '2026-03-31', 'income_statement', '2026-10-18', [13, 9], [900.0, 4.25])]
+    assert conn.commits == 0
+
+
+def test_write_without_a_shared_dictionary_adds_names_in_the_transaction():
+    conn = ScriptedConnection({'SELECT name, id FROM LineItem': [('Total Revenue', 1), ('Basic EPS', 2)]})
+
+    write_line_items(conn, 7, '2026-03-31', 'income_statement', {'Total Revenue': 900.0, 'Basic EPS': 4.25}, None)
+
+    # Names are added in sorted order, so concurrent writers lock them in the same order
+    assert conn.statements('INSERT INTO LineItem') == [(['Basic EPS', 'Total Revenue'],)]
+    assert conn.statements('INSERT INTO FinancialLineItem')[0][4:] == ([1, 2], [900.0, 4.25])
+
+
+def test_an_empty_column_only_deletes():
+    conn = ScriptedConnection()
+
+    assert write_line_items(conn, 7, '2026-03-31', 'cash_flow', pd.Series(dtype=float), None, StubLineItemNames()) == 0
+
+    assert conn.statements('DELETE FROM FinancialLineItem') == [(7, 'cash_flow', '2026-03-31', [])]
+    assert conn.statements('INSERT') == []
+
+
+def test_migration_backfills_in_batches_and_records_itself():
+    conn = ScriptedConnection({'SELECT DISTINCT stock_id FROM Financials': [(1,), (2,), (5,)]}, rowcount=10)
+
+    assert migrate_financials(conn, batch_size=2) == 20
+
+    assert conn.statements('INSERT INTO LineItem') == [([1, 2],), ([5],)]
+    assert conn.statements('INSERT INTO FinancialLineItem') == [([1, 2],), ([5],)]
+    assert conn.statements('INSERT INTO SchemaMigration') == [(MIGRATION_NAME,)]
+    # One commit per batch, then the migration record
+    assert conn.commits == 3
+
+
+def test_migration_runs_once():
+    conn = ScriptedConnection({'FROM SchemaMigration': [(1,)]})
+
+    assert migrate_financials(conn) == 0
+
+    assert conn.statements('INSERT') == [] and conn.commits == 0
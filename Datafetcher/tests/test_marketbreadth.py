@@ -0,0 +1,62 @@
+import os
+from datetime import date
+
+import numpy as np
+
+for name in ('DB_NAME', 'DB_USER', 'DB_PASSWORD'):
+    os.environ.setdefault(name, 'test')  # dbutil reads these at import time
+
+import marketbreadth
+from marketbreadth import BREADTH_COLUMNS, breadth_rows, compute_breadth, fill_gaps
+
+nan = np.nan
+# Three stocks over four sessions: the second skips a session, the third lists on the second day
+CLOSES = np.array([
+    [10.0, 20.0, nan],
+    [11.0, 19.0, 5.0],
+    [11.0, nan, 6.0],
+    [12.0, 18.0, 4.0],
+])
+DATES = [date(2026, 10, 12), date(2026, 10, 13), date(2026, 10, 14), date(2026, 10, 15)]
+
+
+def test_gaps_carry_the_last_close_for_a_few_sessions():
+    closes = np.array([[1.0], [nan], [nan], [nan], [5.0]])
+
+    np.testing.assert_array_equal(fill_gaps(closes, limit=2), [[1.0], [1.0], [1.0], [nan], [5.0]])
+
+
+def test_advances_and_declines_count_against_the_previous_close():
+    breadth = compute_breadth(CLOSES)
+
+    assert breadth['stocks'].tolist() == [2, 3, 2, 3]
+    # The first session has nothing to compare with; the listing day of the third stock neither
+    assert breadth['advances'].tolist() == [0, 1, 1, 1]
+    assert breadth['declines'].tolist() == [0, 1, 0, 2]
+    assert breadth['unchanged'].tolist() == [0, 0, 1, 0]
+    # 18 after the skipped session is a decline from the carried 19, and a new low under 20 and 19
+    assert breadth['new_highs_52w'].tolist() == [0, 1, 1, 1]
+    assert breadth['new_lows_52w'].tolist() == [0, 1, 0, 2]
+
+
+def test_moving_average_shares_count_only_stocks_with_a_full_window(monkeypatch):
+    monkeypatch.setattr(marketbreadth, 'BREADTH_MA_WINDOWS', [2])
+
+    breadth = compute_breadth(CLOSES)
+
+    # Two-session averages of the gap-filled closes; only stocks that traded that day are counted
+    assert breadth['with_sma_2'].tolist() == [0, 2, 2, 3]
+    assert breadth['above_sma_2'].tolist() == [0, 1, 1, 1]
+    np.testing.assert_allclose(breadth['pct_above_sma_2'], [nan, 50.0, 50.0, 100.0 / 3])
+
+
+def test_rows_start_at_the_first_date_and_leave_empty_shares_null():
+    rows = breadth_rows(DATES, compute_breadth(CLOSES), DATES[2])
+
+    assert [row[0] for row in rows] == DATES[2:]
+    values = dict(zip(BREADTH_COLUMNS, rows[-1][1:]))
+    assert values['advances'] == 1 and values['declines'] == 2
+    # Four sessions never fill a 50-session window
+    assert values['with_sma_50'] == 0 and values['pct_above_sma_50'] is None
+    assert all(isinstance(values[column], int) for column in BREADTH_COLUMNS if not column.startswith('pct_'))
+
@@ -0,0 +1,117 @@
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from pricecache import PRICE_COLUMNS, PriceCache
+
+
+def history(days, close):
+    index = pd.DatetimeIndex(days).tz_localize('Asia/Kolkata')
+    values = np.asarray(close, dtype=np.float64)
+    return pd.DataFrame({'Open': values, 'High': values + 1, 'Low': values - 1, 'Close': values,
+                         'Volume': values * 100, 'Dividends': 0.0, 'Stock Splits': 0.0}, index=index)
+
+
+def dates(cache, ticker):
+    return [str(day) for day in cache.load(ticker)['date']]
+
+
+# Stand-in for the two queries backfill runs: the per-ticker span of StockData, then the rows of the
+# stale tickers through a named cursor
+class BackfillConnection:
+    def __init__(self, stored):
+        self.stored = stored
+        self.requested = None
+
+    def cursor(self, name=None):
+        connection = self
+
+        class Cursor:
+            itersize = None
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, statement, params=None):
+                if params:
+                    connection.requested = params[0]
+
+            def fetchall(self):
+                return [(ticker, len(rows), rows[0][0], rows[-1][0]) for ticker, rows in connection.stored.items()]
+
+            def __iter__(self):
+                for ticker in sorted(connection.requested):
+                    for row in connection.stored[ticker]:
+                        yield (ticker,) + row
+
+        return Cursor()
+
+
+def test_append_replaces_the_overlapping_sessions(tmp_path):
+    cache = PriceCache(str(tmp_path))
+    cache.append('AAA', history(['2026-10-12', '2026-10-13', '2026-10-14'], [1, 2, 3]))
+
+    # A re-fetch of the last sessions, with a late correction and a repeated day
+    cache.append('AAA', history(['2026-10-14', '2026-10-15', '2026-10-15'], [30, 4, 40]))
+
+    assert dates(cache, 'AAA') == ['2026-10-12', '2026-10-13', '2026-10-14', '2026-10-15']
+    assert cache.load('AAA')['close'].tolist() == [1, 2, 30, 40]
+    assert cache.span('AAA') == (4, date(2026, 10, 12), date(2026, 10, 15))
+
+
+def test_torn_append_is_cut_back_to_the_complete_rows(tmp_path):
+    cache = PriceCache(str(tmp_path))
+    cache.append('AAA', history(['2026-10-12', '2026-10-13'], [1, 2]))
+    # A crash mid-append: the first columns got a third row, the others did not
+    for column in ['date', 'open', 'high']:
+        with open(os.path.join(str(tmp_path), 'AAA', f"{column}.bin"), 'ab') as f:
+            f.write(np.zeros(1, dtype=PRICE_COLUMNS[column]).tobytes())
+
+    assert cache.span('AAA') == (2, date(2026, 10, 12), date(2026, 10, 13))
+    assert all(len(array) == 2 for array in cache.load('AAA').values())
+
+    cache.append('AAA', history(['2026-10-14'], [3]))
+
+    assert cache.load('AAA')['close'].tolist() == [1, 2, 3]
+    for column, dtype in PRICE_COLUMNS.items():
+        assert os.path.getsize(os.path.join(str(tmp_path), 'AAA', f"{column}.bin")) == 3 * dtype.itemsize
+
+
+def test_range_loads_are_read_only_views(tmp_path):
+    cache = PriceCache(str(tmp_path))
+    cache.append('AAA', history(['2026-10-12', '2026-10-13', '2026-10-14', '2026-10-15'], [1, 2, 3, 4]))
+    cache.append('BBB', history(['2026-10-15'], [7]))
+
+    window = cache.load('AAA', start='2026-10-13', end=date(2026, 10, 14), columns=['date', 'close'])
+
+    assert list(window) == ['date', 'close']
+    assert window['close'].tolist() == [2, 3]
+    assert window['date'].dtype == np.dtype('datetime64[D]')
+    # Sliced straight out of the memory map: no copy, and nothing can write through it
+    assert isinstance(window['close'], np.memmap)
+    assert not window['close'].flags.writeable
+    assert sorted(cache.load_many(['AAA', 'BBB', 'CCC'], start='2026-10-15')) == ['AAA', 'BBB']
+    assert cache.tickers() == ['AAA', 'BBB']
+
+
+def test_backfill_refills_series_that_differ_from_stockdata(tmp_path):
+    cache = PriceCache(str(tmp_path))
+    stored = {ticker: [(date(2026, 10, day), 1.0, 1.0, 1.0, float(day), 100, 0.0, 0.0) for day in (12, 13, 14, 15)]
+              for ticker in ['FULL', 'GAP', 'TAIL', 'NEW']}
+    cache.append('FULL', history(['2026-10-12', '2026-10-13', '2026-10-14', '2026-10-15'], [12, 13, 14, 15]))
+    # Same first session, but a session missing in the middle or at the end
+    cache.append('GAP', history(['2026-10-12', '2026-10-13', '2026-10-15'], [12, 13, 15]))
+    cache.append('TAIL', history(['2026-10-12', '2026-10-13', '2026-10-14'], [12, 13, 14]))
+    conn = BackfillConnection(stored)
+
+    assert cache.backfill(conn) == 3
+
+    assert sorted(conn.requested) == ['GAP', 'NEW', 'TAIL']
+    for ticker in ['GAP', 'NEW', 'TAIL']:
+        assert cache.load(ticker)['close'].tolist() == [12, 13, 14, 15]
+    assert cache.backfill(conn) == 0
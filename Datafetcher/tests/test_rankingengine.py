@@ -0,0 +1,149 @@
+import numpy as np
+import pytest
+
+import rankingengine
+from rankingengine import rank_key, top_positions
+
+fakeredis = pytest.importorskip('fakeredis')
+
+STOCKS = [(1, 'AAA'), (2, 'BBB'), (3, 'CCC'), (4, 'DDD')]
+# largecap, midcap, smallcap and no market cap
+MARKET_CAPS = np.array([3e11, 1e11, 2e10, np.nan])
+
+
+# Stand-in for the two reads update_rankings runs (Stock, then RankValue); writes are recorded
+class RankingConnection:
+    def __init__(self, previous):
+        self.previous = previous
+        self.statements = []
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, statement, params=None):
+                connection.statements.append((statement, params))
+                self.last = statement
+
+            def fetchall(self):
+                if 'FROM Stock' in self.last:
+                    return STOCKS
+                if 'FROM RankValue' in self.last:
+                    return connection.previous
+                return []
+
+        return Cursor()
+
+    def commit(self):
+        pass
+
+
+@pytest.fixture
+def ranking(monkeypatch):
+    written = []
+    monkeypatch.setattr(rankingengine, 'execute_values', lambda cur, sql, rows, **kw: written.append((sql, rows)))
+    # eps for the first three stocks; the fourth is no longer ranked
+    eps = np.array([1.0, 3.0, 0.5, np.nan])
+    monkeypatch.setattr(rankingengine, 'compute_metric_values', lambda conn, stock_ids: ({'eps': eps}, MARKET_CAPS))
+    return written
+
+
+# Last run ranked AAA and BBB at other values and DDD, which has since lost its eps
+PREVIOUS = [('eps', 1, 1.0, 'largecap'), ('eps', 2, 2.0, 'midcap'), ('eps', 4, 9.0, None)]
+# What this run ranks
+CURRENT = [('eps', 1, 1.0, 'largecap'), ('eps', 2, 3.0, 'midcap'), ('eps', 3, 0.5, 'smallcap')]
+
+
+def published(redis_client):
+    return {bucket: redis_client.zrange(rank_key('eps', bucket), 0, -1, withscores=True)
+            for bucket in ['all', 'largecap', 'midcap', 'smallcap', 'microcap']}
+
+
+# Function to publish the lists the way the run that wrote these RankValue rows left them
+def seed(redis_client, rows):
+    tickers = dict(STOCKS)
+    for metric, stock_id, value, bucket in rows:
+        for key_bucket in ('all', bucket):
+            if key_bucket is not None:
+                redis_client.zadd(rank_key(metric, key_bucket), {tickers[stock_id]: value})
+
+
+def test_top_positions_are_largest_first_with_ties_by_stock_id():
+    values = np.array([5.0, 9.0, 9.0, 1.0, 7.0, 9.0])
+    stock_ids = np.array([10, 30, 20, 40, 50, 5])
+
+    assert top_positions(values, stock_ids, 3).tolist() == [5, 2, 1]
+    assert top_positions(values, stock_ids, 4).tolist() == [5, 2, 1, 4]
+    # Asking for the whole list (or more) sorts all of it
+    assert top_positions(values, stock_ids, 10).tolist() == [5, 2, 1, 4, 0, 3]
+    assert top_positions(values, stock_ids, 0).tolist() == []
+
+
+def test_top_positions_match_a_full_sort():
+    rng = np.random.default_rng(3)
+    values = rng.integers(0, 20, 500).astype(np.float64)
+    stock_ids = rng.permutation(500)
+
+    expected = sorted(range(500), key=lambda position: (-values[position], stock_ids[position]))
+    assert top_positions(values, stock_ids, 25).tolist() == expected[:25]
+
+
+def test_only_changed_stocks_are_written(ranking):
+    redis_client = fakeredis.FakeStrictRedis(decode_responses=True)
+    seed(redis_client, PREVIOUS)
+    conn = RankingConnection(PREVIOUS)
+
+    # BBB moved, CCC is new and DDD is gone; AAA is unchanged
+    assert rankingengine.update_rankings(conn, redis_client, n=2) == 3
+
+    upserts = [rows for sql, rows in ranking if 'INTO RankValue' in sql]
+    assert [row[:4] for rows in upserts for row in rows] == [('eps', 2, 3.0, 'midcap'), ('eps', 3, 0.5, 'smallcap')]
+    assert any('DELETE FROM RankValue' in sql and params == ('eps', [4]) for sql, params in conn.statements)
+    assert published(redis_client) == {
+        'all': [('CCC', 0.5), ('AAA', 1.0), ('BBB', 3.0)],
+        'largecap': [('AAA', 1.0)],
+        'midcap': [('BBB', 3.0)],
+        'smallcap': [('CCC', 0.5)],
+        'microcap': [],
+    }
+    # Only the lists a change touched are re-ranked: largecap held no change
+    ranks = {(rows[0][1], rows[0][2]): [row[4] for row in rows] for sql, rows in ranking if 'INTO MetricRank' in sql}
+    assert ranks == {('all', 'top'): [2, 1], ('all', 'last'): [3, 1],
+                     ('midcap', 'top'): [2], ('midcap', 'last'): [2],
+                     ('smallcap', 'top'): [3], ('smallcap', 'last'): [3]}
+
+
+def test_unchanged_values_write_nothing(ranking):
+    redis_client = fakeredis.FakeStrictRedis(decode_responses=True)
+    seed(redis_client, CURRENT)
+
+    assert rankingengine.update_rankings(RankingConnection(CURRENT), redis_client, n=2) == 0
+
+    assert ranking == []
+
+
+def test_a_lost_bucket_list_is_republished(ranking):
+    redis_client = fakeredis.FakeStrictRedis(decode_responses=True)
+    seed(redis_client, CURRENT)
+    # The 'all' list survived but the midcap one was evicted
+    redis_client.delete(rank_key('eps', 'midcap'))
+
+    assert rankingengine.update_rankings(RankingConnection(CURRENT), redis_client, n=2) == 0
+
+    assert published(redis_client) == {
+        'all': [('CCC', 0.5), ('AAA', 1.0), ('BBB', 3.0)],
+        'largecap': [('AAA', 1.0)],
+        'midcap': [('BBB', 3.0)],
+        'smallcap': [('CCC', 0.5)],
+        'microcap': [],
+    }
+    # Nothing changed in RankValue, but every list of the metric is re-ranked
+    assert not any('INTO RankValue' in sql for sql, rows in ranking)
+    ranks = {(rows[0][1], rows[0][2]) for sql, rows in ranking if 'INTO MetricRank' in sql}
+    assert {bucket for bucket, _ in ranks} == {'all', 'largecap', 'midcap', 'smallcap'}
@@ -0,0 +1,23 @@
+import pytest
+
+from runmetrics import percentile, summarize_samples
+
+
+@pytest.mark.parametrize('fraction, expected', [
+    (0.01, 1), (0.05, 5), (0.07, 7), (0.50, 50), (0.95, 95), (0.99, 99), (1.0, 100), (0.0, 1),
+])
+def test_nearest_rank_on_1_to_100(fraction, expected):
+    assert percentile(list(range(1, 101)), fraction) == expected
+
+
+def test_p95_of_20_samples_is_the_19th():
+    ordered = [float(value) for value in range(1, 21)]
+    assert percentile(ordered, 0.95) == ordered[18]
+    assert percentile(ordered, 0.50) == ordered[9]
+
+
+def test_small_and_empty_samples():
+    assert percentile([], 0.95) == 0.0
+    assert percentile([3.0], 0.05) == 3.0
+    assert percentile([1.0, 2.0, 3.0], 0.5) == 2.0
+    assert summarize_samples([0.3, 0.1, 0.2]) == {'count': 3, 'total': pytest.approx(0.6), 'p50': 0.2, 'p95': 0.3, 'max': 0.3}
@@ -0,0 +1,72 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from sanitize import dumps_finite, finite_array, mask_non_finite, sum_finite
+
+inf, nan = float('inf'), float('nan')
+
+
+def test_non_finite_values_become_null_but_strings_are_kept():
+    document = {'NaN': nan, 'label': 'NaN', 'note': 'Infinity and -Infinity', 'value': -inf}
+
+    assert json.loads(dumps_finite(document)) == {'NaN': None, 'label': 'NaN', 'note': 'Infinity and -Infinity',
+                                                  'value': None}
+
+
+def test_strings_with_escaped_quotes_are_kept():
+    # Escaped quotes (and a trailing backslash) would shift a naive split on '"'
+    document = {'note': 'say "NaN" -Infinity', 'path': 'C:\\', 'quoted': '\\"NaN', 'x': inf, 'y': [nan, 'NaN"']}
+
+    assert json.loads(dumps_finite(document)) == {'note': 'say "NaN" -Infinity', 'path': 'C:\\',
+                                                  'quoted': '\\"NaN', 'x': None, 'y': [None, 'NaN"']}
+
+
+def test_nested_and_numpy_values_are_cleaned():
+    document = {'a': [1.0, {'b': -inf, 'c': [inf, nan, 2]}], 't': (inf,),
+                'n': np.float64('nan'), 'array': np.array([1.0, -np.inf]), 'i': np.int64(3)}
+
+    assert json.loads(dumps_finite(document)) == {'a': [1.0, {'b': None, 'c': [None, None, 2]}], 't': [None],
+                                                  'n': None, 'array': [1.0, None], 'i': 3}
+
+
+def test_finite_documents_are_encoded_unchanged():
+    document = {'a': [1.5, 'text'], 'b': {'c': None}}
+
+    assert dumps_finite(document) == json.dumps(document)
+
+
+def test_numeric_columns_keep_their_dtype():
+    floats = mask_non_finite(pd.Series([1.0, nan, inf, -inf], dtype='float32'))
+    assert floats.dtype == np.float32
+    assert floats.isna().tolist() == [False, True, True, True]
+
+    assert mask_non_finite(pd.Series([1, 2])).tolist() == [1, 2]
+    nullable = mask_non_finite(pd.Series([1.0, None, inf], dtype='Float64'))
+    assert nullable.dtype == 'Float64' and nullable.isna().tolist() == [False, True, True]
+
+
+def test_object_columns_get_none():
+    frame = mask_non_finite(pd.DataFrame({'numbers': [1.0, inf, nan], 'mixed': ['x', -inf, None]}))
+
+    assert frame['numbers'].isna().tolist() == [False, True, True]
+    assert frame['mixed'].tolist() == ['x', None, None]
+    # Written as null by to_json
+    assert json.loads(frame.to_json(orient='records'))[1] == {'numbers': None, 'mixed': None}
+
+
+def test_arrays_come_back_as_float64_with_nan():
+    masked = mask_non_finite(np.array([1, 2]))
+    assert masked.dtype == np.float64
+    np.testing.assert_array_equal(mask_non_finite([1.0, inf, -inf, nan]), [1.0, nan, nan, nan])
+
+
+def test_sums_count_only_finite_numbers():
+    assert sum_finite([1.0, None, nan, inf, -inf, 2]) == 3.0
+    assert sum_finite(np.array([1, 2, 3])) == 6.0
+    assert sum_finite(value for value in [1.0, nan]) == 1.0
+    # Numeric strings and booleans are not numbers, with or without other text in the list
+    assert sum_finite(['1.5', 2.0]) == sum_finite(['1.5', 'n/a', 2.0]) == 2.0
+    assert sum_finite([True, 2.0]) == sum_finite([True, 'n/a', 2.0]) == 2.0
+    assert np.isnan(finite_array([np.bool_(True)])).all()
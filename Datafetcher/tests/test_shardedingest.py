@@ -0,0 +1,72 @@
+import multiprocessing
+import textwrap
+
+import shardedingest
+
+# Stand-in for datafetcher in the shard process: reports the settings main was called with, without touching Yahoo, Postgres or Redis
+STUB_DATAFETCHER = textwrap.dedent("""
+    import fetchpipeline
+
+
+    class Metrics:
+        def snapshot(self):
+            return {}
+
+
+    metrics = Metrics()
+
+
+    def get_redis_client():
+        return None
+
+
+    def main(tickers, scheduler=None, prepare=True, write_report=True, rate_per_host=None, claim_batch=None):
+        limiter = fetchpipeline.HostRateLimiter(rate=rate_per_host)
+        scheduler.events.put(('settings', scheduler.shard, None, {
+            'tickers': tickers,
+            'limiter_rate': limiter.rate,
+            'claim_batch': claim_batch,
+        }))
+""")
+
+
+def shard_settings_for(shards, tickers):
+    return shardedingest.shard_settings(shards, tickers, rate=4.0, claim_batch=50)
+
+
+def test_shard_settings_divide_rate_and_bound_claims():
+    assert shard_settings_for(4, 100) == {'rate_per_host': 1.0, 'claim_batch': 6}
+    assert shard_settings_for(1, 10000) == {'rate_per_host': 4.0, 'claim_batch': 50}
+    assert shard_settings_for(8, 3)['claim_batch'] == 1
+
+
+def test_connection_budget_warns_past_the_server_limit(capsys):
+    assert shardedingest.connection_budget(4, 3, 97) == 12
+    assert capsys.readouterr().out == ''
+
+    assert shardedingest.connection_budget(40, 3, 97) == 120
+    assert 'up to 120 Postgres connections but only 97' in capsys.readouterr().out
+
+
+def test_spawned_shard_uses_its_settings(tmp_path, monkeypatch):
+    (tmp_path / 'datafetcher.py').write_text(STUB_DATAFETCHER)
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    settings = shard_settings_for(4, 100)
+    context = multiprocessing.get_context('spawn')
+    events = context.Queue()
+    process = context.Process(target=shardedingest.run_shard, args=(2, ['A', 'B'], events, settings))
+    process.start()
+    reported = {}
+    for _ in range(2):
+        kind, shard, _, detail = events.get(timeout=60)
+        reported[kind] = (shard, detail)
+    process.join(timeout=60)
+
+    assert process.exitcode == 0
+    assert reported['finished'] == (2, {'error': None, 'metrics': {}})
+    shard, used = reported['settings']
+    assert shard == 2
+    assert used['tickers'] == ['A', 'B']
+    assert used['limiter_rate'] == 1.0
+    assert used['claim_batch'] == 6
@@ -0,0 +1,125 @@
+import json
+import math
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+for name in ('DB_NAME', 'DB_USER', 'DB_PASSWORD'):
+    os.environ.setdefault(name, 'test')  # dailydatacruncher reads these at import time
+
+import dailydatacruncher
+import summarysql
+import yfinancedatafetcher
+
+INCOME = {
+    '2024-03-31': {'Net Income': 120.5, 'Total Revenue': 900.0, 'Basic EPS': 4.25, 'Gross Profit': 300.0},
+    # NaN is written as null by to_json; EPS is missing altogether
+    '2023-03-31': {'Net Income': np.nan, 'Total Revenue': 800.0, 'Gross Profit': 250.0},
+}
+BALANCE = {
+    '2024-03-31': {'Total Debt': 410.0, 'Total Assets': 2000.0},
+    '2023-03-31': {'Total Debt': np.nan, 'Total Assets': 1800.0},
+}
+
+
+# Function to load two stocks of statements and fundamentals into an in-memory SQLite file, with the
+# typed line items the Postgres dialect reads mirrored next to them
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    yfinancedatafetcher.create_db_schema(conn)
+    with conn:
+        for ticker in ['AAA', 'BBB']:
+            stock_id = yfinancedatafetcher.insert_stock(conn, ticker)
+            yfinancedatafetcher.insert_statements(conn, stock_id, [
+                ('income_statement', pd.DataFrame(INCOME)),
+                ('balance_sheet', pd.DataFrame(BALANCE)),
+                ('cash_flow', pd.DataFrame({'2024-03-31': {'Free Cash Flow': 50.0}})),
+            ])
+        # Stray non-numeric values, as some statements carry them
+        conn.execute("""
+            INSERT INTO Financials (stock_id, date, statement_type, data, updated_at)
+            VALUES (2, '2022-03-31', 'income_statement', ?, '2024-01-01 00:00:00')
+        """, (json.dumps({'Net Income': 'n/a', 'Total Revenue': 75.0, 'Basic EPS': '1.5'}),))
+        for stock_id, day, market_cap in [(1, '2024-01-01', 5000), (2, '2024-01-01', 7000), (2, '2024-02-01', None)]:
+            conn.execute("INSERT INTO Fundamentals (stock_id, date, market_cap, updated_at) VALUES (?, ?, ?, ?)",
+                         (stock_id, day, market_cap, '2024-01-01 00:00:00'))
+
+        conn.execute("CREATE TABLE LineItem (id INTEGER PRIMARY KEY, name TEXT UNIQUE)")
+        conn.execute("""
+            CREATE TABLE FinancialLineItem (
+                stock_id INTEGER, period_end TEXT, statement_type TEXT, line_item_id INTEGER, value REAL
+            )
+        """)
+        rows = conn.execute("SELECT stock_id, date, statement_type, data FROM Financials").fetchall()
+        for stock_id, period_end, statement_type, data in rows:
+            for name, value in json.loads(data).items():
+                # Only finite numbers become line items (see lineitems.write_line_items)
+                if isinstance(value, (int, float)) and math.isfinite(value):
+                    conn.execute("INSERT OR IGNORE INTO LineItem (name) VALUES (?)", (name,))
+                    conn.execute("""
+                        INSERT INTO FinancialLineItem (stock_id, period_end, statement_type, line_item_id, value)
+                        SELECT ?, ?, ?, id, ? FROM LineItem WHERE name = ?
+                    """, (stock_id, period_end, statement_type, value, name))
+    yield conn
+    conn.close()
+
+
+# Function to run the cruncher's Python aggregation over the same rows
+def python_totals(conn):
+    financial_data = [(stock_id, day, statement_type, json.loads(data)) for stock_id, day, statement_type, data in
+                      conn.execute("SELECT stock_id, date, statement_type, data FROM Financials")]
+    fundamentals_data = conn.execute("SELECT stock_id, date, market_cap, trailing_pe, price_to_book FROM Fundamentals").fetchall()
+    return dailydatacruncher.aggregate_metrics(financial_data, fundamentals_data)
+
+
+def assert_totals_match(actual, expected):
+    assert set(actual) == set(summarysql.METRICS)
+    for metric in summarysql.METRICS:
+        assert actual[metric] == pytest.approx(expected[metric]), metric
+
+
+@pytest.mark.parametrize('dialect', ['sqlite', 'postgres'])
+def test_sql_aggregation_matches_the_python_path(conn, dialect):
+    totals = summarysql.aggregate_metrics_sql(conn, dialect)
+
+    assert_totals_match(totals, python_totals(conn))
+    # Nulls, missing keys and strings count as nothing; the second stock's latest snapshot has no market cap
+    assert totals['market_cap'] == pytest.approx(5000)
+    assert totals['profit'] == pytest.approx(2 * 120.5)
+    assert totals['revenue'] == pytest.approx(2 * (900.0 + 800.0) + 75.0)
+    assert totals['eps'] == pytest.approx(2 * 4.25)
+    assert totals['debt'] == pytest.approx(2 * 410.0)
+
+
+@pytest.mark.parametrize('dialect', ['sqlite', 'postgres'])
+def test_market_cap_counts_the_latest_snapshot_of_each_stock(conn, dialect):
+    before = summarysql.aggregate_metrics_sql(conn, dialect)['market_cap']
+    # A later snapshot at the same market cap, then a day where it moved
+    conn.execute("INSERT INTO Fundamentals (stock_id, date, market_cap, updated_at) VALUES (1, '2024-03-01', 5000, '2024-03-01 00:00:00')")
+
+    assert summarysql.aggregate_metrics_sql(conn, dialect)['market_cap'] == pytest.approx(before)
+    assert python_totals(conn)['market_cap'] == pytest.approx(before)
+
+    conn.execute("INSERT INTO Fundamentals (stock_id, date, market_cap, updated_at) VALUES (1, '2024-03-02', 6000, '2024-03-02 00:00:00')")
+
+    assert summarysql.aggregate_metrics_sql(conn, dialect)['market_cap'] == pytest.approx(before + 1000)
+    assert python_totals(conn)['market_cap'] == pytest.approx(before + 1000)
+
+
+def test_line_item_metric_sums_read_one_line_item_each(conn):
+    sums = ', '.join(summarysql.line_item_metric_sums())
+    row = conn.execute(f"SELECT {sums} FROM {summarysql.line_item_metric_source()}").fetchone()
+
+    expected = python_totals(conn)
+    assert list(row) == pytest.approx([expected[metric] for metric, _, _ in summarysql.FINANCIAL_METRICS])
+
+
+def test_empty_tables_sum_to_zero():
+    conn = sqlite3.connect(':memory:')
+    yfinancedatafetcher.create_db_schema(conn)
+
+    assert summarysql.aggregate_metrics_sql(conn, 'sqlite') == dict.fromkeys(summarysql.METRICS, 0)
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+import symboluniverse
+from symboluniverse import SIDECAR_SUFFIX, load_symbols
+
+openpyxl = pytest.importorskip('openpyxl')
+
+
+# Function to write a one-sheet workbook with a header row and one row per entry of rows
+def write_sheet(path, header, rows):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def sidecars(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(SIDECAR_SUFFIX))
+
+
+def test_sheet_is_parsed_once_then_read_from_the_sidecar(tmp_path, monkeypatch):
+    sheet = str(tmp_path / 'mcap.xlsx')
+    write_sheet(sheet, ['Rank', 'Symbol'], [[1, 'RELIANCE'], [2, ' TCS '], [3, None], [4, 'INFY']])
+
+    assert load_symbols(sheet, 'Symbol', '') == ['RELIANCE', 'TCS', 'INFY']
+    assert len(sidecars(tmp_path)) == 1
+
+    def parse(path, column):
+        raise AssertionError('the sheet was parsed again')
+
+    monkeypatch.setattr(symboluniverse, 'read_sheet_column', parse)
+    assert load_symbols(sheet, 'Symbol', '') == ['RELIANCE', 'TCS', 'INFY']
+
+
+def test_edited_sheet_replaces_the_sidecar(tmp_path):
+    sheet = str(tmp_path / 'mcap.xlsx')
+    write_sheet(sheet, ['Symbol'], [['RELIANCE'], ['TCS']])
+    load_symbols(sheet, 'Symbol', '')
+    stale = sidecars(tmp_path)
+
+    write_sheet(sheet, ['Symbol'], [['HDFCBANK'], ['RELIANCE']])
+
+    assert load_symbols(sheet, 'Symbol', '') == ['HDFCBANK', 'RELIANCE']
+    # The hash changed, so the old list is never read and its sidecar is dropped
+    assert len(sidecars(tmp_path)) == 1 and sidecars(tmp_path) != stale
+
+
+def test_each_column_has_its_own_sidecar(tmp_path):
+    sheet = str(tmp_path / 'mcap.xlsx')
+    cache = tmp_path / 'cache'
+    write_sheet(sheet, ['Symbol', 'Series'], [['RELIANCE', 'EQ'], ['TCS', 'BE']])
+
+    assert load_symbols(sheet, 'Symbol', str(cache)) == ['RELIANCE', 'TCS']
+    symbol_sidecar = sidecars(cache)
+
+    # The column is part of the hash: another column never reads the first one's list
+    assert load_symbols(sheet, 'Series', str(cache)) == ['EQ', 'BE']
+    assert sidecars(cache) != symbol_sidecar
+    assert load_symbols(sheet, 'Symbol', str(cache)) == ['RELIANCE', 'TCS']
+    assert sidecars(tmp_path) == []
+
+
+def test_missing_column_is_an_error(tmp_path):
+    sheet = str(tmp_path / 'mcap.xlsx')
+    write_sheet(sheet, ['Symbol'], [['RELIANCE']])
+
+    with pytest.raises(ValueError, match="no 'Ticker' column"):
+        load_symbols(sheet, 'Ticker', '')
@@ -0,0 +1,22 @@
+from datetime import date, datetime
+
+import tradingcalendar
+from tradingcalendar import EXCHANGE_UTC_OFFSET, last_completed_session, missing_range, next_trading_day
+
+
+def test_2026_holidays_are_skipped():
+    # Dussehra (Tuesday 20 October 2026)
+    assert next_trading_day(date(2026, 10, 19)) == date(2026, 10, 21)
+    assert missing_range(date(2026, 10, 16), session=date(2026, 10, 21)) == (date(2026, 10, 19), date(2026, 10, 22))
+    assert last_completed_session(datetime(2026, 10, 20, 17, 0, tzinfo=EXCHANGE_UTC_OFFSET)) == date(2026, 10, 19)
+
+
+def test_past_the_holiday_list_falls_back_to_weekdays_with_one_warning(capsys, monkeypatch):
+    monkeypatch.setattr(tradingcalendar, '_warned_past_holidays', set())
+    holidays = {date(2026, 12, 25)}
+
+    assert tradingcalendar.check_holiday_coverage(date(2026, 6, 1), holidays)
+    assert last_completed_session(datetime(2027, 1, 26, 17, 0, tzinfo=EXCHANGE_UTC_OFFSET), holidays) == date(2027, 1, 26)
+    last_completed_session(datetime(2027, 1, 27, 17, 0, tzinfo=EXCHANGE_UTC_OFFSET), holidays)
+
+    assert capsys.readouterr().out.count('only listed through 2026') == 1
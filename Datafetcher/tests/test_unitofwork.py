@@ -0,0 +1,61 @@
+import pytest
+
+from unitofwork import UnitOfWork
+
+
+def write(uow, ticker, done, failed):
+    with uow.ticker(ticker):
+        uow.count('StockData', 10)
+    uow.after_commit(lambda: done.append(ticker))
+    uow.after_rollback(lambda error: failed.append((ticker, str(error))))
+
+
+def test_commit_runs_commit_callbacks_only(fake_conn):
+    uow = UnitOfWork(fake_conn, batch_size=10)
+    done, failed = [], []
+    write(uow, 'AAA', done, failed)
+    write(uow, 'BB', done, failed)
+
+    uow.commit()
+    uow.rollback()
+
+    assert done == ['AAA', 'BB'] and failed == []
+    assert uow.counter.rows == {'StockData': 20} and uow.counter.tickers == 2
+
+
+def test_failed_commit_fails_exactly_the_batch(fake_conn):
+    uow = UnitOfWork(fake_conn, batch_size=10)
+    done, failed = [], []
+    write(uow, 'AAA', done, failed)
+    uow.commit()
+    write(uow, 'BB', done, failed)
+    write(uow, 'CCCC', done, failed)
+    fake_conn.fail_commit = RuntimeError('connection lost')
+
+    with pytest.raises(RuntimeError):
+        uow.commit()
+
+    assert done == ['AAA']
+    assert failed == [('BB', 'connection lost'), ('CCCC', 'connection lost')]
+    assert uow.counter.failed == 2
+    # The next batch starts clean
+    write(uow, 'DD', done, failed)
+    uow.commit()
+    assert done == ['AAA', 'DD'] and len(failed) == 2
+
+
+def test_failed_before_commit_hook_rolls_back(fake_conn):
+    uow = UnitOfWork(fake_conn, batch_size=10)
+    done, failed = [], []
+
+    def flush():
+        raise ValueError('bad row')
+
+    uow.before_commit(flush)
+    write(uow, 'AAA', done, failed)
+
+    with pytest.raises(ValueError):
+        uow.commit()
+
+    assert fake_conn.commits == 0 and fake_conn.rollbacks == 1
+    assert done == [] and failed == [('AAA', 'bad row')]
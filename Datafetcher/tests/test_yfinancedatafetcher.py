@@ -0,0 +1,107 @@
+import sqlite3
+from datetime import date
+
+import pytest
+
+import yfinancedatafetcher
+from yfinancedatafetcher import MIGRATIONS, create_db_schema, insert_fundamentals, insert_stock
+
+
+# Function to create the tables as the unversioned script left them: StockData with adj_close, no
+# Stock.loaded_at, str(datetime) dates and one stock.info copy per trading day
+def legacy_database():
+    conn = sqlite3.connect(':memory:')
+    conn.executescript("""
+        CREATE TABLE Stock (id INTEGER PRIMARY KEY AUTOINCREMENT, ticker TEXT UNIQUE NOT NULL,
+                            created_at TIMESTAMP, updated_at TIMESTAMP);
+        CREATE TABLE StockData (id INTEGER PRIMARY KEY AUTOINCREMENT, stock_id INTEGER, date DATE,
+                                open REAL, high REAL, low REAL, close REAL, adj_close REAL, volume INTEGER,
+                                created_at TIMESTAMP, updated_at TIMESTAMP, UNIQUE(stock_id, date));
+        CREATE TABLE Fundamentals (id INTEGER PRIMARY KEY AUTOINCREMENT, stock_id INTEGER, date DATE,
+                                   market_cap INTEGER, enterprise_value INTEGER, trailing_pe REAL, forward_pe REAL,
+                                   peg_ratio REAL, price_to_book REAL, dividend_yield REAL,
+                                   created_at TIMESTAMP, updated_at TIMESTAMP, UNIQUE(stock_id, date));
+        INSERT INTO Stock (ticker) VALUES ('AAA');
+        INSERT INTO StockData (stock_id, date, close) VALUES
+            (1, '2024-03-27 00:00:00+05:30', 10.0),
+            (1, '2024-03-28 00:00:00+05:30', 11.0),
+            (1, '2024-03-28', 11.5);
+        INSERT INTO Fundamentals (stock_id, date, market_cap, trailing_pe) VALUES
+            (1, '2024-03-26 00:00:00+05:30', 100, 20.0),
+            (1, '2024-03-27 00:00:00+05:30', 100, 20.0),
+            (1, '2024-03-28 00:00:00+05:30', 120, 20.0),
+            (1, '2024-03-29 00:00:00+05:30', 120, 20.0),
+            (1, '2024-04-01 00:00:00+05:30', 100, 20.0);
+    """)
+    return conn
+
+
+def columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def test_legacy_database_is_upgraded_in_place():
+    conn = legacy_database()
+
+    create_db_schema(conn)
+
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    assert {'dividends', 'stock_splits'} <= columns(conn, 'StockData')
+    assert 'loaded_at' in columns(conn, 'Stock')
+    # The same session under both date formats collapses into one row
+    assert conn.execute("SELECT date FROM StockData ORDER BY date").fetchall() == [('2024-03-27',), ('2024-03-28',)]
+    # Daily copies of an unchanged stock.info collapse into the rows where a value changed
+    assert conn.execute("SELECT date, market_cap FROM Fundamentals ORDER BY date").fetchall() == [
+        ('2024-03-26', 100), ('2024-03-28', 120), ('2024-04-01', 100)]
+
+
+def test_an_up_to_date_schema_is_left_alone(capsys):
+    conn = sqlite3.connect(':memory:')
+    create_db_schema(conn)
+    capsys.readouterr()
+
+    create_db_schema(conn)
+
+    assert capsys.readouterr().out == ''
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+
+
+def test_a_failed_migration_resumes_where_it_stopped(monkeypatch):
+    conn = legacy_database()
+
+    def broken(conn):
+        conn.execute("ALTER TABLE Stock ADD COLUMN loaded_at TIMESTAMP")
+        raise sqlite3.OperationalError('disk I/O error')
+
+    monkeypatch.setattr(yfinancedatafetcher, 'MIGRATIONS', MIGRATIONS[:2] + [broken])
+    with pytest.raises(sqlite3.OperationalError):
+        yfinancedatafetcher.create_db_schema(conn)
+
+    # The first two migrations are committed with their versions; the third left nothing behind
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 2
+    assert 'loaded_at' not in columns(conn, 'Stock')
+
+    monkeypatch.setattr(yfinancedatafetcher, 'MIGRATIONS', MIGRATIONS)
+    yfinancedatafetcher.create_db_schema(conn)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    assert 'loaded_at' in columns(conn, 'Stock')
+
+
+def test_fundamentals_are_written_only_when_they_change():
+    conn = sqlite3.connect(':memory:')
+    create_db_schema(conn)
+    stock_id = insert_stock(conn, 'AAA')
+    info = {'marketCap': 100, 'trailingPE': 20.5}
+
+    assert insert_fundamentals(conn, stock_id, date(2026, 10, 12), info)
+    assert not insert_fundamentals(conn, stock_id, date(2026, 10, 13), dict(info))
+    # Missing keys compare as NULL on both sides
+    assert not insert_fundamentals(conn, stock_id, date(2026, 10, 13), dict(info, pegRatio=None))
+    assert insert_fundamentals(conn, stock_id, date(2026, 10, 14), dict(info, marketCap=120))
+    # A correction on the same day replaces that day's row
+    assert insert_fundamentals(conn, stock_id, date(2026, 10, 14), dict(info, marketCap=125))
+    # An earlier date compares with the snapshot in force then, not with the latest one
+    assert not insert_fundamentals(conn, stock_id, date(2026, 10, 13), info)
+
+    assert conn.execute("SELECT date, market_cap FROM Fundamentals ORDER BY date").fetchall() == [
+        ('2026-10-12', 100), ('2026-10-14', 125)]
@@ -0,0 +1,108 @@
+import os
+from datetime import date, datetime, time, timedelta, timezone
+
+# NSE trading calendar used to turn "last stored date" into the exact range of sessions still missing.
+# Weekends are never sessions; exchange holidays come from NSE_HOLIDAYS below plus, optionally, a file
+# named by NSE_HOLIDAYS_FILE with one YYYY-MM-DD per line ('#' starts a comment). Add each new year's
+# circular to that file; a holiday missing from the calendar only costs one empty range request.
+# Past the last year with any holiday listed, every weekday counts as a session (with a warning).
+NSE_HOLIDAYS_FILE = os.environ.get('NSE_HOLIDAYS_FILE', '')
+
+EXCHANGE_TIMEZONE = 'Asia/Kolkata'
+EXCHANGE_UTC_OFFSET = timezone(timedelta(hours=5, minutes=30))
+# Daily bars are taken as final this long after the 15:30 close
+SESSION_SETTLED = time(16, 0)
+
+NSE_HOLIDAYS = {
+    # 2024
+    date(2024, 1, 22), date(2024, 1, 26), date(2024, 3, 8), date(2024, 3, 25), date(2024, 3, 29),
+    date(2024, 4, 11), date(2024, 4, 17), date(2024, 5, 1), date(2024, 5, 20), date(2024, 6, 17),
+    date(2024, 7, 17), date(2024, 8, 15), date(2024, 10, 2), date(2024, 11, 1), date(2024, 11, 15),
+    date(2024, 11, 20), date(2024, 12, 25),
+    # 2025
+    date(2025, 2, 26), date(2025, 3, 14), date(2025, 3, 31), date(2025, 4, 10), date(2025, 4, 14),
+    date(2025, 4, 18), date(2025, 5, 1), date(2025, 8, 15), date(2025, 8, 27), date(2025, 10, 2),
+    date(2025, 10, 21), date(2025, 10, 22), date(2025, 11, 5), date(2025, 12, 25),
+    # 2026
+    date(2026, 1, 15), date(2026, 1, 26), date(2026, 3, 3), date(2026, 3, 26), date(2026, 3, 31),
+    date(2026, 4, 3), date(2026, 4, 14), date(2026, 5, 1), date(2026, 5, 28), date(2026, 6, 26),
+    date(2026, 9, 14), date(2026, 10, 2), date(2026, 10, 20), date(2026, 11, 10), date(2026, 11, 24),
+    date(2026, 12, 25),
+}
+
+
+# Function to read extra holidays from a file with one ISO date per line
+def load_holidays(path):
+    holidays = set()
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                holidays.add(date.fromisoformat(line))
+    return holidays
+
+
+if NSE_HOLIDAYS_FILE:
+    NSE_HOLIDAYS = NSE_HOLIDAYS | load_holidays(NSE_HOLIDAYS_FILE)
+
+
+# Function to check whether the exchange trades on a day
+def is_trading_day(day, holidays=None):
+    holidays = NSE_HOLIDAYS if holidays is None else holidays
+    return day.weekday() < 5 and day not in holidays
+
+
+# Function to return the first session strictly after a day
+def next_trading_day(day, holidays=None):
+    day += timedelta(days=1)
+    while not is_trading_day(day, holidays):
+        day += timedelta(days=1)
+    return day
+
+
+# Function to return the last session on or before a day
+def previous_trading_day(day, holidays=None):
+    while not is_trading_day(day, holidays):
+        day -= timedelta(days=1)
+    return day
+
+
+_warned_past_holidays = set()
+
+
+# Function to tell whether the holiday list covers a day's year; past its last year the calendar falls
+# back to weekdays only, which is printed once per year. An empty list means weekdays only on purpose.
+def check_holiday_coverage(day, holidays=None):
+    holidays = NSE_HOLIDAYS if holidays is None else holidays
+    last_year = max((holiday.year for holiday in holidays), default=day.year)
+    if day.year <= last_year:
+        return True
+    if day.year not in _warned_past_holidays:
+        _warned_past_holidays.add(day.year)
+        print(f"NSE holidays are only listed through {last_year}; treating every weekday of {day.year} as a "
+              f"session. Add the year's holiday circular to NSE_HOLIDAYS_FILE.")
+    return False
+
+
+# Function to return the latest session whose daily bar is final; today's session only counts once
+# it has settled, so a partial intraday bar is never stored as the day's close
+def last_completed_session(now=None, holidays=None):
+    now = now or datetime.now(EXCHANGE_UTC_OFFSET)
+    today = now.date()
+    check_holiday_coverage(today, holidays)
+    if is_trading_day(today, holidays) and now.time() >= SESSION_SETTLED:
+        return today
+    return previous_trading_day(today - timedelta(days=1), holidays)
+
+
+# Function to work out the history range still missing for a ticker. Returns None when the ticker is
+# up to date (no request needed), (None, end) when nothing is stored yet (full history), otherwise
+# (start, end) with start the first session after last_date. end is exclusive, as in yfinance.
+def missing_range(last_date, session=None, holidays=None):
+    session = session or last_completed_session(holidays=holidays)
+    end = session + timedelta(days=1)
+    if last_date is None:
+        return None, end
+    if last_date >= session:
+        return None
+    return next_trading_day(last_date, holidays), end
@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Tickers grouped into one transaction by a UnitOfWork
+WRITE_BATCH_SIZE = int(os.environ.get('WRITE_BATCH_SIZE', '50'))
+
+
+# Thread-safe counter of committed rows per table, with a rows/sec rate since it was created
+class ThroughputCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.rows = {}
+        self.tickers = 0
+        self.failed = 0
+
+    def add(self, rows, tickers=0, failed=0):
+        with self.lock:
+            for table, count in rows.items():
+                self.rows[table] = self.rows.get(table, 0) + count
+            self.tickers += tickers
+            self.failed += failed
+
+    def total_rows(self):
+        with self.lock:
+            return sum(self.rows.values())
+
+    def rows_per_sec(self):
+        elapsed = time.perf_counter() - self.started
+        return self.total_rows() / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        with self.lock:
+            per_table = ', '.join(f"{table} {count}" for table, count in sorted(self.rows.items()))
+            tickers, failed = self.tickers, self.failed
+        elapsed = time.perf_counter() - self.started
+        return (f"Committed {self.total_rows()} rows ({per_table or 'none'}) for {tickers} tickers, "
+                f"{failed} failed, in {elapsed:.1f}s ({self.rows_per_sec():,.0f} rows/sec)")
+
+
+# Groups the writes of several tickers into one transaction. Each ticker runs inside a savepoint, so a
+# failure rolls back only that ticker's writes; the transaction commits every batch_size tickers.
+# before_commit hooks run inside the transaction (e.g. flushing buffered bulk writes); after_commit
+# callbacks (e.g. Redis checkpoints) only run once the batch is durable and are dropped on rollback.
+# after_rollback callbacks get the error instead when the whole batch is rolled back (e.g. to requeue
+# exactly the tickers whose writes were lost) and are dropped on commit. Callbacks registered for a
+# ticker also follow that ticker when it alone is taken out of the batch (see fail_ticker).
+class UnitOfWork:
+    def __init__(self, conn, batch_size=WRITE_BATCH_SIZE, counter=None):
+        self.conn = conn
+        self.batch_size = max(batch_size, 1)
+        self.counter = counter or ThroughputCounter()
+        self.before_commit_hooks = []
+        self.after_commit_callbacks = []
+        self.after_rollback_callbacks = []
+        self.batch_rows = {}
+        self.ticker_rows = None
+        self.batch_tickers = 0
+
+    def before_commit(self, hook):
+        self.before_commit_hooks.append(hook)
+
+    def after_commit(self, callback, ticker=None):
+        self.after_commit_callbacks.append((ticker, callback))
+
+    def after_rollback(self, callback, ticker=None):
+        self.after_rollback_callbacks.append((ticker, callback))
+
+    # Function to record rows written by the current ticker (or by a before_commit hook)
+    def count(self, table, rows):
+        target = self.ticker_rows if self.ticker_rows is not None else self.batch_rows
+        target[table] = target.get(table, 0) + rows
+
+    # Savepoint around part of the batch: a failure rolls back only that part and is re-raised
+    @contextmanager
+    def savepoint(self, name):
+        with self.conn.cursor() as cur:
+            cur.execute(f"SAVEPOINT {name}")
+        try:
+            yield self.conn
+        except Exception:
+            with self.conn.cursor() as cur:
+                cur.execute(f"ROLLBACK TO SAVEPOINT {name}")
+                cur.execute(f"RELEASE SAVEPOINT {name}")
+            raise
+        with self.conn.cursor() as cur:
+            cur.execute(f"RELEASE SAVEPOINT {name}")
+
+    @contextmanager
+    def ticker(self, ticker):
+        self.ticker_rows = {}
+        try:
+            with self.savepoint('ticker_write') as conn:
+                yield conn
+        except Exception:
+            self.ticker_rows = None
+            self.counter.add({}, failed=1)
+            raise
+        for table, rows in self.ticker_rows.items():
+            self.batch_rows[table] = self.batch_rows.get(table, 0) + rows
+        self.ticker_rows = None
+        self.batch_tickers += 1
+
+    # Function to take one ticker out of the batch after its savepoint was released, when a later write
+    # of its own failed (e.g. its share of a bulk flush): its after_commit callbacks are dropped and its
+    # after_rollback callbacks run now. The rest of the batch carries on.
+    def fail_ticker(self, ticker, error):
+        callbacks = [callback for owner, callback in self.after_rollback_callbacks if owner == ticker]
+        self.after_rollback_callbacks = [(owner, callback) for owner, callback in self.after_rollback_callbacks if owner != ticker]
+        self.after_commit_callbacks = [(owner, callback) for owner, callback in self.after_commit_callbacks if owner != ticker]
+        self.batch_tickers -= 1
+        self.counter.add({}, failed=1)
+        for callback in callbacks:
+            callback(error)
+
+    # Function to commit when the batch is full; call after each ticker
+    def maybe_commit(self):
+        if self.batch_tickers >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        try:
+            for hook in self.before_commit_hooks:
+                hook()
+            self.conn.commit()
+        except Exception as e:
+            print(f"Rolling back batch of {self.batch_tickers} tickers: {e}")
+            self.rollback(e)
+            raise
+        callbacks, self.after_commit_callbacks = self.after_commit_callbacks, []
+        self.after_rollback_callbacks = []
+        self.counter.add(self.batch_rows, tickers=self.batch_tickers)
+        self.batch_rows, self.batch_tickers = {}, 0
+        for _, callback in callbacks:
+            callback()
+
+    def rollback(self, error=None):
+        self.conn.rollback()
+        self.counter.add({}, failed=self.batch_tickers)
+        callbacks, self.after_rollback_callbacks = self.after_rollback_callbacks, []
+        self.after_commit_callbacks = []
+        self.batch_rows, self.batch_tickers = {}, 0
+        for _, callback in callbacks:
+            callback(error)
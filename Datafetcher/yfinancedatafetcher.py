@@ -1,168 +1,350 @@
-import yfinance as yf
+import itertools
+import os
 import sqlite3
+import sys
+import time
+from datetime import date, datetime, timedelta
+
 import pandas as pd
-from datetime import datetime
 
-# Function to create the database and tables
-def create_db_schema(conn):
-    with conn:
-        # Drop existing tables if they exist
-        conn.execute("DROP TABLE IF EXISTS Stock")
-        conn.execute("DROP TABLE IF EXISTS StockData")
-        conn.execute("DROP TABLE IF EXISTS Fundamentals")
-        conn.execute("DROP TABLE IF EXISTS Financials")
-        
-        # Create new tables with the updated schema
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS Stock (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ticker TEXT UNIQUE NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS StockData (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                stock_id INTEGER,
-                date DATE,
-                open REAL,
-                high REAL,
-                low REAL,
-                close REAL,
-                volume INTEGER,
-                dividends REAL,
-                stock_splits REAL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (stock_id) REFERENCES Stock(id),
-                UNIQUE(stock_id, date)
-            )
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS Fundamentals (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                stock_id INTEGER,
-                date DATE,
-                market_cap INTEGER,
-                enterprise_value INTEGER,
-                trailing_pe REAL,
-                forward_pe REAL,
-                peg_ratio REAL,
-                price_to_book REAL,
-                dividend_yield REAL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (stock_id) REFERENCES Stock(id),
-                UNIQUE(stock_id, date)
-            )
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS Financials (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                stock_id INTEGER,
-                date DATE,
-                statement_type TEXT,
-                data BLOB,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (stock_id) REFERENCES Stock(id),
-                UNIQUE(stock_id, date, statement_type)
+from summarysql import aggregate_metrics_sql, build_summary
+
+# Local SQLite variant of datafetcher, for laptops and CI: no Postgres or Redis needed. The schema is
+# versioned with PRAGMA user_version and migrated in place (see MIGRATIONS), so the database survives
+# restarts and a rerun only does what is missing: tickers loaded within SQLITE_REFRESH_HOURS are
+# skipped, and the others fetch history from shortly before their last stored session. Each ticker is
+# written with executemany in a single transaction.
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'stocks.db')
+# In WAL mode NORMAL only syncs at checkpoints: a crash of the process loses nothing, a power cut can
+# lose the last transactions. FULL syncs every commit.
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+# Page cache and memory map sizes, in MiB
+SQLITE_CACHE_MB = int(os.environ.get('SQLITE_CACHE_MB', '64'))
+SQLITE_MMAP_MB = int(os.environ.get('SQLITE_MMAP_MB', '256'))
+# Tickers loaded more recently than this are skipped by main
+SQLITE_REFRESH_HOURS = float(os.environ.get('SQLITE_REFRESH_HOURS', '20'))
+# Calendar days before the last stored session that are fetched again, for Yahoo's late corrections
+SQLITE_HISTORY_OVERLAP_DAYS = int(os.environ.get('SQLITE_HISTORY_OVERLAP_DAYS', '5'))
+
+HISTORY_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+FUNDAMENTAL_FIELDS = [
+    ('market_cap', 'marketCap'),
+    ('enterprise_value', 'enterpriseValue'),
+    ('trailing_pe', 'trailingPE'),
+    ('forward_pe', 'forwardPE'),
+    ('peg_ratio', 'pegRatio'),
+    ('price_to_book', 'priceToBook'),
+    ('dividend_yield', 'dividendYield'),
+]
+
+
+# Function to open the database with the pragmas used for bulk loading
+def connect_db(path=SQLITE_PATH):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_MB * 1024}")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_MB * 1024 * 1024}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+# Function to format a date, datetime or Timestamp the way dates are stored (YYYY-MM-DD, exchange-local)
+def sqlite_date(value):
+    return value.strftime('%Y-%m-%d')
+
+
+# Function to format a history index as stored dates, in the exchange's local calendar; going through
+# numpy days is much faster than DatetimeIndex.strftime on a tz-aware index
+def session_dates(index):
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.values.astype('datetime64[D]').astype(str).tolist()
+
+
+# Function to format the current time the way timestamps are stored
+def sqlite_now():
+    return datetime.now().isoformat(sep=' ')
+
+
+# Function to add the columns a table created by an older version lacks
+def add_missing_columns(conn, table, columns):
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for column, definition in columns:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+# Migration 1: the base tables. IF NOT EXISTS adopts databases created before the schema was versioned.
+def create_base_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS Stock (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticker TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS StockData (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            stock_id INTEGER,
+            date DATE,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume INTEGER,
+            dividends REAL,
+            stock_splits REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (stock_id) REFERENCES Stock(id),
+            UNIQUE(stock_id, date)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS Fundamentals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            stock_id INTEGER,
+            date DATE,
+            market_cap INTEGER,
+            enterprise_value INTEGER,
+            trailing_pe REAL,
+            forward_pe REAL,
+            peg_ratio REAL,
+            price_to_book REAL,
+            dividend_yield REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (stock_id) REFERENCES Stock(id),
+            UNIQUE(stock_id, date)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS Financials (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            stock_id INTEGER,
+            date DATE,
+            statement_type TEXT,
+            data BLOB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (stock_id) REFERENCES Stock(id),
+            UNIQUE(stock_id, date, statement_type)
+        )
+    """)
+    # Early StockData tables had adj_close instead of the dividend and split columns
+    add_missing_columns(conn, 'StockData', [('dividends', 'REAL'), ('stock_splits', 'REAL')])
+
+
+# Migration 2: dates stored as YYYY-MM-DD. Older versions stored whatever str() gave for the datetime
+# passed in ('2024-03-28 00:00:00+05:30'), so the same session could not be matched across runs. They
+# also wrote the current stock.info once per trading day of history; those copies are collapsed into
+# the rows where a value changed.
+def normalize_dates(conn):
+    for table in ['StockData', 'Fundamentals', 'Financials']:
+        conn.execute(f"UPDATE OR REPLACE {table} SET date = substr(date, 1, 10) WHERE length(date) > 10")
+    unchanged = ' AND '.join(f"{column} IS LAG({column}) OVER w" for column, _ in FUNDAMENTAL_FIELDS)
+    conn.execute(f"""
+        DELETE FROM Fundamentals WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER w AS rn, {unchanged} AS unchanged
+                FROM Fundamentals
+                WINDOW w AS (PARTITION BY stock_id ORDER BY date)
             )
-        """)
+            WHERE rn > 1 AND unchanged
+        )
+    """)
+
+
+# Migration 3: when each ticker was last loaded completely, so an interrupted run resumes after it
+def add_loaded_at(conn):
+    add_missing_columns(conn, 'Stock', [('loaded_at', 'TIMESTAMP')])
+
+
+MIGRATIONS = [create_base_tables, normalize_dates, add_loaded_at]
 
-# Function to insert stock information
+
+# Function to bring the schema up to the latest version; each migration commits together with the
+# version it sets, so an interrupted upgrade resumes where it stopped
+def create_db_schema(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with conn:
+            conn.execute("BEGIN")
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+    if version < len(MIGRATIONS):
+        print(f"Migrated the schema from version {version} to {len(MIGRATIONS)}")
+
+
+# Function to insert stock information; returns the stock's id whether or not it already existed.
+# Like the other insert functions it does not commit (see store_ticker_payload).
 def insert_stock(conn, ticker):
-    with conn:
-        cursor = conn.execute("INSERT OR IGNORE INTO Stock (ticker) VALUES (?)", (ticker,))
-        return cursor.lastrowid
+    conn.execute("INSERT OR IGNORE INTO Stock (ticker) VALUES (?)", (ticker,))
+    return conn.execute("SELECT id FROM Stock WHERE ticker = ?", (ticker,)).fetchone()[0]
+
 
-# Function to insert stock data
+# Function to insert stock data; returns the number of rows written
 def insert_stock_data(conn, stock_id, data):
-    with conn:
-        for row in data.itertuples(index=True, name=None):
-            conn.execute("""
-                INSERT INTO StockData (stock_id, date, open, high, low, close, volume, dividends, stock_splits, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(stock_id, date) DO UPDATE SET
-                open=excluded.open, high=excluded.high, low=excluded.low,
-                close=excluded.close, volume=excluded.volume, dividends=excluded.dividends,
-                stock_splits=excluded.stock_splits, updated_at=excluded.updated_at
-            """, (stock_id, row[0].to_pydatetime(), row[1], row[2], row[3], row[4], row[5], row[6], row[7], datetime.now()))
-
-# Function to insert fundamental data
+    if data.empty:
+        return 0
+    frame = data.reindex(columns=HISTORY_COLUMNS)
+    rows = zip(itertools.repeat(stock_id), session_dates(data.index),
+               *(frame[column].tolist() for column in HISTORY_COLUMNS), itertools.repeat(sqlite_now()))
+    conn.executemany("""
+        INSERT INTO StockData (stock_id, date, open, high, low, close, volume, dividends, stock_splits, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(stock_id, date) DO UPDATE SET
+        open=excluded.open, high=excluded.high, low=excluded.low,
+        close=excluded.close, volume=excluded.volume, dividends=excluded.dividends,
+        stock_splits=excluded.stock_splits, updated_at=excluded.updated_at
+    """, rows)
+    return len(data)
+
+
+# Function to insert fundamental data, only when it differs from the snapshot in force on that date;
+# returns True when a row was written
 def insert_fundamentals(conn, stock_id, date, info):
-    with conn:
-        conn.execute("""
-            INSERT INTO Fundamentals (
-                stock_id, date, market_cap, enterprise_value, trailing_pe, forward_pe, peg_ratio, price_to_book, dividend_yield, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(stock_id, date) DO UPDATE SET
-            market_cap=excluded.market_cap, enterprise_value=excluded.enterprise_value,
-            trailing_pe=excluded.trailing_pe, forward_pe=excluded.forward_pe,
-            peg_ratio=excluded.peg_ratio, price_to_book=excluded.price_to_book,
-            dividend_yield=excluded.dividend_yield, updated_at=excluded.updated_at
-        """, (
-            stock_id, date,
-            info.get('marketCap'),
-            info.get('enterpriseValue'),
-            info.get('trailingPE'),
-            info.get('forwardPE'),
-            info.get('pegRatio'),
-            info.get('priceToBook'),
-            info.get('dividendYield'),
-            datetime.now()
-        ))
+    columns = ', '.join(column for column, _ in FUNDAMENTAL_FIELDS)
+    placeholders = ', '.join(f":{column}" for column, _ in FUNDAMENTAL_FIELDS)
+    unchanged = ' AND '.join(f"{column} IS :{column}" for column, _ in FUNDAMENTAL_FIELDS)
+    updates = ', '.join(f"{column}=excluded.{column}" for column, _ in FUNDAMENTAL_FIELDS)
+    params = {column: info.get(key) for column, key in FUNDAMENTAL_FIELDS}
+    params.update(stock_id=stock_id, date=sqlite_date(date), updated_at=sqlite_now())
+    cursor = conn.execute(f"""
+        INSERT INTO Fundamentals (stock_id, date, {columns}, updated_at)
+        SELECT :stock_id, :date, {placeholders}, :updated_at
+        WHERE NOT EXISTS (
+            SELECT 1 FROM (
+                SELECT {columns} FROM Fundamentals
+                WHERE stock_id = :stock_id AND date <= :date
+                ORDER BY date DESC LIMIT 1
+            )
+            WHERE {unchanged}
+        )
+        ON CONFLICT(stock_id, date) DO UPDATE SET {updates}, updated_at=excluded.updated_at
+    """, params)
+    return cursor.rowcount > 0
+
 
 # Function to insert financial data
 def insert_financials(conn, stock_id, date, statement_type, data):
+    insert_statements(conn, stock_id, [(statement_type, data.to_frame(date))])
+
+
+# Function to insert every column of the statement frames; returns the number of rows written
+def insert_statements(conn, stock_id, statements):
+    updated_at = sqlite_now()
+    rows = [(stock_id, sqlite_date(pd.to_datetime(date)), statement_type, frame[date].to_json(), updated_at)
+            for statement_type, frame in statements for date in frame.columns]
+    conn.executemany("""
+        INSERT INTO Financials (
+            stock_id, date, statement_type, data, updated_at
+        ) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(stock_id, date, statement_type) DO UPDATE SET
+        data=excluded.data, updated_at=excluded.updated_at
+    """, rows)
+    return len(rows)
+
+
+# Function to write one ticker's payload (as fetch_ticker_payload returns it) in a single transaction;
+# a failure leaves nothing of the ticker behind. Returns the number of rows written.
+def store_ticker_payload(conn, payload):
     with conn:
-        conn.execute("""
-            INSERT INTO Financials (
-                stock_id, date, statement_type, data, updated_at
-            ) VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(stock_id, date, statement_type) DO UPDATE SET
-            data=excluded.data, updated_at=excluded.updated_at
-        """, (stock_id, date, statement_type, data.to_json(), datetime.now()))
+        stock_id = insert_stock(conn, payload['ticker'])
+        rows = insert_stock_data(conn, stock_id, payload['data'])
+        rows += insert_fundamentals(conn, stock_id, date.today(), payload['info'])
+        rows += insert_statements(conn, stock_id, payload['statements'])
+        conn.execute("UPDATE Stock SET loaded_at = ?, updated_at = ? WHERE id = ?", (sqlite_now(), sqlite_now(), stock_id))
+    return rows
+
+
+# Function to fetch everything stored for one ticker; start=None fetches the whole history
+def fetch_ticker_payload(yf, ticker, start=None):
+    stock = yf.Ticker(ticker + '.NS')
+    data = stock.history(period="max") if start is None else stock.history(start=start)
+    return {
+        'ticker': ticker,
+        'data': data,
+        'info': stock.info,
+        'statements': [("balance_sheet", stock.balance_sheet),
+                       ("income_statement", stock.financials),
+                       ("cash_flow", stock.cashflow)],
+    }
+
+
+# Function to read, per ticker, when it was last loaded and its last stored session
+def read_load_state(conn):
+    rows = conn.execute("""
+        SELECT s.ticker, s.loaded_at, (SELECT MAX(date) FROM StockData WHERE stock_id = s.id)
+        FROM Stock s
+    """)
+    return {ticker: (loaded_at, last_date) for ticker, loaded_at, last_date in rows}
+
+
+# Function to read the latest fundamentals row of every stock, in the layout dailydatacruncher publishes
+def read_latest_fundamentals(conn):
+    return conn.execute("""
+        SELECT f.stock_id, f.date, f.market_cap, f.trailing_pe, f.price_to_book
+        FROM Fundamentals f
+        JOIN (SELECT stock_id, MAX(date) AS date FROM Fundamentals GROUP BY stock_id) latest
+        ON latest.stock_id = f.stock_id AND latest.date = f.date
+        ORDER BY f.stock_id
+    """).fetchall()
+
+
+# Function to compute the FinancialSummary figures straight from the SQLite file, with the cruncher's
+# own aggregation (its SQLite dialect) and summary layout; returns (summary, latest fundamentals rows)
+def read_financial_summary(conn):
+    summary = build_summary(aggregate_metrics_sql(conn, 'sqlite'))
+    return summary, read_latest_fundamentals(conn)
+
 
 # Main function to retrieve data and store it in the database
-def main(tickers):
-    conn = sqlite3.connect('stocks.db')
+def main(tickers, path=SQLITE_PATH):
+    import yfinance as yf
+
+    conn = connect_db(path)
     create_db_schema(conn)
+    state = read_load_state(conn)
+    fresh_after = (datetime.now() - timedelta(hours=SQLITE_REFRESH_HOURS)).isoformat(sep=' ')
 
+    started = time.perf_counter()
+    loaded, skipped, failed, rows = 0, 0, 0, 0
     for ticker in tickers:
-        print(f"Processing {ticker}...")
-        stock_id = insert_stock(conn, ticker)
-        stock = yf.Ticker(ticker + '.NS')
-
-        # Fetch and insert historical stock data
-        data = stock.history(period="max")
-        print(data.columns)  # Print columns to debug the names
-        insert_stock_data(conn, stock_id, data)
-
-        # Fetch and insert daily fundamental data
-        info = stock.info
-        for date in data.index:
-            insert_fundamentals(conn, stock_id, date.to_pydatetime(), info)
-
-        # Fetch and insert financial data
-        for statement_type, statement_data in [("balance_sheet", stock.balance_sheet),
-                                               ("income_statement", stock.financials),
-                                               ("cash_flow", stock.cashflow)]:
-            for date in statement_data.columns:
-                insert_financials(conn, stock_id, pd.to_datetime(date).to_pydatetime(), statement_type, statement_data[date])
+        loaded_at, last_date = state.get(ticker, (None, None))
+        if loaded_at is not None and loaded_at >= fresh_after:
+            skipped += 1
+            continue
+        start = None
+        if loaded_at is not None and last_date is not None:
+            start = (date.fromisoformat(last_date[:10]) - timedelta(days=SQLITE_HISTORY_OVERLAP_DAYS)).isoformat()
+        print(f"Processing {ticker} from {start or 'listing'}...")
+        try:
+            rows += store_ticker_payload(conn, fetch_ticker_payload(yf, ticker, start))
+            loaded += 1
+        except Exception as e:
+            print(f"Error processing {ticker}: {e}")
+            failed += 1
 
+    conn.execute("PRAGMA optimize")
     conn.close()
-    print("Data retrieval and storage complete.")
+    print(f"Data retrieval and storage complete: {loaded} tickers loaded ({rows} rows), {skipped} already "
+          f"up to date, {failed} failed in {time.perf_counter() - started:.0f}s")
 
 if __name__ == "__main__":
-    # List of stock tickers to retrieve data for
-    # tickers = ['TCS.NS', 'INFY.NS', 'NRL.NS']
+    # python yfinancedatafetcher.py summary prints the cruncher's figures from the local database
+    if sys.argv[1:] == ['summary']:
+        conn = connect_db()
+        summary, latest_fundamentals = read_financial_summary(conn)
+        conn.close()
+        for name, value in summary.items():
+            print(f"{name}: {value}")
+        print(f"Latest fundamentals for {len(latest_fundamentals)} stocks")
+        sys.exit(0)
 
-    excel_file_path = './MCAP28032024.xlsx'
-    # Load the symbols from the Excel file
-    df = pd.read_excel(excel_file_path)
-    symbols = df['Symbol'].tolist()
-    # random.shuffle(symbols)
+    from symboluniverse import load_symbols
 
-    main(symbols)
+    main(load_symbols())